@@ -28,7 +28,10 @@ Main import stuff
 """
 
 #import mrf.ascii
+import sys
+import re
 from collections import namedtuple
+from array import array
 
 
 CHAR_H_RATIO = 2.0
@@ -41,11 +44,22 @@ Text = namedtuple("Text","pos z text colour alpha size")
 QuadCurve = namedtuple("QuadCurve","a b c z stroke salpha w stype")
 Polygon = namedtuple("Polygon","points z stroke salpha w stype fill falpha")
 
-STROKE_SOLID = object()
-STROKE_DASHED = object()
+StartKey = namedtuple("StartKey","chars offset meta nometa")
+TopEdge = namedtuple("TopEdge","left right dashed side slant")
 
-C_FOREGROUND = object()
-C_BACKGROUND = object()
+class Sentinel(object):
+    """A unique marker value. Pickles by name, so that it is still the same
+    object when passed between processes"""
+    def __init__(self,name):
+        self.name = name
+    def __reduce__(self):
+        return self.name
+
+STROKE_SOLID = Sentinel("STROKE_SOLID")
+STROKE_DASHED = Sentinel("STROKE_DASHED")
+
+C_FOREGROUND = Sentinel("C_FOREGROUND")
+C_BACKGROUND = Sentinel("C_BACKGROUND")
 
 M_NONE = 0
 M_OCCUPIED = (1<<0)
@@ -82,6 +96,329 @@ class NonChar(object):
 START_OF_INPUT = NonChar()
 END_OF_INPUT = NonChar()
 
+# results of Pattern.step, other than meta
+REJECTED = Sentinel("REJECTED")
+FINISHED = Sentinel("FINISHED")
+
+def char_mask(chars):
+    """Returns a bitmask with a bit set for each of the given characters. 
+    ASCII characters have a bit each, all others share a single bit and 
+    anything other than a character is ignored"""
+    mask = 0
+    for c in chars:
+        if isinstance(c,basestring):
+            mask |= 1 << min(ord(c),128)
+    return mask
+    
+
+class MetaPlane(object):
+    """Dense store of meta flags for a diagram, one unsigned 32-bit word per 
+    cell. Covers columns 0 to width and rows -1 to height, so that the start 
+    and end of input have cells of their own, plus a border of one cell all 
+    round. Positions outside of this read as M_NONE. If given, alloc is called 
+    with a number of words to provide zeroed storage for them, such as a 
+    shared memory array"""
+    
+    def __init__(self,width,height,alloc=None):
+        self.width = width
+        self.height = height
+        self._stride = width+3
+        if alloc is None:
+            self._words = array("I",[M_NONE])*(self._stride*(height+4))
+        else:
+            self._words = alloc(self._stride*(height+4))
+        
+    def _index(self,x,y):
+        if x < -1 or x > self.width+1 or y < -2 or y > self.height+1:
+            return None
+        return (y+2)*self._stride + x+1
+        
+    def get(self,x,y):
+        i = self._index(x,y)
+        return self._words[i] if i is not None else M_NONE
+        
+    def add(self,x,y,meta):
+        i = self._index(x,y)
+        if i is None: 
+            raise IndexError("Position %s outside of plane" % ((x,y),))
+        self._words[i] |= meta
+        
+    def merge(self,footprint):
+        """ORs in the meta of a dict of (x,y) positions to meta flags"""
+        for (x,y),meta in footprint.items():
+            self.add(x,y,meta)
+            
+    def tostring(self):
+        """Returns the meta of the whole plane as a string of bytes"""
+        return array("I",self._words).tostring()
+        
+    def fromstring(self,data):
+        """Replaces the meta of the whole plane with that from tostring"""
+        words = array("I")
+        words.fromstring(data)
+        if len(words) != len(self._words):
+            raise ValueError("Meta for a plane of a different size")
+        self._words = words
+            
+    def copy(self):
+        c = MetaPlane.__new__(MetaPlane)
+        c.width,c.height,c._stride = self.width,self.height,self._stride
+        c._words = self._words[:]
+        return c
+    
+
+def find_all(line,char):
+    """Returns the indices at which the character occurs in the row, which 
+    may be None or a list of START_OF_INPUT or END_OF_INPUT"""
+    found = []
+    if isinstance(line,basestring):
+        i = line.find(char)
+        while i != -1:
+            found.append(i)
+            i = line.find(char,i+1)
+    return found
+
+
+class Grid(object):
+    """Immutable random-access view of the characters of a diagram, built 
+    once per diagram. Each text row ends with its newline character, row -1 
+    holds START_OF_INPUT and row 'height' holds END_OF_INPUT, in the same way 
+    as the characters fed to patterns. Positions that don't exist read as 
+    None. The meta of completed matches is held in the 'meta' plane. 'mask'
+    and 'rowmasks' (indexed by row+1) give the char_mask of the characters 
+    present in the whole diagram and in each row. The runs of characters 
+    along rows and down columns, and the positions of characters in rows, 
+    are tabled for the whole of a row or column the first time they are 
+    asked for. Runs down diagonals are tabled for the cells walked to find 
+    them"""
+    
+    def __init__(self,text):
+        self.lines = []
+        self.lines.append( [START_OF_INPUT] )
+        self.lines.extend( [l+"\n" for l in text.splitlines()] )
+        self.lines.append( [END_OF_INPUT] )
+        self.height = len(self.lines)-2
+        self.width = max([len(x) for x in self.lines])-1
+        self.meta = MetaPlane(self.width,self.height)
+        self.rowmasks = [char_mask(set(l)) for l in self.lines]
+        self.mask = reduce(lambda a,b: a|b, self.rowmasks)
+        self._hruns = {}
+        self._vruns = {}
+        self._druns = {}
+        self._positions = {}
+        
+    def char_at(self,x,y):
+        if y < -1 or y > self.height or x < 0: 
+            return None
+        line = self.lines[y+1]
+        return line[x] if x < len(line) else None
+        
+    def meta_at(self,x,y):
+        return self.meta.get(x,y)
+        
+    def line(self,y):
+        """Returns the row as held: its text with the newline, or a list of 
+        START_OF_INPUT or END_OF_INPUT. None if there is no such row"""
+        if y < -1 or y > self.height:
+            return None
+        return self.lines[y+1]
+        
+    def row(self,y,start=0,end=None):
+        """Returns the characters of the row between the given columns"""
+        if y < -1 or y > self.height:
+            return ()
+        return tuple(self.lines[y+1][start:end])
+        
+    def column(self,x,start=-1,end=None):
+        """Returns the characters of the column between the given rows, with
+        None where a row is too short to reach the column"""
+        if end is None: end = self.height+1
+        return tuple([self.char_at(x,y) for y in range(max(start,-1),
+                min(end,self.height+1))])
+                
+    def hrun(self,x,y,unit):
+        """Returns the number of repeats of the unit string along the row from
+        (x,y), such as "-" for a line or "- " for a dashed one"""
+        runs = self._hruns.get((y,unit))
+        if runs is None:
+            line = self.line(y)
+            line = line if isinstance(line,basestring) else ""
+            runs = self._hruns[(y,unit)] = [0]*len(line)
+            for m in re.finditer("(?:%s)+" % re.escape(unit),line):
+                for i in range(m.start(),m.end(),len(unit)):
+                    runs[i] = (m.end()-i)//len(unit)
+        return runs[x] if 0 <= x < len(runs) else 0
+        
+    def vrun(self,x,y,chars):
+        """Returns the number of cells down the column from (x,y) holding one
+        of the given characters"""
+        runs = self._vruns.get((x,chars))
+        if runs is None:
+            runs = self._vruns[(x,chars)] = [0]*(self.height+3)
+            for j in range(self.height,-2,-1):
+                c = self.char_at(x,j)
+                if isinstance(c,basestring) and c in chars:
+                    runs[j+1] = runs[j+2]+1
+        return runs[y+1] if -1 <= y <= self.height else 0
+        
+    def drun(self,x,y,dx,unit):
+        """Returns the number of repeats of the unit string down the diagonal
+        from (x,y), each a row below and dx columns along from the last, such
+        as "/" with dx -1 for a line or ".'" with dx -2 for a diamond's slope"""
+        runs = self._druns.setdefault((dx,unit),{})
+        walked = []
+        while (x,y) not in runs:
+            line = self.line(y)
+            if not isinstance(line,basestring) or x < 0 or not line.startswith(unit,x):
+                runs[(x,y)] = 0
+                break
+            walked.append((x,y))
+            x,y = x+dx,y+1
+        n = runs[(x,y)]
+        for pos in reversed(walked):
+            n += 1
+            runs[pos] = n
+        return n
+        
+    def positions(self,y,char):
+        """Returns the columns of the row holding the character, in order"""
+        found = self._positions.get((y,char))
+        if found is None:
+            found = self._positions[(y,char)] = find_all(self.line(y),char)
+        return found
+        
+
+class RowMetaPlane(object):
+    """Meta flags held a row at a time, for diagrams which are read as they 
+    are matched. Rows grow as meta is added to them and can be dropped once 
+    no longer needed. Positions without meta read as M_NONE"""
+    
+    def __init__(self):
+        self._rows = {}
+        
+    def get(self,x,y):
+        row = self._rows.get(y)
+        if row is None or x < -1 or x+1 >= len(row):
+            return M_NONE
+        return row[x+1]
+        
+    def add(self,x,y,meta):
+        if x < -1 or y < -2:
+            raise IndexError("Position %s outside of plane" % ((x,y),))
+        row = self._rows.get(y)
+        if row is None:
+            row = self._rows[y] = array("I")
+        if x+1 >= len(row):
+            row.extend([M_NONE]*(x+2-len(row)))
+        row[x+1] |= meta
+        
+    def merge(self,footprint):
+        """ORs in the meta of a dict of (x,y) positions to meta flags"""
+        for (x,y),meta in footprint.items():
+            self.add(x,y,meta)
+            
+    def drop(self,y):
+        """Discards the meta of the given row"""
+        self._rows.pop(y,None)
+        
+        
+class StreamGrid(object):
+    """Random-access view of the characters of a diagram which is read from
+    an iterable of lines as positions are asked for, in the manner of Grid. 
+    'onrow' is called with the row number and characters of each row as it 
+    is read, including the start and end of input rows. Rows before 'first' 
+    have been dropped and read as None. 'height' is None until the end of 
+    input has been read, and 'width' is the greatest so far"""
+
+    def __init__(self,lines,onrow=lambda y,line: None):
+        self._source = iter(lines)
+        self._pending = []
+        self._rows = {}
+        self.onrow = onrow
+        self.first = -1
+        self.last = -2
+        self.height = None
+        self.width = 0
+        self.meta = RowMetaPlane()
+        
+    def _read_line(self):
+        while len(self._pending) == 0:
+            try:
+                chunk = self._source.next()
+            except StopIteration:
+                return None
+            # an empty chunk is still a row - splitlines would drop it
+            self._pending = (chunk.splitlines() or [""])[::-1]
+        return self._pending.pop()
+        
+    def load(self,y):
+        """Reads rows until the given row has been read or input runs out"""
+        while self.last < y and self.height is None:
+            if self.last == -2:
+                line = [START_OF_INPUT]
+            else:
+                text = self._read_line()
+                if text is None:
+                    line = [END_OF_INPUT]
+                    self.height = self.last+1
+                else:
+                    line = text+"\n"
+                    self.width = max(self.width,len(text))
+            self.last += 1
+            self._rows[self.last] = line
+            self.onrow(self.last,line)
+        
+    def drop(self,y):
+        """Discards the rows before the given row"""
+        for r in range(self.first,min(y,self.last+1)):
+            self._rows.pop(r,None)
+            self.meta.drop(r)
+        self.first = max(self.first,y)
+        
+    def char_at(self,x,y):
+        if y > self.last:
+            self.load(y)
+        line = self._rows.get(y)
+        if line is None or x < 0 or x >= len(line):
+            return None
+        return line[x]
+        
+    def meta_at(self,x,y):
+        return self.meta.get(x,y)
+        
+    def line(self,y):
+        if y > self.last:
+            self.load(y)
+        return self._rows.get(y)
+        
+    def hrun(self,x,y,unit):
+        line = self.line(y)
+        if not isinstance(line,basestring) or x < 0:
+            return 0
+        m = re.compile("(?:%s)*" % re.escape(unit)).match(line,x)
+        return (m.end()-x)//len(unit)
+        
+    def vrun(self,x,y,chars):
+        n = 0
+        while True:
+            c = self.char_at(x,y+n)
+            if not isinstance(c,basestring) or not c in chars:
+                return n
+            n += 1
+            
+    def drun(self,x,y,dx,unit):
+        n = 0
+        while True:
+            line = self.line(y+n)
+            if( not isinstance(line,basestring) or x+n*dx < 0 
+                    or not line.startswith(unit,x+n*dx) ):
+                return n
+            n += 1
+            
+    def positions(self,y,char):
+        return find_all(self.line(y),char)
+    
+
 class PatternRejected(Exception): pass
 class PatternStateError(Exception): pass
 class NoSuchPosition(Exception): pass
@@ -93,6 +430,40 @@ class Pattern(object):
     gen = None
     is_finished = False
     curr = None
+    waitpos = None
+    grid = None
+    reach = None
+    # if set, the traceback of an exception which rejects the match is kept
+    # in 'rejection', for profiling
+    keep_rejection = False
+    rejection = None
+    
+    @classmethod
+    def needs(cls):
+        """Returns the characters which appear in every match of the pattern,
+        so that the pattern need not be tried against a diagram lacking any of 
+        them. Returns None if nothing is required"""
+        return None
+    
+    @classmethod
+    def start_key(cls):
+        """Describes the cells at which a match can possibly begin, so that the 
+        engine need not create a matcher anywhere else. Returns a StartKey whose 
+        'offset' is the number of cells, in scan order, from the first cell to 
+        a key cell holding one of 'chars', with all of the 'meta' flags and none 
+        of the 'nometa' flags set. A 'chars' of None allows any character. 
+        Returns None if a match may begin at any cell."""
+        return None
+        
+    @classmethod
+    def top_edges(cls):
+        """For box patterns, describes the top edges a match can begin with, 
+        so that the engine need only try the pattern where one is found. 
+        Returns a list of TopEdge: a run of "-" from the 'left' corner 
+        character to the 'right', or of "- " pairs if 'dashed', with one of
+        the 'side' characters in the row below, 'slant' columns along from 
+        the left corner. Returns None if the pattern isn't found this way."""
+        return None
     
     def __init__(self):
         self.curr = None
@@ -102,7 +473,7 @@ class Pattern(object):
         
     def matcher(self):
         yield
-        self.reject()
+        yield REJECTED
         
     def reject(self):
         raise PatternRejected()
@@ -116,17 +487,45 @@ class Pattern(object):
         else:
             return meta        
 
+    def expect_or_reject(self,chars,meta=M_OCCUPIED):
+        """As expect, but returns REJECTED rather than raising PatternRejected. 
+        The result is intended to be yielded by the matcher"""
+        if self.occupied() or not self.is_in(self.curr.char,chars):
+            return REJECTED
+        else:
+            return meta
+
     def offset(self,x,y,pos=None):    
         if pos is None: pos = (self.curr.col,self.curr.row)
         return (pos[0]+x,pos[1]+y)
 
     def await_pos(self,pos):
+        """Yields the position to be waited for until it is the current one. The 
+        matcher should pass these on, in place of meta, so that it is not resumed 
+        until the position is reached or is found not to exist"""
         while (self.curr.col,self.curr.row) != pos:
             if( self.curr.row > pos[1] 
                     or (self.curr.row == pos[1] and self.curr.col > pos[0])
                     or self.curr.char == END_OF_INPUT ):
                 raise NoSuchPosition(pos)
-            yield M_NONE
+            yield pos
+            
+    def follow(self,footprint,endpos):
+        """For matchers which find their whole match up front using the grid. 
+        Yields the meta of each (pos,meta) pair in scan order as its position 
+        is reached, waiting in between, and then waits for the position at or 
+        after which the match completes. Cells found unoccupied up front are
+        checked again on arrival, as other matches may have claimed them since"""
+        for pos,meta in footprint:
+            for m in self.await_pos(pos):
+                yield m
+            if meta & M_OCCUPIED and self.occupied():
+                yield REJECTED
+            yield meta
+        try:
+            for m in self.await_pos(endpos):
+                yield m
+        except NoSuchPosition: pass
             
     def is_in(self,c,chars):
         try:
@@ -134,17 +533,56 @@ class Pattern(object):
         except TypeError:
             return False
             
-    def test(self,currentchar):
+    def step(self,currentchar):
+        """Feeds the next character to the matcher without raising exceptions 
+        for the usual outcomes. Returns the meta for the character, REJECTED if
+        the match has failed or FINISHED if the match completed before the 
+        character. Matchers may yield REJECTED and FINISHED themselves, in 
+        place of raising PatternRejected or returning. A matcher may also set 
+        'reach' to a position it must still visit to complete, so that with a 
+        grid available it is rejected as soon as that position is known not 
+        to exist"""
+        #if currentchar.char != "\n":
+        #    self.debug_canvas.set(currentchar.col,currentchar.row,
+        #        currentchar.char if currentchar.char != " " else "*")
+        if self.waitpos is not None:
+            if( (currentchar.row < self.waitpos[1] 
+                    or (currentchar.row == self.waitpos[1] 
+                        and currentchar.col < self.waitpos[0]))
+                    and currentchar.char != END_OF_INPUT ):
+                return M_NONE
+            self.waitpos = None
         try:
-            #if currentchar.char != "\n":
-            #    self.debug_canvas.set(currentchar.col,currentchar.row,
-            #        currentchar.char if currentchar.char != " " else "*")
-            return self.gen.send(currentchar)
+            result = self.gen.send(currentchar)
         except StopIteration:
+            result = FINISHED
+        except (PatternRejected,NoSuchPosition):
+            if self.keep_rejection:
+                self.rejection = sys.exc_info()[2]
+            result = REJECTED
+        if result is FINISHED:
             self.is_finished = True
-            raise
-        except NoSuchPosition as e:
-            raise PatternRejected(e)
+            return result
+        if( self.reach is not None and self.grid is not None
+                and self.grid.char_at(*self.reach) is None ):
+            # match can't complete - its shape runs past the diagram
+            return REJECTED
+        if isinstance(result,tuple):
+            # matcher is waiting for a position
+            self.waitpos = result
+            return M_NONE
+        return result
+            
+    def test(self,currentchar):
+        """Exception-based form of step. Returns the meta for the character, 
+        raises PatternRejected if the match has failed, or StopIteration if the 
+        match completed before the character"""
+        result = self.step(currentchar)
+        if result is REJECTED:
+            raise PatternRejected()
+        if result is FINISHED:
+            raise StopIteration()
+        return result
         
     def render(self):
         if not self.is_finished: 
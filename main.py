@@ -73,9 +73,23 @@ import xml.dom
 import xml.dom.minidom
 import math
 import re
+import heapq
+import time
+import bisect
+import os
+import inspect
+import gc
+import types
+import hashlib
+import tempfile
+import zlib
+import cPickle
+import multiprocessing
+import Queue
 import cairo
-from collections import defaultdict
 from collections import namedtuple
+from collections import OrderedDict
+from collections import deque
 
 import core
 import patterns
@@ -402,43 +416,50 @@ class SvgOutput(object):
         
     
 class MatchLookup(object):
+    """Set of in-progress matches, kept in the order they were added, along with
+    the meta each has reported and an index of the positions they occupy"""
 
-    _matches = None
+    _live = None
     _occupants = None
     _match_meta = None
     
     def __init__(self):
-        self._matches = []
-        self._occupants = defaultdict(list)
-        self._match_meta = defaultdict(dict)
+        self._live = OrderedDict()
+        self._occupants = {}
+        self._match_meta = {}
+        
+    def __len__(self):
+        return len(self._live)
+        
+    def __contains__(self,match):
+        return match in self._live
 
     def get_all_matches(self):
-        return list(self._matches)
+        return self._live.keys()
         
     def get_occupants_at(self,pos):
-        return list(self._occupants[pos])
+        return list(self._occupants.get(pos,()))
         
     def get_meta_for(self,match):
-        return dict(self._match_meta[match])
+        return dict(self._match_meta.get(match,{}))
         
     def add_match(self,match):
-        self._matches.append(match)
+        self._live[match] = True
         
     def add_meta(self,match,pos,meta):
+        if meta == core.M_NONE: return
         if meta & core.M_OCCUPIED:
-            self._occupants[pos].append(match)
-        self._match_meta[match][pos] = meta
+            self._occupants.setdefault(pos,set()).add(match)
+        self._match_meta.setdefault(match,{})[pos] = meta
         
     def remove_match(self,match):
-        try: 
-            self._matches.remove(match)
-        except ValueError: pass
-        for pos,meta in self._match_meta[match].items():
+        self._live.pop(match,None)
+        for pos,meta in self._match_meta.pop(match,{}).items():
             if meta & core.M_OCCUPIED:
-                try:
-                    self._occupants[pos].remove(match)
-                except ValueError: pass
-        del(self._match_meta[match])
+                occs = self._occupants.get(pos)
+                if occs is None: continue
+                occs.discard(match)
+                if len(occs) == 0: del(self._occupants[pos])
         
     def remove_cooccupants(self,match):
         for pos,meta in self.get_meta_for(match).items():
@@ -447,50 +468,2294 @@ class MatchLookup(object):
                     self.remove_match(m)
         
         
+# the number of blank rows which separate bands of a diagram that can be 
+# matched independently
+REGION_GAP = 2
+# the number of groups of bands to be matched for each process
+REGION_GROUPS = 4
+# the number of rows either side of the rows matched again by update_diagram 
+# which are matched with them, to check that they are unaffected
+UPDATE_CONTEXT = 3
+
 CurrentChar = namedtuple("CurrentChar","row col char meta")
 
-Diagram = namedtuple("Diagram","size content")
+# exceeded names the budget which a diagram went over, if it was matched with 
+# only the fallback patterns as a result
+Diagram = namedtuple("Diagram","size content exceeded")
+Diagram.__new__.__defaults__ = (None,)
+
+# state kept between calls to update_diagram: the rows of the text, with their
+# newlines, and for each pattern class the complete matches in order, each as 
+# the first and last rows covered by its content and the content itself
+ParseState = namedtuple("ParseState","patterns maxlive lines matches")
+
+Delta = namedtuple("Delta","removed added")
+
+# the work done by the pass for a pattern class: seconds spent, matches 
+# created, steps of matches, matches rejected and completed, the most 
+# matches in progress at once and the cells occupied by complete matches
+PassStats = namedtuple("PassStats",
+    "pattern seconds created resumes rejected completed peaklive claimed")
+
+
+def can_match(pclass,grid):
+    """Returns False if the diagram lacks characters that every match of the 
+    given pattern class must contain, in which case its pass can be skipped"""
+    needs = pclass.needs() if hasattr(pclass,"needs") else None
+    if needs is not None:
+        needmask = core.char_mask(needs)
+        if grid.mask & needmask != needmask:
+            return False
+    key = pclass.start_key() if hasattr(pclass,"start_key") else None
+    if key is not None and key.chars is not None:
+        if not grid.mask & core.char_mask(key.chars):
+            return False
+    return True
+    
+
+def find_start_cells(pclass,grid,cells,rowstarts):
+    """Returns the sorted indices of those cells at which a match of the given
+    pattern class can begin, according to the characters of the class's start
+    key. The key's meta is left to be checked as each cell is reached. Rows 
+    without any of the key characters are skipped over"""
+    key = pclass.start_key() if hasattr(pclass,"start_key") else None
+    if key is None or key.chars is None:
+        return range(len(cells))
+    keymask = core.char_mask(key.chars)
+    starts = []
+    for j,line in enumerate(grid.lines):
+        if not grid.rowmasks[j] & keymask: continue
+        starts.extend(find_row_start_cells(key,line,rowstarts[j]))
+    return starts
+    
+    
+def find_row_start_cells(key,line,rowstart):
+    """Returns the sorted indices of the cells at which matches can begin 
+    according to the key, for those key characters found in a single row,
+    given the index of its first cell"""
+    found = []
+    for c in set(key.chars):
+        i = line.find(c)
+        while i != -1:
+            found.append(rowstart+i)
+            i = line.find(c,i+1)
+    return [k-key.offset for k in sorted(found) if k >= key.offset]
+    
+    
+def find_cell_at(pos,rowstarts):
+    """Returns the index of the first cell at or after the given (col,row) 
+    position in scan order, where rowstarts holds the index of the first cell
+    of each line, the start-of-input line included"""
+    col,row = pos
+    if row < -1:
+        return 0
+    if row+1 >= len(rowstarts)-1:
+        return rowstarts[-1]-1
+    rowlen = rowstarts[row+2]-rowstarts[row+1]
+    return min(rowstarts[row+1] + max(0,min(col,rowlen)), rowstarts[-1]-1)
+
 
+def step_with_test(match,currentchar):
+    """Feeds the current character to a match which only offers the 
+    exception-based test method, giving the result in the form of 
+    core.Pattern.step"""
+    try:
+        return match.test(currentchar)
+    except core.PatternRejected:
+        return core.REJECTED
+    except StopIteration:
+        return core.FINISHED
 
-def process_diagram(text,patternlist,proglsnr=lambda x: None):
 
-    lines = []
-    lines.append( [core.START_OF_INPUT] )
-    lines.extend( [l+"\n" for l in text.splitlines()] )
-    lines.append( [core.END_OF_INPUT] )
-    height = len(lines)-2
-    width = max([len(x) for x in lines])-1
+class LiveCount(object):
+    """Count of the matches in progress across the passes run together, and 
+    the limit on them, or None for no limit"""
+    
+    def __init__(self,limit=None):
+        self.limit = limit
+        self.live = 0
+        
+        
+def share_live(passes):
+    """Has the passes keep one count of their matches in progress, within the
+    smallest of the limits they were made with"""
+    limits = [p.maxlive for p in passes if p.maxlive is not None]
+    livecount = LiveCount(min(limits) if len(limits) > 0 else None)
+    for p in passes:
+        p.share_live(livecount)
+
 
-    complete_matches = []
-    complete_meta = {}
-    for pnum,pclass in enumerate(patternlist):
-        proglsnr(float(pnum)/len(patternlist))
-        ongoing = MatchLookup()    
-        for j,line in enumerate(lines):
-            j -= 1
-            for i,char in enumerate(line):    
-                meta = complete_meta.get((j,i),core.M_NONE)
-                newp = pclass()
+class PatternPass(object):
+    """Matches a single pattern class against the diagram. The pass can be 
+    advanced through the cells a piece at a time, so that passes for several 
+    pattern classes can be run together in a single scan. If starts are 
+    given, the pass begins with those start cells, and more are added with
+    add_starts as the diagram is read, rather than all being found up front.
+    If findcell is given, it is used to find the index of the cell at a 
+    position in place of rowstarts. If maxlive is given, no new matches are 
+    begun while that many are in progress: in this pass alone, or across 
+    the passes given a LiveCount in common by share_live"""
+
+    def __init__(self,pclass,grid,cells,rowstarts,maxlive=None,starts=None,
+            findcell=None):
+        self.pclass = pclass
+        self.grid = grid
+        self.cells = cells
+        self.rowstarts = rowstarts
+        self.findcell = findcell
+        self.maxlive = maxlive
+        # the count of matches in progress that the limit applies to, and the
+        # number of them last added to it by this pass
+        self.livecount = LiveCount(maxlive)
+        self.counted = 0
+        self.complete_matches = []
+        self.scanpos = 0
+        self.watermark = 0
+        self.ongoing = MatchLookup()
+        # counts of the work done, for profiling and budgets
+        self.seconds = 0.0
+        self.created = 0
+        self.resumes = 0
+        self.rejected = 0
+        self.peaklive = 0
+        self.claimed = 0
+        # RejectProfile recording where matches are rejected, if any
+        self.rejects = None
+        # ActivityMap recording the steps of matches at each cell, if any
+        self.activity = None
+        # Budget checked as the pass advances, if any
+        self.budget = None
+        if starts is None and not can_match(pclass,grid):
+            self.scanpos = self.watermark = len(cells)
+            return
+        self.key = pclass.start_key() if hasattr(pclass,"start_key") else None
+        if starts is None:
+            starts = find_start_cells(pclass,grid,cells,rowstarts)
+        self.starts = starts
+        self.nextstart = 0
+        self.step = getattr(pclass,"step",step_with_test)
+        # matches in the order they were started, oldest first
+        self.started = deque()
+        # matches are resumed in the order they were created, at the cell they 
+        # are next interested in
+        self.waiting = []
+        self.nextk = self.starts[0] if len(self.starts) > 0 else len(cells)
+        self.oldest = len(cells)
+        
+    def share_live(self,livecount):
+        """Counts the matches in progress in the given LiveCount from now on"""
+        livecount.live += self.counted
+        self.livecount.live -= self.counted
+        self.livecount = livecount
+        
+    def count_live(self):
+        """Brings the LiveCount up to date with the matches in progress"""
+        live = self.live()
+        self.livecount.live += live - self.counted
+        self.counted = live
+        
+    def at_limit(self):
+        """Returns True if no new matches may be begun, with the matches in 
+        progress at their limit"""
+        if self.livecount.limit is None:
+            return False
+        self.count_live()
+        return self.livecount.live >= self.livecount.limit
+        
+    def find_cell(self,pos):
+        """Returns the index of the first cell at or after the given position"""
+        if self.findcell is not None:
+            return self.findcell(pos)
+        return find_cell_at(pos,self.rowstarts)
+        
+    def add_starts(self,starts):
+        """Adds further start cells, which must follow those already given"""
+        if len(starts) > 0:
+            self.starts.extend(starts)
+            self.nextk = min(self.nextk,starts[0])
+            
+    def drop_starts(self):
+        """Discards the start cells which have already been passed"""
+        del self.starts[:self.nextstart]
+        self.nextstart = 0
+        
+    def update_watermark(self):
+        """Sets the watermark: the index of the first cell whose meta the pass 
+        may yet add to. Meta for the cells before it is final as far as this 
+        pass goes"""
+        started = self.started
+        while len(started) > 0 and not started[0][1] in self.ongoing:
+            started.popleft()
+        self.oldest = started[0][0] if len(started) > 0 else len(self.cells)
+        self.watermark = min(self.scanpos,self.oldest)
+        
+    def advance(self,limit):
+        """Processes the cells before the given index. The meta of earlier 
+        passes must be final for those cells"""
+        if self.scanpos >= limit: 
+            return
+        if self.nextk >= limit:
+            # nothing to do before the limit
+            self.scanpos = limit
+            self.watermark = min(limit,self.oldest)
+            return
+        cells,waiting,ongoing = self.cells,self.waiting,self.ongoing
+        starts,key,step = self.starts,self.key,self.step
+        meta = self.grid.meta
+        nextstart,ncells = self.nextstart,len(cells)
+        resumes,rejected = 0,0
+        rejects,activity,budget = self.rejects,self.activity,self.budget
+        limited = self.livecount.limit is not None
+        tocheck = BUDGET_INTERVAL
+        while True:
+            if budget is not None:
+                tocheck -= 1
+                if tocheck == 0:
+                    self.resumes += resumes
+                    self.rejected += rejected
+                    resumes,rejected = 0,0
+                    budget.check()
+                    tocheck = BUDGET_INTERVAL
+            k = waiting[0][0] if len(waiting) > 0 else ncells
+            startnow = False
+            if nextstart < len(starts) and starts[nextstart] <= k:
+                k = starts[nextstart]
+                if k >= limit: break
+                nextstart += 1
+                # the key's meta can only be checked once earlier passes have
+                # settled it
+                if key is None:
+                    startnow = True
+                else:
+                    kj,ki,kchar = cells[k+key.offset]
+                    keymeta = meta.get(ki,kj)
+                    startnow = (keymeta & key.meta == key.meta 
+                            and not keymeta & key.nometa)
+                if startnow and limited and self.at_limit():
+                    startnow = False
+                if not startnow and (len(waiting) == 0 or waiting[0][0] != k):
+                    continue
+            if k >= limit: break
+            j,i,char = cells[k]
+            cellmeta = meta.get(i,j)
+            due = []
+            while len(waiting) > 0 and waiting[0][0] == k:
+                due.append(heapq.heappop(waiting)[1:])
+            if startnow:
+                newp = self.pclass()
+                if isinstance(newp,core.Pattern): 
+                    newp.grid = self.grid
+                    newp.keep_rejection = rejects is not None
+                due.append((k,newp))
                 ongoing.add_match(newp)
-                for match in ongoing.get_all_matches():
-                    if not match in ongoing.get_all_matches():
-                        continue
-                    try:
-                        matchmeta = match.test(CurrentChar(j,i,char,meta))
-                    except core.PatternRejected:
-                        ongoing.remove_match(match)
-                    except StopIteration:
-                        complete_matches.append(match)
-                        for p,m in ongoing.get_meta_for(match).items():
-                            complete_meta[p] = complete_meta.get(p,core.M_NONE) | m
-                        ongoing.remove_cooccupants(match)
-                        ongoing.remove_match(match)
+                self.started.append((k,newp))
+                self.created += 1
+                self.peaklive = max(self.peaklive,len(ongoing))
+            before = resumes
+            for seq,match in due:
+                if not match in ongoing:
+                    continue
+                resumes += 1
+                matchmeta = step(match,CurrentChar(j,i,char,cellmeta))
+                if matchmeta is core.REJECTED:
+                    rejected += 1
+                    if rejects is not None and isinstance(match,core.Pattern):
+                        rejects.record(self.pclass,match,ongoing.get_meta_for(match))
+                    ongoing.remove_match(match)
+                elif matchmeta is core.FINISHED:
+                    self.complete_matches.append(match)
+                    footprint = ongoing.get_meta_for(match)
+                    meta.merge(footprint)
+                    self.claimed += len([m for m in footprint.values() 
+                            if m & core.M_OCCUPIED])
+                    ongoing.remove_cooccupants(match)
+                    ongoing.remove_match(match)
+                else:
+                    ongoing.add_meta(match,(i,j),matchmeta)
+                    nextk = k+1
+                    waitpos = getattr(match,"waitpos",None)
+                    if waitpos is not None:
+                        nextk = max(nextk,self.find_cell(waitpos))
+                    heapq.heappush(waiting,(nextk,seq,match))
+            if activity is not None and resumes > before:
+                activity.add(self.pclass,i,j,resumes-before)
+        self.nextstart = nextstart
+        self.nextk = k
+        self.resumes += resumes
+        self.rejected += rejected
+        self.scanpos = min(limit,ncells)
+        self.update_watermark()
+        self.count_live()
+
+
+    def timed_advance(self,limit):
+        """Advances as with advance, adding the time taken to seconds"""
+        start = time.time()
+        self.advance(limit)
+        self.seconds += time.time() - start
+        
+    def matches_by_class(self):
+        """Returns the complete matches of each pattern class of the pass"""
+        return [self.complete_matches]
+        
+    def live(self):
+        """Returns the number of matches in progress"""
+        return len(self.ongoing)
+        
+    def stats(self):
+        """Returns the PassStats for the work done so far"""
+        return PassStats(self.pclass.__name__,self.seconds,self.created,
+            self.resumes,self.rejected,len(self.complete_matches),self.peaklive,
+            self.claimed)
+            
+    def stats_by_class(self):
+        """Returns the PassStats for each pattern class of the pass"""
+        return [self.stats()]
+        
+
+class MemberWork(object):
+    """Counts of the work done on one member of a GroupPass, as for the 
+    PassStats of a pass of its own"""
+    
+    def __init__(self):
+        self.seconds = 0.0
+        self.created = 0
+        self.resumes = 0
+        self.rejected = 0
+        self.peaklive = 0
+        self.claimed = 0
+
+
+class GroupPass(PatternPass):
+    """Matches the members of a patterns.PatternGroup together in a single 
+    pass. The matches found, and the meta left, are those that the member 
+    classes would find in passes of their own in the order listed, and the 
+    matches are kept in the same order too: by member, then in the order they
+    complete. Subclasses find matches in find, as far as the limit allows, 
+    and hand them to add_match. Those with matches in progress count them in
+    live, and begin no new matches while at_limit"""
+
+    def __init__(self,pclass,grid,cells,rowstarts,maxlive=None,starts=None,
+            findcell=None):
+        PatternPass.__init__(self,pclass,grid,cells,rowstarts,maxlive,starts=[],
+            findcell=findcell)
+        self.members = [(n,m) for n,m in enumerate(pclass.members)
+                if starts is not None or can_match(m,grid)]
+        # matches found before the cell at which they complete has been 
+        # reached, with their sort keys
+        self.held = []
+        # the sort keys of the complete matches, while they are kept
+        self.order = []
+        # the index of the first cell of each row read so far, from the first
+        # row still needed
+        self.rowindex = {0: 1}
+        self.firstrow = self.lastrow = 0
+        # the work done on each member, and whether the time taken on each 
+        # is added up
+        self.work = dict((n,MemberWork()) for n,m in enumerate(pclass.members))
+        self.timing = False
+        # cells stepped through since the budget was last checked
+        self.spent = 0
+        if len(self.members) == 0:
+            self.scanpos = self.watermark = len(cells)
+        
+    def add_starts(self,starts):
+        pass
+        
+    def drop_starts(self):
+        pass
+        
+    def matches_by_class(self):
+        bymember = [[] for m in self.pclass.members]
+        for (n,k,start),match in zip(self.order,self.complete_matches):
+            bymember[n].append(match)
+        return bymember
+        
+    def row_start(self,y,limit=None):
+        """Returns the index of the first cell of the row, reading the rows 
+        before it as needed. If a limit is given, rows starting after it are 
+        not read, and None is returned if the row is beyond them"""
+        while self.lastrow < y:
+            start = self.rowindex[self.lastrow]
+            if limit is not None and start > limit:
+                return None
+            line = self.grid.line(self.lastrow)
+            self.rowindex[self.lastrow+1] = start + (len(line) if line is not None else 0)
+            self.lastrow += 1
+        return self.rowindex[y]
+        
+    def rows_before(self,y,limit):
+        """Returns True if the cells of the rows up to and including the given
+        one all lie before the limit"""
+        end = self.row_start(y+1,limit)
+        return end is not None and end <= limit
+        
+    def drop_rows(self,y):
+        """Forgets where the rows before the given one start"""
+        for r in range(self.firstrow,y):
+            del self.rowindex[r]
+        self.firstrow = max(self.firstrow,y)
+        
+    def add_match(self,k,n,start,match,footprint):
+        """Adds the meta of a match of member n completing at cell k and holds 
+        the match until that cell is reached"""
+        self.grid.meta.merge(footprint)
+        claimed = len([m for m in footprint.values() if m & core.M_OCCUPIED])
+        self.claimed += claimed
+        self.work[n].claimed += claimed
+        self.held.append((k,n,start,match))
+        
+    def start_match(self,n,x,y):
+        """Counts a match of member n tried from the cell, as a match created 
+        and stepped"""
+        self.created += 1
+        self.resumes += 1
+        self.spend(1)
+        self.work[n].created += 1
+        self.work[n].resumes += 1
+        if self.activity is not None:
+            self.activity.add(self.pclass.members[n],x,y,1)
+            
+    def spend(self,cells):
+        """Counts cells stepped through, checking the budget, if any, every 
+        BUDGET_INTERVAL of them"""
+        if self.budget is None: 
+            return
+        self.spent += cells
+        if self.spent >= BUDGET_INTERVAL:
+            self.spent = 0
+            self.budget.check()
+            
+    def reject(self,n,cells):
+        """Counts a match of member n given up on, having claimed the given 
+        number of cells. It is recorded in the RejectProfile, if any, at the 
+        first line of the member's matcher, as the matcher itself isn't run"""
+        self.rejected += 1
+        self.work[n].rejected += 1
+        if self.rejects is not None:
+            member = self.pclass.members[n]
+            code = member.matcher.im_func.func_code
+            site = (os.path.basename(code.co_filename),code.co_firstlineno,1)
+            self.rejects.add(member,site,cells)
+            
+    def note_live(self,n,live):
+        """Notes the number of matches of member n in progress"""
+        self.work[n].peaklive = max(self.work[n].peaklive,live)
+        self.peaklive = max(self.peaklive,live)
+        
+    def clock(self):
+        """Returns the time if the time taken on each member is being added 
+        up, or otherwise 0"""
+        return time.time() if self.timing else 0.0
+        
+    def timed_advance(self,limit):
+        self.timing = True
+        PatternPass.timed_advance(self,limit)
+        
+    def stats_by_class(self):
+        stats = []
+        for n,matches in enumerate(self.matches_by_class()):
+            w = self.work[n]
+            stats.append(PassStats(self.pclass.members[n].__name__,w.seconds,
+                w.created,w.resumes,w.rejected,len(matches),w.peaklive,w.claimed))
+        return stats
+            
+    def advance(self,limit):
+        if self.scanpos >= limit:
+            return
+        self.find(limit)
+        self.scanpos = min(limit,len(self.cells))
+        self.update_watermark()
+        self.count_live()
+        # matches are only given as complete once their matchers would have been
+        if len(self.complete_matches) == 0:
+            del self.order[:]
+        self.held.sort()
+        due = bisect.bisect_left(self.held,(self.scanpos,))
+        for k,n,start,match in self.held[:due]:
+            self.add_complete((n,k,start),match)
+        del self.held[:due]
+        
+    def add_complete(self,key,match):
+        """Adds a complete match in its place among the others, given its sort
+        key, whose first item is the member number"""
+        i = bisect.bisect(self.order,key)
+        self.order.insert(i,key)
+        self.complete_matches.insert(i,match)
+        
+
+class LineTracerPass(GroupPass):
+    """Pass for a patterns.LineGroupPattern. Rather than trying a matcher at 
+    every cell that might begin a line, runs of line characters are traced a 
+    row at a time, once earlier passes have settled the meta of the row. The
+    tracing follows the matchers of patterns.ShortLinePattern and 
+    patterns.LongLinePattern, so members must match as those do"""
+
+    @classmethod
+    def finds(cls,member):
+        """Returns True if the pass can trace the lines of the pattern class:
+        lines along a row are followed from left to right, and those across
+        rows must be runs of a single character"""
+        if matches_as(member,patterns.ShortLinePattern):
+            return True
+        if not matches_as(member,patterns.LongLinePattern):
+            return False
+        if member.ydir == 0:
+            return member.xdir == 1
+        return( member.ydir == 1 and len(member.startchars) == 1 
+                and member.midchars == member.startchars )
+
+    def __init__(self,pclass,grid,cells,rowstarts,maxlive=None,starts=None,
+            findcell=None):
+        GroupPass.__init__(self,pclass,grid,cells,rowstarts,maxlive,starts,findcell)
+        for n,m in self.members:
+            if not self.finds(m):
+                raise ValueError("%s can't be traced" % m.__name__)
+        # the next row to trace, or None once the end of input is traced
+        self.row = 0 if len(self.members) > 0 else None
+        # for each member, the lines crossing into the next row not yet ended,
+        # by the column they continue at
+        self.runs = dict((n,{}) for n,m in self.members)
+        # for each member, the short lines waiting on the next row for their end
+        self.pending = dict((n,[]) for n,m in self.members)
+        
+    def update_watermark(self):
+        if self.row is None:
+            self.oldest = len(self.cells)
+        else:
+            self.oldest = min([self.row_start(self.row)]
+                    + [r[2] for n,m in self.members for r in self.runs[n].values()]
+                    + [p[2] for n,m in self.members for p in self.pending[n]])
+        self.watermark = min(self.scanpos,self.oldest)
+        
+    def find(self,limit):
+        while self.row is not None and self.rows_before(self.row,limit):
+            line = self.grid.line(self.row)
+            self.trace_row(self.row,line,self.row_start(self.row))
+            self.row = self.row+1 if line[0] is not core.END_OF_INPUT else None
+            self.drop_rows(self.row if self.row is not None else self.lastrow)
+        
+    def trace_row(self,y,line,rowstart):
+        """Finds the lines ending in the given row, adding their meta as the 
+        members' passes would have"""
+        isend = line[0] is core.END_OF_INPUT
+        for n,member in self.members:
+            start = self.clock()
+            if issubclass(member,patterns.ShortLinePattern):
+                self.trace_short(n,member,y,line,rowstart,isend)
+            elif member.ydir == 0:
+                self.trace_long_across(n,member,y,line,rowstart)
+            else:
+                self.trace_long_down(n,member,y,line,rowstart,isend)
+            self.note_live(n,len(self.runs[n])+len(self.pending[n]))
+            self.work[n].seconds += self.clock()-start
+            
+    def live(self):
+        return sum(len(self.runs[n])+len(self.pending[n]) for n,m in self.members)
+        
+    def end_line(self,n,member,start,endpos,qx,y,line,rowstart,frombox,footprint):
+        """Completes a line ending before (qx,y), adding the footprint and the
+        meta of the cell after"""
+        tobox = False
+        if 0 <= qx < len(line):
+            tobox = bool(self.grid.meta.get(qx,y) & member.boxendmeta)
+        if 0 <= qx < len(line) and line[qx] is not core.END_OF_INPUT:
+            footprint[(qx,y)] = footprint.get((qx,y),core.M_NONE) | member.endmeta
+            k = rowstart+qx+1
+        elif qx < 0 or line[0] is core.END_OF_INPUT:
+            k = rowstart
+        else:
+            # past the end of the row, so completing at the start of the next
+            k = rowstart+len(line)
+        match = member()
+        if issubclass(member,patterns.ShortLinePattern):
+            match.pos = endpos
+        else:
+            match.startpos,match.endpos = start[:2],endpos
+        match.frombox,match.tobox = frombox,tobox
+        match.is_finished = True
+        self.add_match(k,n,start[2],match,footprint)
+        
+    def trace_short(self,n,member,y,line,rowstart,isend):
+        """Short lines are single characters, ending in the row for those along
+        it and otherwise in the next"""
+        meta = self.grid.meta
+        for x0,y0,k0,frombox in self.pending[n]:
+            footprint = {(x0,y0): core.M_OCCUPIED|member.startmeta}
+            self.end_line(n,member,(x0,y0,k0),(x0,y0),x0+member.xdir,y,line,
+                    rowstart,frombox,footprint)
+        del self.pending[n][:]
+        if isend:
+            return
+        text = patterns.TEXT_CHARS
+        x = line.find(member.char)
+        while x != -1:
+            if not meta.get(x,y) & core.M_OCCUPIED and not self.at_limit():
+                self.start_match(n,x,y)
+                if x > 0 and line[x-1] in text:
+                    self.reject(n,0)
+                elif line[x+1] in text:
+                    self.reject(n,2)
+                else:
+                    frombox = bool(meta.get(x,y) & member.boxstartmeta)
+                    if member.ydir == 0:
+                        footprint = {(x,y): core.M_OCCUPIED|member.startmeta}
+                        self.end_line(n,member,(x,y,rowstart+x),(x,y),x+member.xdir,
+                                y,line,rowstart,frombox,footprint)
                     else:
-                        ongoing.add_meta(match,(j,i),matchmeta)
+                        self.pending[n].append((x,y,rowstart+x,frombox))
+            x = line.find(member.char,x+1)
+        
+    def trace_long_across(self,n,member,y,line,rowstart):
+        """Lines along the row are followed as the member's matcher would, 
+        each possible start in turn, except those inside a line already found"""
+        meta = self.grid.meta
+        startchars,midchars = member.startchars,member.midchars
+        end = -1
+        x = line.find(startchars[0]) if isinstance(line,basestring) else -1
+        while x != -1:
+            if x > end and not meta.get(x,y) & core.M_OCCUPIED and not self.at_limit():
+                self.start_match(n,x,y)
+                claimed = self.follow_across(startchars,midchars,x,y,line)
+                if claimed is None:
+                    self.reject(n,1)
+                else:
+                    end = claimed[-1]
+                    footprint = dict(((c,y),core.M_OCCUPIED) for c in claimed)
+                    footprint[(x,y)] |= member.startmeta
+                    frombox = bool(meta.get(x,y) & member.boxstartmeta)
+                    self.end_line(n,member,(x,y,rowstart+x),(end,y),end+1,y,line,
+                            rowstart,frombox,footprint)
+            x = line.find(startchars[0],x+1)
+        
+    def follow_across(self,startchars,midchars,x,y,line):
+        """Returns the columns of the line along the row from x, or None if 
+        there isn't one"""
+        meta = self.grid.meta
+        def free(c,char):
+            return c < len(line) and line[c] == char and not meta.get(c,y) & core.M_OCCUPIED
+        claimed = [x]
+        for char in startchars[1:]:
+            if not free(claimed[-1]+1,char):
+                return None
+            claimed.append(claimed[-1]+1)
+        while True:
+            self.spend(len(midchars))
+            for i,char in enumerate(midchars):
+                if not free(claimed[-1]+1,char):
+                    if i == 0 and len(claimed) >= 2:
+                        return claimed
+                    return None
+                claimed.append(claimed[-1]+1)
+                
+    def trace_long_down(self,n,member,y,line,rowstart,isend):
+        """Lines crossing rows are carried from one row to the next, and end at
+        the first cell which doesn't continue them"""
+        meta = self.grid.meta
+        xdir,ydir = member.xdir,member.ydir
+        char = member.startchars[0]
+        runs,nextruns = self.runs[n],{}
+        x = line.find(char) if not isend else -1
+        while x != -1:
+            if not meta.get(x,y) & core.M_OCCUPIED:
+                run = runs.pop(x,None)
+                if run is None and not self.at_limit():
+                    self.start_match(n,x,y)
+                    run = [x,y,rowstart+x,bool(meta.get(x,y) & member.boxstartmeta),0]
+                if run is not None:
+                    run[4] += 1
+                    nextruns[x+xdir] = run
+            x = line.find(char,x+1)
+        for qx,run in runs.items():
+            sx,sy,sk,frombox,length = run
+            if length < 2:
+                self.reject(n,length)
+                continue
+            footprint = dict(((sx+t*xdir,sy+t*ydir),core.M_OCCUPIED) 
+                    for t in range(length))
+            footprint[(sx,sy)] |= member.startmeta
+            self.end_line(n,member,(sx,sy,sk),(qx-xdir,y-ydir),qx,y,line,rowstart,
+                    frombox,footprint)
+        self.runs[n] = nextruns
 
-    proglsnr(1.0)            
-    content = sum([m.render() for m in complete_matches],[])
 
-    return Diagram((width,height),content)
+class ConnectorPass(GroupPass):
+    """Pass for a patterns.ConnectorGroupPattern. The members differ only in 
+    their characters, direction, flipping and meta masks, and these are taken 
+    as a table by a single matching routine following the matcher of 
+    patterns.ConnectorPattern, rather than a matcher being tried at each of 
+    their start cells. Each member finds its connectors a row at a time, once
+    earlier passes, and the members before it, have settled the meta of the 
+    rows they reach"""
+
+    @classmethod
+    def finds(cls,member):
+        """Returns True if the pass can find the pattern class's connectors"""
+        return matches_as(member,patterns.ConnectorPattern)
+
+    def __init__(self,pclass,grid,cells,rowstarts,maxlive=None,starts=None,
+            findcell=None):
+        GroupPass.__init__(self,pclass,grid,cells,rowstarts,maxlive,starts,findcell)
+        self.table = []
+        for n,m in self.members:
+            if not self.finds(m):
+                raise ValueError("%s isn't a connector" % m.__name__)
+            key = m.start_key()
+            # the rows after the start that the connector and the cell after
+            # it reach into
+            reach = len(m.chars)*m.ydir
+            self.table.append((n,m,key.chars,key.meta,reach))
+        # for each member, the next row to find connectors starting in, or 
+        # None once the end of input is reached
+        self.rows = dict((n,0) for n,m in self.members)
+        
+    def update_watermark(self):
+        rows = [y for y in self.rows.values() if y is not None]
+        self.oldest = self.row_start(min(rows)) if len(rows) > 0 else len(self.cells)
+        self.watermark = min(self.scanpos,self.oldest)
+        
+    def find(self,limit):
+        # the row before which the members so far have found their connectors
+        bound = None
+        for n,m,chars,keymeta,reach in self.table:
+            start = self.clock()
+            y = self.rows[n]
+            while y is not None:
+                if bound is not None and y+reach >= bound: break
+                if not self.rows_before(y+reach,limit): break
+                line = self.grid.line(y)
+                if line[0] is core.END_OF_INPUT:
+                    y = None
+                else:
+                    self.find_in_row(n,m,chars,keymeta,y,line)
+                    y += 1
+            self.rows[n] = y
+            if y is not None:
+                bound = y if bound is None else min(bound,y)
+            self.work[n].seconds += self.clock()-start
+        rows = [y for y in self.rows.values() if y is not None]
+        self.drop_rows(min(rows) if len(rows) > 0 else self.lastrow)
+        
+    def find_in_row(self,n,m,chars,keymeta,y,line):
+        meta = self.grid.meta
+        xs = []
+        for c in chars:
+            x = line.find(c)
+            while x != -1:
+                xs.append(x)
+                x = line.find(c,x+1)
+        for x in sorted(xs):
+            startmeta = meta.get(x,y)
+            if( startmeta & core.M_OCCUPIED or startmeta & keymeta != keymeta 
+                    or self.at_limit() ):
+                continue
+            self.start_match(n,x,y)
+            self.note_live(n,1)
+            match = self.follow_connector(m,x,y,startmeta)
+            if match is None:
+                self.reject(n,1)
+                continue
+            k,match,footprint = match
+            self.add_match(k,n,self.row_start(y)+x,match,footprint)
+            
+    def follow_connector(self,m,x,y,startmeta):
+        """Returns the cell at which the member's connector from (x,y) 
+        completes, the match and its footprint, or None if there's no 
+        connector there. Follows the member's matcher"""
+        meta = self.grid.meta
+        tobox,dashed = False,False
+        if not m.flipped:
+            tobox = bool(startmeta & m.boxmeta)
+            if m.boxrequired and not tobox: 
+                return None
+        else:
+            dashed = bool(startmeta & m.dashmeta)
+        footprint = {(x,y): core.M_OCCUPIED}
+        pos = (x,y)
+        for t,chars in enumerate(m.chars[1:]):
+            pos = (x+(t+1)*m.xdir,y+(t+1)*m.ydir)
+            line = self.grid.line(pos[1])
+            if( line is None or not 0 <= pos[0] < len(line) 
+                    or not isinstance(line[pos[0]],basestring) 
+                    or not line[pos[0]] in chars
+                    or meta.get(*pos) & core.M_OCCUPIED ):
+                return None
+            footprint[pos] = core.M_OCCUPIED
+        if not m.flipped:
+            pos = (x,y)
+        qx,qy = x+len(m.chars)*m.xdir,y+len(m.chars)*m.ydir
+        line = self.grid.line(qy)
+        if line is not None and 0 <= qx < len(line):
+            qmeta = meta.get(qx,qy)
+            if not m.flipped:
+                if not qmeta & m.linemeta: 
+                    return None
+                dashed = bool(qmeta & m.dashmeta)
+            else:
+                tobox = bool(qmeta & m.boxmeta)
+                if m.boxrequired and not tobox: 
+                    return None
+            k = self.row_start(qy)+qx
+        elif m.boxrequired:
+            return None
+        elif line is None:
+            k = self.row_start(self.grid.height)
+        elif line[0] is core.END_OF_INPUT:
+            k = self.row_start(qy)
+        else:
+            k = self.row_start(qy)+max(0,min(qx,len(line)))
+        match = m()
+        match.pos,match.tobox,match.dashed = pos,tobox,dashed
+        match.is_finished = True
+        return k,match,footprint
+
+
+class ChainedPass(GroupPass):
+    """Pass for a patterns.PatternGroup whose members are each matched by 
+    their own matcher, in a pass of its own following behind the one for the
+    member before it. The members' passes are given their start cells a row
+    at a time, from their start keys, so the rows of a diagram being read 
+    are found in the same way as those of a whole one. Groups whose members 
+    can't be found by a quicker pass, such as those with matchers of their 
+    own, are matched this way"""
+
+    def __init__(self,pclass,grid,cells,rowstarts,maxlive=None,starts=None,
+            findcell=None):
+        GroupPass.__init__(self,pclass,grid,cells,rowstarts,maxlive,starts,findcell)
+        self.subpasses = []
+        self.keys = []
+        for n,m in self.members:
+            key = m.start_key() if hasattr(m,"start_key") else None
+            sub = PatternPass(m,grid,cells,rowstarts,maxlive,starts=[],
+                    findcell=self.find_cell)
+            if key is None or key.chars is None:
+                # the start of input, which is in no row
+                sub.add_starts([0])
+            self.subpasses.append((n,sub))
+            self.keys.append(key)
+        self.share_live(self.livecount)
+        # the number of cells before the start of a row that its start keys 
+        # can give start cells at
+        self.lead = max([key.offset for key in self.keys if key is not None] + [0])
+        # the next row to find start cells in, or None once the end of input 
+        # is reached
+        self.row = 0 if len(self.members) > 0 else None
+        self.seq = 0
+        
+    def live(self):
+        return sum(sub.live() for n,sub in self.subpasses)
+        
+    def share_live(self,livecount):
+        # the members' passes count their own matches in progress
+        self.livecount = livecount
+        for n,sub in self.subpasses:
+            sub.share_live(livecount)
+
+    def drop_starts(self):
+        for n,sub in self.subpasses:
+            sub.drop_starts()
+
+    def find(self,limit):
+        """Gives the members' passes their start cells in the rows begun 
+        before the limit"""
+        while self.row is not None:
+            rowstart = self.row_start(self.row,limit)
+            if rowstart is None or rowstart >= limit: break
+            line = self.grid.line(self.row)
+            if line[0] is core.END_OF_INPUT:
+                for key,(n,sub) in zip(self.keys,self.subpasses):
+                    if key is None or key.chars is None:
+                        sub.add_starts([rowstart])
+                self.row = None
+            else:
+                self.find_in_row(self.row,line,rowstart)
+                self.row += 1
+        self.drop_rows(self.row if self.row is not None else self.lastrow)
+        
+    def find_in_row(self,y,line,rowstart):
+        for key,(n,sub) in zip(self.keys,self.subpasses):
+            sub.add_starts(self.key_starts(key,line,rowstart))
+            
+    def key_starts(self,key,line,rowstart):
+        """Returns the start cells given by the start key in the row"""
+        if key is None or key.chars is None:
+            return range(rowstart,rowstart+len(line))
+        return find_row_start_cells(key,line,rowstart)
+            
+    def advance(self,limit):
+        self.find(limit)
+        ncells = len(self.cells)
+        self.scanpos = max(self.scanpos,min(limit,ncells))
+        if self.row is not None:
+            # start cells may yet be given just before the next row
+            limit = min(limit,self.row_start(self.row)-self.lead)
+        # the meta of each member's matches is settled before the next member
+        # sees it. Matches in progress once all of the cells are passed can 
+        # never complete, so they no longer hold back the members after
+        for n,sub in self.subpasses:
+            sub.rejects,sub.activity,sub.budget = self.rejects,self.activity,self.budget
+            if self.timing:
+                sub.timed_advance(limit)
+            else:
+                sub.advance(limit)
+            limit = min(limit,sub.watermark if sub.scanpos < ncells else ncells)
+        self.watermark = self.oldest = min(self.scanpos,limit)
+        if len(self.complete_matches) == 0:
+            del self.order[:]
+        for n,sub in self.subpasses:
+            for match in sub.complete_matches:
+                self.seq += 1
+                self.add_complete((n,self.seq),match)
+            del sub.complete_matches[:]
+        subs = [sub for n,sub in self.subpasses]
+        self.created = sum(sub.created for sub in subs)
+        self.resumes = sum(sub.resumes for sub in subs)
+        self.rejected = sum(sub.rejected for sub in subs)
+        self.claimed = sum(sub.claimed for sub in subs)
+        self.peaklive = max([self.peaklive,self.live()] + [sub.peaklive for sub in subs])
+        
+    def matches_by_class(self):
+        bymember = [[] for m in self.pclass.members]
+        for key,match in zip(self.order,self.complete_matches):
+            bymember[key[0]].append(match)
+        return bymember
+        
+    def stats_by_class(self):
+        subs = dict(self.subpasses)
+        stats = []
+        for n,matches in enumerate(self.matches_by_class()):
+            m = self.pclass.members[n]
+            if n in subs:
+                stats.append(subs[n].stats()._replace(completed=len(matches)))
+            else:
+                stats.append(PassStats(m.__name__,0.0,0,0,0,0,0,0))
+        return stats
+
+
+class BoxPass(ChainedPass):
+    """Pass for a patterns.BoxGroupPattern. Each member is matched by its own
+    matcher, as for a ChainedPass, but the top edges in each row are found 
+    just once, for all of the members, and a member's matcher is only tried 
+    where an edge it can begin with is found, over a side it can have in the
+    row below. The members without top edges are tried at the cells their 
+    start keys give"""
+    
+    SOLID_EDGE = re.compile(r"-+")
+    DASHED_EDGE = re.compile(r"(?:- )+")
+
+    @classmethod
+    def finds(cls,member):
+        """Returns True, as each member is matched by its own matcher"""
+        return True
+
+    def __init__(self,pclass,grid,cells,rowstarts,maxlive=None,starts=None,
+            findcell=None):
+        ChainedPass.__init__(self,pclass,grid,cells,rowstarts,maxlive,starts,findcell)
+        # for each member, its top edges, or None to use its start key
+        self.edges = [m.top_edges() for n,m in self.members]
+        self.corners = set(e.left for edges in self.edges if edges is not None 
+                for e in edges)
+        self.lead = max([key.offset for edges,key in zip(self.edges,self.keys) 
+                if edges is None and key is not None] + [0])
+        
+    def find_in_row(self,y,line,rowstart):
+        # the corners beginning solid and dashed runs, and where they end, 
+        # found once for all of the members
+        solids,dashes = {},{}
+        for c in self.corners:
+            x = line.find(c)
+            while x != -1:
+                run = self.SOLID_EDGE.match(line,x+1)
+                if run is not None:
+                    solids[x] = line[run.end()]
+                run = self.DASHED_EDGE.match(line,x+1)
+                if run is not None:
+                    dashes[x] = line[run.end()]
+                x = line.find(c,x+1)
+        below = self.grid.line(y+1)
+        if not isinstance(below,basestring):
+            below = ""
+        for edges,key,(n,sub) in zip(self.edges,self.keys,self.subpasses):
+            if edges is None:
+                sub.add_starts(self.key_starts(key,line,rowstart))
+                continue
+            xs = set()
+            for e in edges:
+                for x,right in (dashes if e.dashed else solids).items():
+                    if( right == e.right and line[x] == e.left 
+                            and 0 <= x+e.slant < len(below) 
+                            and below[x+e.slant] in e.side ):
+                        xs.add(rowstart+x)
+            sub.add_starts(sorted(xs))
+
+
+class TextPass(GroupPass):
+    """Pass for a patterns.TextGroupPattern. A literal is a single character 
+    other than whitespace, on a cell not already occupied, so rather than a 
+    matcher being tried at every cell, the characters other than whitespace
+    are found a row at a time, once earlier passes have settled the meta of 
+    the row. A wide diagram with little in it then costs little more than a 
+    narrow one. Members must match as patterns.LiteralPattern does"""
+
+    NONBLANK = re.compile(r"\S")
+
+    @classmethod
+    def finds(cls,member):
+        """Returns True if the pass can find the pattern class's literals"""
+        return matches_as(member,patterns.LiteralPattern)
+
+    def __init__(self,pclass,grid,cells,rowstarts,maxlive=None,starts=None,
+            findcell=None):
+        GroupPass.__init__(self,pclass,grid,cells,rowstarts,maxlive,starts,findcell)
+        for n,m in self.members:
+            if not self.finds(m):
+                raise ValueError("%s isn't a literal" % m.__name__)
+        # the next row to find text in, or None once the end of input is reached
+        self.row = 0 if len(self.members) > 0 else None
+        
+    def update_watermark(self):
+        self.oldest = self.row_start(self.row) if self.row is not None else len(self.cells)
+        self.watermark = min(self.scanpos,self.oldest)
+        
+    def find(self,limit):
+        while self.row is not None and self.rows_before(self.row,limit):
+            line = self.grid.line(self.row)
+            if line[0] is core.END_OF_INPUT:
+                self.row = None
+            else:
+                self.find_in_row(self.row,line,self.row_start(self.row))
+                self.row += 1
+        self.drop_rows(self.row if self.row is not None else self.lastrow)
+        
+    def find_in_row(self,y,line,rowstart):
+        """Adds the literals of the row, each completing at the cell after it"""
+        meta = self.grid.meta
+        for n,m in self.members:
+            start = self.clock()
+            for found in self.NONBLANK.finditer(line):
+                x = found.start()
+                # \S takes only ASCII whitespace as blank, for unicode too
+                if( meta.get(x,y) & core.M_OCCUPIED or line[x].isspace() 
+                        or self.at_limit() ):
+                    continue
+                self.start_match(n,x,y)
+                self.note_live(n,1)
+                match = m()
+                match.pos,match.char = (x,y),line[x]
+                match.is_finished = True
+                self.add_match(rowstart+x+1,n,rowstart+x,match,{(x,y): core.M_OCCUPIED})
+            self.work[n].seconds += self.clock()-start
+
+
+def pattern_classes(patternlist):
+    """Returns the pattern classes matched for the list, with the members of 
+    groups in place of the groups"""
+    return [m for pclass in patternlist 
+            for m in (pclass.members if is_group(pclass) else [pclass])]
+            
+            
+def is_group(pclass):
+    """Returns True if the pattern class is a patterns.PatternGroup"""
+    return isinstance(pclass,type) and issubclass(pclass,patterns.PatternGroup)
+    
+
+def matches_as(pclass,base):
+    """Returns True if the pattern class matches just as the given base class 
+    does: neither it nor the classes between them define anything but how a 
+    match is constructed and rendered"""
+    if not issubclass(pclass,base):
+        return False
+    for c in pclass.__mro__[:pclass.__mro__.index(base)]:
+        for name,value in vars(c).items():
+            if name not in ("__init__","render") and isinstance(value,
+                    (types.FunctionType,classmethod,staticmethod)):
+                return False
+    return True
+    
+
+# the passes for groups of patterns of each kind, which can be used if they 
+# find all of the members
+GROUP_PASSES = [
+    (patterns.LineGroupPattern, LineTracerPass),
+    (patterns.ConnectorGroupPattern, ConnectorPass),
+    (patterns.BoxGroupPattern, BoxPass),
+    (patterns.TextGroupPattern, TextPass),
+]
+
+
+def make_pass(pclass,grid,cells,rowstarts,maxlive=None,starts=None,findcell=None):
+    """Returns the pass for the pattern class: a GroupPass for a group of 
+    patterns, or otherwise a PatternPass. A group is matched by the pass for 
+    its kind if that finds all of its members, or else by a ChainedPass"""
+    if not is_group(pclass):
+        return PatternPass(pclass,grid,cells,rowstarts,maxlive,starts,findcell)
+    for grouptype,passtype in GROUP_PASSES:
+        if( issubclass(pclass,grouptype) 
+                and all(passtype.finds(m) for m in pclass.members) ):
+            return passtype(pclass,grid,cells,rowstarts,maxlive,starts,findcell)
+    return ChainedPass(pclass,grid,cells,rowstarts,maxlive,starts,findcell)
+
+
+def advance_passes(passes,limit):
+    """Advances each pass in turn as far as those before it allow, the first 
+    up to the given cell index. Returns the watermark of the last"""
+    for p in passes:
+        p.advance(limit)
+        limit = min(limit,p.watermark)
+    return limit
+    
+
+class SharedMetaPlane(core.MetaPlane):
+    """Meta plane held in shared memory, for passes run in separate processes.
+    Merges are serialised, since matches of different passes may add meta to 
+    the same cell at the same time"""
+    
+    def __init__(self,width,height):
+        core.MetaPlane.__init__(self,width,height,
+            lambda n: multiprocessing.RawArray("I",n))
+        self.lock = multiprocessing.Lock()
+        
+    def merge(self,footprint):
+        with self.lock:
+            core.MetaPlane.merge(self,footprint)
+    
+
+def run_pipeline_stage(n,passes,rowstarts,marks,changed,results):
+    """Runs a group of passes in a worker process, following the watermark 
+    published by the stage before it, or a row at a time for the first stage.
+    Publishes its own watermark as it goes and puts the rendered matches of 
+    each pass on the results queue at the end"""
+    try:
+        ncells = rowstarts[-1]
+        rowends = iter(rowstarts[1:])
+        upstream = 0
+        while True:
+            if n == 0:
+                upstream = rowends.next()
+            else:
+                with changed:
+                    while marks[n-1] <= upstream:
+                        changed.wait()
+                    upstream = marks[n-1]
+            if upstream == ncells:
+                # matches still in progress before this stage can never 
+                # complete, so they no longer hold it back
+                for p in passes:
+                    p.advance(ncells)
+                mark = ncells
+            else:
+                mark = advance_passes(passes,upstream)
+            with changed:
+                marks[n] = max(marks[n],mark)
+                changed.notify_all()
+            if mark == ncells: break
+        content = []
+        for p in passes:
+            for m in p.complete_matches:
+                content.extend(m.render())
+        results.put((n,content,None))
+    except Exception as e:
+        # let the stages after carry on, so that they don't wait forever
+        with changed:
+            marks[n] = rowstarts[-1]
+            changed.notify_all()
+        results.put((n,None,e))
+
+
+def run_pipeline(passes,rowstarts,processes,proglsnr):
+    """Splits the passes into groups, in order, and runs each group in a 
+    process of its own, as a pipeline. Returns the rendered content. If a 
+    worker dies without giving its result, the others are stopped and a 
+    RuntimeError raised"""
+    ncells = rowstarts[-1]
+    size = (len(passes)+processes-1)//processes
+    groups = [passes[i:i+size] for i in range(0,len(passes),size)]
+    marks = multiprocessing.RawArray("l",len(groups))
+    changed = multiprocessing.Condition()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_pipeline_stage,
+            args=(n,group,rowstarts,marks,changed,results)) 
+            for n,group in enumerate(groups)]
+    for w in workers: 
+        w.start()
+    contents = [None]*len(groups)
+    error = None
+    progress = 0.0
+    received = set()
+    while len(received) < len(groups):
+        try:
+            n,content,e = results.get(timeout=0.1)
+            contents[n] = content
+            error = error or e
+            received.add(n)
+            continue
+        except Queue.Empty:
+            pass
+        # a worker which has exited has already flushed any result to the 
+        # queue, so one gone without a result never posted one
+        dead = [n for n,w in enumerate(workers) 
+                if n not in received and not w.is_alive()]
+        if len(dead) > 0:
+            try:
+                n,content,e = results.get(timeout=0.1)
+                contents[n] = content
+                error = error or e
+                received.add(n)
+                continue
+            except Queue.Empty:
+                pass
+            for w in workers:
+                if w.is_alive(): 
+                    w.terminate()
+                w.join()
+            raise RuntimeError("Pipeline stage %d ended without a result, exit "
+                "code %s" % (dead[0],workers[dead[0]].exitcode))
+        done = float(sum(marks))/len(groups)/ncells
+        if progress < done < 1.0:
+            progress = done
+            proglsnr(progress)
+    for w in workers: 
+        w.join()
+    if error is not None:
+        raise error
+    return [c for content in contents for c in content]
+
+
+def find_regions(grid,gap):
+    """Returns the (start,end) row ranges of the bands of the diagram which are
+    separated by at least the given number of blank rows. The blank rows 
+    after a band are included in it"""
+    starts = []
+    blanks = gap
+    for y in range(grid.height):
+        if grid.lines[y+1].strip(" \n") == "":
+            blanks += 1
+            continue
+        if blanks >= gap:
+            starts.append(y)
+        blanks = 0
+    return zip(starts,starts[1:]+[grid.height])
+    
+    
+def group_regions(regions,count):
+    """Joins neighbouring regions together to make no more than the given 
+    number of groups, of roughly equal numbers of rows"""
+    if len(regions) == 0:
+        return []
+    first = regions[0][0]
+    size = float(regions[-1][1]-first)/count
+    groups = []
+    for start,end in regions:
+        if len(groups) > 0 and int((start-first)/size) == groups[-1][2]:
+            groups[-1] = (groups[-1][0],end,groups[-1][2])
+        else:
+            groups.append((start,end,int((start-first)/size)))
+    return [(start,end) for start,end,n in groups]
+    
+    
+def match_region(job):
+    """Matches the patterns against one band of a diagram. The band is 
+    preceded by empty lines to keep its rows in place. Returns the rendered 
+    content for each pattern class, those of groups of patterns taken 
+    one by one"""
+    text,patternlist,maxlive = job
+    grid = core.Grid(text)
+    cells,rowstarts = scan_cells(grid)
+    passes = [make_pass(pclass,grid,cells,rowstarts,maxlive) 
+            for pclass in patternlist]
+    run_passes(passes,rowstarts,lambda x: None)
+    return [[c for m in ms for c in m.render()] 
+            for p in passes for ms in p.matches_by_class()]
+    
+    
+def match_regions(grid,regions,patternlist,maxlive,processes,proglsnr):
+    """Matches the patterns against each of the bands of the diagram in a pool
+    of processes, returning the rendered content in the same order as for the 
+    diagram as a whole. Small bands are matched together, a few groups per 
+    process, as each band is preceded by empty lines to keep it in place. 
+    Pattern classes which can't be pickled to send to the pool, such as those
+    defined in a function, are matched in this process instead"""
+    jobs = [("\n"*start + "".join(grid.lines[start+1:end+1]),patternlist,maxlive)
+            for start,end in group_regions(regions,processes*REGION_GROUPS)]
+    try:
+        cPickle.dumps(patternlist,2)
+        pool = multiprocessing.Pool(processes)
+    except (cPickle.PicklingError,TypeError):
+        pool = None
+    try:
+        results = []
+        found = pool.imap(match_region,jobs) if pool is not None else (
+                match_region(job) for job in jobs)
+        for result in found:
+            results.append(result)
+            if len(results) < len(jobs):
+                proglsnr(float(len(results))/len(jobs))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    content = []
+    for i in range(len(pattern_classes(patternlist))):
+        for result in results:
+            content.extend(result[i])
+    return content
+    
+    
+class GridCells(object):
+    """The cells of a grid as (row,col,char) tuples in scan order, made from 
+    the grid's rows as they are indexed rather than held, so that a large 
+    diagram costs no more than its text. The row of the last cell asked for 
+    is remembered, as passes mostly move through a row at a time"""
+    
+    def __init__(self,grid,rowstarts):
+        self.lines = grid.lines
+        self.rowstarts = rowstarts
+        self.row = 0
+        
+    def __getitem__(self,k):
+        rowstarts,j = self.rowstarts,self.row
+        if not rowstarts[j] <= k < rowstarts[j+1]:
+            if not 0 <= k < rowstarts[-1]:
+                raise IndexError(k)
+            j = self.row = bisect.bisect_right(rowstarts,k) - 1
+        return (j-1, k-rowstarts[j], self.lines[j][k-rowstarts[j]])
+        
+    def __len__(self):
+        return self.rowstarts[-1]
+        
+
+def scan_cells(grid):
+    """Returns the GridCells of the grid, and the index of the first cell of 
+    each row plus the total"""
+    rowstarts = [0]
+    for line in grid.lines:
+        rowstarts.append(rowstarts[-1]+len(line))
+    return GridCells(grid,rowstarts),rowstarts
+    
+    
+# the number of cells a pass steps through, or matches a group pass tries, 
+# between checks of its budget
+BUDGET_INTERVAL = 1024
+
+
+class BudgetExceeded(Exception):
+    """Raised when matching a diagram goes over a Budget. The budget attribute
+    names the limit which was exceeded, value the amount reached and limit the
+    amount allowed. If this happened while matching with the fallback 
+    patterns, first is the BudgetExceeded which led to them"""
+    
+    def __init__(self,budget,value,limit,first=None):
+        message = "Over %s budget: %s of %s" % (budget,value,limit)
+        if first is not None:
+            message += " with fallback patterns, after %s" % first
+        Exception.__init__(self,message)
+        self.budget = budget
+        self.value = value
+        self.limit = limit
+        self.first = first
+        
+        
+class Budget(object):
+    """Limits on the work spent matching a diagram, any of which may be None
+    for no limit: wall-clock seconds, cells in the diagram, matches in 
+    progress at once across all patterns, and the total number of times 
+    matches are stepped. A diagram over budget raises BudgetExceeded, unless 
+    fallback patterns are given, in which case it is matched again with only 
+    those, within the same limit on cells and the seconds given by 
+    fallbackseconds, or no limit on time if that is None"""
+
+    def __init__(self,seconds=None,cells=None,live=None,resumes=None,
+            fallback=None,fallbackseconds=None):
+        self.seconds = seconds
+        self.cells = cells
+        self.live = live
+        self.resumes = resumes
+        self.fallback = fallback
+        self.fallbackseconds = fallbackseconds
+        self.deadline = None
+        # the passes whose work counts against the budget
+        self.passes = []
+        
+    def start(self,width,height):
+        """Begins timing, and checks the size of the diagram"""
+        if self.seconds is not None:
+            if self.seconds <= 0:
+                raise BudgetExceeded("seconds",0,self.seconds)
+            self.deadline = time.time() + self.seconds
+        if self.cells is not None and width*height > self.cells:
+            raise BudgetExceeded("cells",width*height,self.cells)
+            
+    def for_fallback(self):
+        """Returns the budget for matching with the fallback patterns: their 
+        own allowance of seconds and the same limit on cells"""
+        return Budget(seconds=self.fallbackseconds,cells=self.cells)
+        
+    def watch(self,passes):
+        """Counts the work of the passes against the budget, and has them 
+        check it as they advance"""
+        self.passes = passes
+        for p in passes:
+            p.budget = self
+            
+    def check(self,passes=None):
+        """Checks the passes in progress, or else those watched, against the 
+        budget"""
+        if passes is None:
+            passes = self.passes
+        if self.deadline is not None and time.time() > self.deadline:
+            raise BudgetExceeded("seconds",time.time()-self.deadline+self.seconds,
+                self.seconds)
+        if self.live is not None:
+            live = sum(p.live() for p in passes)
+            if live > self.live:
+                raise BudgetExceeded("live",live,self.live)
+        if self.resumes is not None:
+            resumes = sum(p.resumes for p in passes)
+            if resumes > self.resumes:
+                raise BudgetExceeded("resumes",resumes,self.resumes)
+                
+
+class MatchStats(object):
+    """Profile of the work done matching a diagram, filled in when given to 
+    process_diagram: the PassStats of each pattern class, in order"""
+    
+    def __init__(self):
+        self.passes = []
+        
+    def totals(self):
+        """Returns PassStats summed over all of the passes. The peak of 
+        matches in progress is that of the busiest pass"""
+        return PassStats("total",*[(max if f == "peaklive" else sum)(
+                getattr(p,f) for p in self.passes) for f in PassStats._fields[1:]])
+        
+    def to_dict(self):
+        """Returns the stats as a dictionary, as for JSON"""
+        return { "passes": [p._asdict() for p in self.passes], 
+                 "totals": self.totals()._asdict() }
+        
+    def report(self):
+        """Returns the stats as a table of text, a line per pass"""
+        heads = ("pattern","seconds","created","resumes","rejected","completed",
+            "peak","claimed")
+        rows = [heads]
+        for p in self.passes+[self.totals()]:
+            rows.append((p.pattern,"%.3f" % p.seconds)+tuple(map(str,p[2:])))
+        widths = [max(len(r[i]) for r in rows) for i in range(len(heads))]
+        return "".join(" ".join([r[0].ljust(widths[0])]
+                +[c.rjust(w) for c,w in zip(r[1:],widths[1:])])+"\n" for r in rows)
+        
+
+def find_reject_site(match):
+    """Returns the (filename,line,depth) at which the match was rejected: the 
+    innermost line of its matcher outside of core, so that rejections by 
+    expect, reject or await_pos are put down to the line calling them, along 
+    with the number of generators nested at the point of rejection, 
+    counting those of core such as await_pos and follow. The line is None if 
+    the match was rejected for reaching past the edge of the diagram"""
+    frames = []
+    if match.rejection is not None:
+        # raised - the traceback runs from step down to where it was raised
+        tb = match.rejection.tb_next
+        match.rejection = None
+        while tb is not None:
+            frames.append((tb.tb_frame,tb.tb_lineno))
+            tb = tb.tb_next
+    else:
+        # yielded - the generators waiting in each other's frames are found 
+        # from the references those frames hold
+        gen = match.gen
+        while gen is not None and gen.gi_frame is not None:
+            frames.append((gen.gi_frame,gen.gi_frame.f_lineno))
+            gen = next((r for r in gc.get_referents(gen.gi_frame)
+                    if isinstance(r,types.GeneratorType)),None)
+    filename,line = None,None
+    for frame,lineno in frames:
+        if frame.f_globals.get("__name__") == core.__name__: continue
+        filename,line = os.path.basename(frame.f_code.co_filename),lineno
+    depth = len([f for f,l in frames if f.f_code.co_flags & inspect.CO_GENERATOR])
+    if( match.reach is not None and match.grid is not None
+            and match.grid.char_at(*match.reach) is None ):
+        line = None
+    return (filename,line,depth)
+    
+
+class RejectProfile(object):
+    """Records where matches are rejected, filled in when given to 
+    process_diagram. For each pattern class, each site given by 
+    find_reject_site has a histogram of the number of cells the rejected 
+    matches had claimed first, so that the sites where matches get far 
+    before failing can be found"""
+    
+    def __init__(self):
+        # pattern name to site to cell count to number of rejections
+        self.sites = {}
+        
+    def record(self,pclass,match,footprint):
+        """Records the rejection of the match, having claimed the cells of the
+        given footprint"""
+        self.add(pclass,find_reject_site(match),len(footprint))
+        
+    def add(self,pclass,site,cells):
+        """Records a rejection at the given site, having claimed the given 
+        number of cells"""
+        hist = self.sites.setdefault(pclass.__name__,{}).setdefault(site,{})
+        hist[cells] = hist.get(cells,0) + 1
+        
+    def _ordered(self):
+        """Returns (pattern,[(site,histogram)...]) pairs, the most rejected 
+        first"""
+        total = lambda sites: sum(sum(h.values()) for h in sites.values())
+        return [(name,sorted(sites.items(),key=lambda (s,h): -sum(h.values())))
+                for name,sites in sorted(self.sites.items(),
+                    key=lambda (n,s): -total(s))]
+        
+    def to_dict(self):
+        """Returns the histograms as a dictionary, as for JSON"""
+        return dict((name,[{ "file": filename, "line": line, "depth": depth,
+                             "rejected": sum(hist.values()),
+                             "cells": dict((str(n),c) for n,c in hist.items()) }
+                           for (filename,line,depth),hist in sites])
+                    for name,sites in self._ordered())
+        
+    def report(self):
+        """Returns the histograms as text, a line per site"""
+        lines = []
+        for name,sites in self._ordered():
+            lines.append(name)
+            for (filename,line,depth),hist in sites:
+                count = sum(hist.values())
+                cells = sum(n*c for n,c in hist.items())
+                place = ("%s:%d" % (filename,line) if line is not None 
+                        else "past edge")
+                lines.append("  %s depth %d: %d rejected, %.1f cells on average, "
+                    "%d at most" % (place,depth,count,float(cells)/count,max(hist)))
+        return "".join(l+"\n" for l in lines)
+        
+
+def pattern_family(pclass):
+    """Returns the name of the family in patterns.FAMILIES to which the 
+    pattern class belongs, or "other" """
+    for name,bases in patterns.FAMILIES:
+        if issubclass(pclass,bases): 
+            return name
+    return "other"
+
+
+class ActivityMap(object):
+    """Counts of the steps of matches at each cell of a diagram, by pattern 
+    family, filled in when given to process_diagram. Shows which parts of a 
+    slow diagram the time goes on, either as a diagram of its own for the 
+    usual output formats, or as CSV"""
+
+    COLOURS = {
+        "box":          NAMED_COLOURS["red"],
+        "line":         NAMED_COLOURS["blue"],
+        "connector":    NAMED_COLOURS["green"],
+        "text":         NAMED_COLOURS["gray"],
+        "other":        NAMED_COLOURS["purple"],
+    }
+
+    def __init__(self):
+        self.grid = None
+        # (x,y) position to family name to number of steps
+        self.counts = {}
+        self.families = {}
+        
+    def add(self,pclass,x,y,steps):
+        if pclass not in self.families:
+            self.families[pclass] = pattern_family(pclass)
+        cell = self.counts.setdefault((x,y),{})
+        family = self.families[pclass]
+        cell[family] = cell.get(family,0) + steps
+        
+    def total(self,x,y):
+        return sum(self.counts.get((x,y),{}).values())
+        
+    def diagram(self):
+        """Returns a Diagram with each cell shaded in the colour of the family 
+        with the most steps there, more strongly the more steps there were in 
+        all, on a log scale, behind the characters of the diagram"""
+        width,height = self.grid.width,self.grid.height
+        content = []
+        cells = [(pos,c) for pos,c in self.counts.items()
+                if 0 <= pos[0] < width and 0 <= pos[1] < height]
+        if len(cells) > 0:
+            top = math.log(1+max(sum(c.values()) for pos,c in cells))
+            for (x,y),c in cells:
+                family = max(c.keys(),key=lambda f: c[f])
+                content.append(core.Rectangle(a=(x,y),b=(x+1,y+1),z=0,
+                    stroke=None,salpha=0,w=1,stype=core.STROKE_SOLID,
+                    fill=ActivityMap.COLOURS[family],
+                    falpha=math.log(1+sum(c.values()))/top))
+        for y in range(height):
+            for x in range(width):
+                char = self.grid.char_at(x,y)
+                if char is not None and not char.isspace():
+                    content.append(core.Text(pos=(x,y),z=1,text=char,
+                        colour=core.C_FOREGROUND,alpha=0.5,size=1))
+        return Diagram((width,height),content)
+        
+    def write_csv(self,stream):
+        """Writes the total steps at each cell, a line per row"""
+        for y in range(self.grid.height):
+            stream.write(",".join(str(self.total(x,y)) 
+                for x in range(self.grid.width)) + "\n")
+        
+
+def run_passes(passes,rowstarts,proglsnr,budget=None,timed=False):
+    """Runs the passes together over all of the cells. If a Budget is given, 
+    it is checked after each row, and by the passes every BUDGET_INTERVAL 
+    cells or so within a row, raising BudgetExceeded once over it. If timed, the 
+    time spent in each pass is added up in its seconds"""
+    method = "timed_advance" if timed else "advance"
+    share_live(passes)
+    if budget is not None:
+        budget.watch(passes)
+    ncells = rowstarts[-1]
+    progress = 0.0
+    for j,rowend in enumerate(rowstarts[1:]):
+        # the first pass leads by a row at a time, the rest follow as far as 
+        # they can. Empty rows are taken together with the row after
+        if rowend - rowstarts[j] == 1 and rowend < ncells: 
+            continue
+        limit = rowend
+        total = 0
+        for p in passes:
+            getattr(p,method)(limit)
+            limit = min(limit,p.watermark)
+            total += limit
+        if budget is not None:
+            budget.check(passes)
+        if len(passes) > 0 and rowend < ncells:
+            done = float(total)/len(passes)/ncells
+            if done > progress: 
+                progress = done
+                proglsnr(progress)
+    # matches still in progress at the end of input can never complete, so
+    # they no longer hold back the passes after them
+    for p in passes:
+        getattr(p,method)(ncells)
+
+
+class CellWindow(object):
+    """The cells of those rows of a diagram being read which are still needed,
+    indexed as if all of the cells were held. Its length is unknown, and so 
+    taken as sys.maxint, until the end of input has been read"""
+
+    def __init__(self):
+        self.first = None
+        self.rowstarts = []
+        self.lines = []
+        self.total = 0
+        self.ended = False
+        
+    def add_row(self,y,line):
+        if self.first is None:
+            self.first = y
+        self.rowstarts.append(self.total)
+        self.lines.append(line)
+        self.total += len(line)
+        if line == [core.END_OF_INPUT]:
+            self.ended = True
+            
+    def row_start(self,y):
+        return self.rowstarts[y-self.first]
+        
+    def drop(self,y):
+        """Discards the rows before the given row"""
+        n = max(0,min(y-self.first,len(self.lines)-1))
+        del self.rowstarts[:n]
+        del self.lines[:n]
+        self.first += n
+        
+    def row_at(self,k):
+        """Returns the row holding the cell with the given index"""
+        return self.first + bisect.bisect_right(self.rowstarts,k) - 1
+        
+    def __getitem__(self,k):
+        j = bisect.bisect_right(self.rowstarts,k) - 1
+        return (self.first+j, k-self.rowstarts[j], self.lines[j][k-self.rowstarts[j]])
+        
+    def __len__(self):
+        return self.total if self.ended else sys.maxint
+        
+
+class DiagramStream(object):
+    """Matches the patterns against a diagram read from an iterable of lines,
+    such as a file, in the same way as process_diagram, but without holding 
+    the whole diagram at once. Rows are let go of once no match in progress 
+    can reach back to them. Iterating over the stream gives the rendered 
+    content of each match as it completes, in order of completion rather 
+    than by pattern. The size is set once the stream has been exhausted. 
+    The diagram method returns the Diagram with its content in the same 
+    order as process_diagram"""
+    
+    size = None
+
+    def __init__(self,lines,patternlist,maxlive=None):
+        self.lines = lines
+        self.patternlist = patternlist
+        self.maxlive = maxlive
+        
+    def __iter__(self):
+        for n,shapes in self.matches():
+            for s in shapes:
+                yield s
+                
+    def diagram(self):
+        content = [[] for p in pattern_classes(self.patternlist)]
+        for n,shapes in self.matches():
+            content[n].extend(shapes)
+        return Diagram(self.size,[s for c in content for s in c])
+        
+    def matches(self):
+        """Yields the number of the pattern class, counting the members of 
+        groups of patterns one by one, and the rendered content of each 
+        match as it completes"""
+        cells = CellWindow()
+        keys = [pclass.start_key() if hasattr(pclass,"start_key") else None
+                for pclass in self.patternlist]
+        passes = []
+        
+        def add_row(y,line):
+            rowstart = cells.total
+            cells.add_row(y,line)
+            for p,key in zip(passes,keys):
+                if key is None or key.chars is None:
+                    p.add_starts(range(rowstart,rowstart+len(line)))
+                elif isinstance(line,basestring):
+                    p.add_starts(find_row_start_cells(key,line,rowstart))
+                    
+        def find_cell(pos):
+            col,row = pos
+            if row < cells.first:
+                return 0
+            grid.load(row+1)
+            if grid.height is not None and row >= grid.height:
+                return cells.total-1
+            start = cells.row_start(row)
+            return start + max(0,min(col,cells.row_start(row+1)-start))
+                    
+        def completed():
+            n = 0
+            for p in passes:
+                for ms in p.matches_by_class():
+                    for m in ms:
+                        yield n,m.render()
+                    n += 1
+                del p.complete_matches[:]
+                    
+        grid = core.StreamGrid(self.lines,add_row)
+        for pclass in self.patternlist:
+            passes.append(make_pass(pclass,grid,cells,None,self.maxlive,starts=[],
+                findcell=find_cell))
+        share_live(passes)
+        
+        row = -1
+        while grid.height is None or row <= grid.height:
+            # a row of lookahead, for start keys and patterns looking ahead
+            grid.load(row+1)
+            limit = cells.total if row == grid.height else cells.row_start(row+1)
+            for p in passes:
+                p.advance(limit)
+                limit = min(limit,p.watermark)
+            for item in completed():
+                yield item
+            # nothing before the last watermark will be looked at again
+            done = cells.row_at(limit)
+            grid.drop(done)
+            cells.drop(done)
+            for p in passes:
+                p.drop_starts()
+            row += 1
+            
+        # matches still in progress at the end of input can never complete
+        for p in passes:
+            p.advance(cells.total)
+        for item in completed():
+            yield item
+        self.size = (grid.width,grid.height)
+    
+
+def shape_key(shape):
+    """Returns a hashable equivalent of a shape"""
+    return tuple([tuple(v) if isinstance(v,list) else v for v in shape])
+    
+    
+def shape_rows(shape):
+    """Returns the first and last rows covered by a shape, or None if they 
+    can't be told"""
+    if isinstance(shape,core.Text):
+        return shape.pos[1],shape.pos[1]
+    if isinstance(shape,core.Polygon):
+        ys = [p[1] for p in shape.points]
+    elif isinstance(shape,core.QuadCurve):
+        ys = [shape.a[1],shape.b[1],shape.c[1]]
+    elif isinstance(shape,(core.Line,core.Rectangle,core.Ellipse,core.Arc)):
+        ys = [shape.a[1],shape.b[1]]
+    else:
+        return None
+    lo,hi = int(math.floor(min(ys))),int(math.ceil(max(ys)))-1
+    if hi < lo:
+        # level with the boundary between two rows
+        lo,hi = hi,lo
+    return lo,hi
+    
+    
+def match_rows(lines,patternlist,maxlive,top):
+    """Matches the patterns against the given rows, with their newlines, the 
+    first of which is the given row of the diagram. The rows are preceded by 
+    empty lines to keep them in place. Returns for each pattern class, those 
+    of groups taken one by one, the complete matches in order, each as the 
+    first and last rows covered by its content and the content. Where the 
+    rows can't be told from the content, they are taken to be the whole 
+    diagram"""
+    grid = core.Grid("\n"*top + "".join(lines))
+    cells,rowstarts = scan_cells(grid)
+    passes = [make_pass(pclass,grid,cells,rowstarts,maxlive) 
+            for pclass in patternlist]
+    run_passes(passes,rowstarts,lambda x: None)
+    results = []
+    for p in passes:
+        for ms in p.matches_by_class():
+            found = []
+            for m in ms:
+                content = m.render()
+                if len(content) == 0:
+                    continue
+                rows = [shape_rows(s) for s in content]
+                if None in rows:
+                    found.append((-1,sys.maxint,content))
+                else:
+                    found.append((min(r[0] for r in rows),max(r[1] for r in rows),
+                        content))
+            results.append(found)
+    return results
+    
+    
+def zone_content(matches,start,end):
+    """Returns comparable content of the matches lying within the given rows, 
+    for each pattern class"""
+    return [sorted(tuple(shape_key(s) for s in content)
+                for lo,hi,content in found if start <= lo and hi < end)
+            for found in matches]
+    
+    
+def update_diagram(state,text,patternlist,maxlive=None):
+    """Matches the patterns against the text as process_diagram does, reusing
+    what it can of the state from matching an earlier version of the text. 
+    Only a window of rows around those which have changed is matched again, 
+    along with a few rows either side. The window is widened until no match, 
+    earlier or new, crosses its edges, and the matches in the rows either 
+    side are the same as before. If rows have been added or removed, the 
+    window reaches to the end of the diagram, as the matches below it have 
+    moved. Pass None as the state for the first version. Returns the 
+    Diagram, the state for the next update, and a Delta giving the shapes 
+    removed and added since the earlier version"""
+    grid = core.Grid(text)
+    lines = grid.lines[1:-1]
+    nclasses = len(pattern_classes(patternlist))
+    if( state is None or state.patterns != tuple(patternlist) 
+            or state.maxlive != maxlive ):
+        old = [[] for i in range(nclasses)]
+        oldlines = []
+        a,b = 0,len(lines)
+    elif lines == state.lines:
+        content = [s for found in state.matches for lo,hi,c in found for s in c]
+        return Diagram((grid.width,grid.height),content),state,Delta([],[])
+    else:
+        old,oldlines = state.matches,state.lines
+        a = 0
+        while a < min(len(lines),len(oldlines)) and lines[a] == oldlines[a]:
+            a += 1
+        b = len(lines)
+        while( b > a and b-len(lines)+len(oldlines) > a 
+                and lines[b-1] == oldlines[b-1-len(lines)+len(oldlines)] ):
+            b -= 1
+    if maxlive is not None:
+        # the limit on matches in progress applies across the whole diagram
+        a,b = 0,len(lines)
+    # rows from b on were rows from b-dy on in the earlier version
+    dy = len(lines) - len(oldlines)
+    if dy != 0:
+        # the content of moved matches is rendered again where they now lie,
+        # as moving it would not give exactly the same coordinates
+        b = len(lines)
+    spans = [(lo,hi) for found in old for lo,hi,content in found if hi > lo]
+    
+    while True:
+        window = None
+        while window != (a,b):
+            window = a,b
+            for lo,hi in spans:
+                if lo < a <= hi: 
+                    a = max(0,lo)
+                if lo < b-dy <= hi: 
+                    b = min(len(lines),hi+1+dy)
+        top,bottom = max(0,a-UPDATE_CONTEXT),min(len(lines),b+UPDATE_CONTEXT)
+        new = match_rows(lines[top:bottom],patternlist,maxlive,top)
+        if top == 0 and bottom == len(lines):
+            a,b = 0,len(lines)
+            break
+        crossing = [(lo,hi) for f in new for lo,hi,content in f 
+                if lo < a <= hi or lo < b <= hi]
+        if len(crossing) > 0:
+            a = max(0,min([a]+[lo for lo,hi in crossing]))
+            b = min(len(lines),max([b]+[hi+1 for lo,hi in crossing]))
+            continue
+        # the outermost rows matched may have lost matches reaching beyond them
+        start = top+1 if top > 0 else 0
+        if zone_content(new,start,a) != zone_content(old,start,a):
+            a = max(0,a-UPDATE_CONTEXT)
+            continue
+        end = bottom-1 if bottom < len(lines) else bottom
+        if zone_content(new,b,end) != zone_content(old,b,end):
+            b = min(len(lines),b+UPDATE_CONTEXT)
+            continue
+        break
+    
+    matches = []
+    removed,added = [],[]
+    for i in range(nclasses):
+        above = [m for m in old[i] if m[1] < a]
+        below = [m for m in old[i] if m[0] >= b-dy]
+        within = [m for m in new[i] if (m[0] >= a or a == 0) 
+                and (m[1] < b or b == len(lines))]
+        for lo,hi,content in old[i]:
+            if hi >= a and lo < b-dy:
+                removed.extend(content)
+        added.extend([s for lo,hi,content in within for s in content])
+        matches.append(above+within+below)
+    
+    # shapes which are the same in the new version of the window aren't 
+    # changes
+    counts = {}
+    for s in removed:
+        counts[shape_key(s)] = counts.get(shape_key(s),0) + 1
+    delta = Delta(removed=[],added=[])
+    for s in added:
+        if counts.get(shape_key(s),0) > 0:
+            counts[shape_key(s)] -= 1
+        else:
+            delta.added.append(s)
+    for s in removed:
+        if counts.get(shape_key(s),0) > 0:
+            counts[shape_key(s)] -= 1
+            delta.removed.append(s)
+    
+    content = [s for found in matches for lo,hi,c in found for s in c]
+    return (Diagram((grid.width,grid.height),content),
+            ParseState(patterns=tuple(patternlist),maxlive=maxlive,lines=lines,
+                matches=matches),
+            delta)
     
 
+def source_fingerprint(obj):
+    """Returns a hash of the source code of a module, or of a class and the 
+    classes it derives from, and those of the members of a group of 
+    patterns, or None if the source can't be found"""
+    try:
+        if not inspect.isclass(obj):
+            return hashlib.sha1(inspect.getsource(obj)).hexdigest()
+        parts = []
+        classes = list(inspect.getmro(obj))
+        for m in getattr(obj,"members",[]):
+            classes.extend(inspect.getmro(m))
+        for c in classes:
+            if c is object: continue
+            parts.append("%s.%s\n%s" % (c.__module__,c.__name__,
+                    inspect.getsource(c)))
+        return hashlib.sha1("".join(parts)).hexdigest()
+    except (IOError,TypeError):
+        return None
+        
+        
+def write_atomically(path,data):
+    """Writes the data to the file at the given path, creating its directory 
+    if need be. The data is written under a temporary name, starting with a 
+    dot, and then renamed, so that the file is never seen half written"""
+    dir = os.path.dirname(path)
+    if not os.path.isdir(dir):
+        try:
+            os.makedirs(dir)
+        except OSError:
+            # another process may have just created it
+            if not os.path.isdir(dir): raise
+    fd,temp = tempfile.mkstemp(dir=dir,prefix=".")
+    try:
+        with os.fdopen(fd,"wb") as f:
+            f.write(data)
+        os.rename(temp,path)
+    except:
+        os.remove(temp)
+        raise
+        
+        
+class PassCache(object):
+    """On-disk store of the state of matching after each pass: the meta of 
+    the diagram and the rendered content of each pass so far. Each is keyed 
+    by a hash of the text together with the pattern classes up to and 
+    including that pass, their source code and that of the core, patterns 
+    and main modules, so that matching can resume after the longest run of 
+    passes which hasn't changed"""
+
+    def __init__(self,directory):
+        self.directory = directory
+        self.fingerprints = {}
+        
+    def fingerprint(self,obj):
+        """Returns a hash of the source code of a class or module, or None if
+        it can't be found"""
+        if obj not in self.fingerprints:
+            self.fingerprints[obj] = source_fingerprint(obj)
+        return self.fingerprints[obj]
+        
+    def keys(self,text,patternlist,maxlive):
+        """Returns the key for the state after each pass, or None from the 
+        first pattern class whose source can't be found onwards"""
+        if isinstance(text,unicode):
+            text = text.encode("utf8")
+        key = hashlib.sha1()
+        # the pattern classes may read anything in the modules, as well as 
+        # in their own source
+        for part in (text,repr(maxlive),self.fingerprint(core),
+                self.fingerprint(patterns),self.fingerprint(sys.modules[__name__])):
+            if part is None: 
+                return [None]*len(patternlist)
+            key.update(part)
+        keys = []
+        for pclass in patternlist:
+            fp = self.fingerprint(pclass) if key is not None else None
+            if fp is None:
+                key = None
+            else:
+                key.update(fp)
+            keys.append(key.hexdigest() if key is not None else None)
+        return keys
+        
+    def path(self,key):
+        return os.path.join(self.directory,key[:2],key)
+        
+    def load(self,key):
+        """Returns the (meta,contents) stored for the key, or None"""
+        try:
+            with open(self.path(key),"rb") as f:
+                return cPickle.loads(zlib.decompress(f.read()))
+        except (IOError,EOFError,zlib.error,cPickle.UnpicklingError):
+            return None
+            
+    def save(self,key,meta,contents):
+        """Stores the meta and the content of each pass for the key"""
+        write_atomically(self.path(key),
+            zlib.compress(cPickle.dumps((meta,contents),2)))
+            
+
+class RenderCache(object):
+    """On-disk store of rendered diagrams, keyed by a hash of the text and of
+    everything else which affects the output: the output preferences and 
+    format, the limit on matches in progress and the source of the engine 
+    and patterns. A running total of the size of the files is kept in the 
+    directory, and once it exceeds the given number of bytes, the least 
+    recently used are removed"""
+
+    # the file in the directory holding the running total, apart from the 
+    # entries, which are kept in subdirectories
+    TOTAL_FILE = "total"
+
+    def __init__(self,directory,maxsize):
+        self.directory = directory
+        self.maxsize = maxsize
+        
+    def key(self,text,prefs,format,maxlive=None):
+        if isinstance(text,unicode):
+            text = text.encode("utf8")
+        key = hashlib.sha1(text)
+        key.update(repr((prefs.fgcolour,prefs.bgcolour,prefs.charheight,
+                format.__name__,maxlive)))
+        for module in (core,patterns,sys.modules[__name__]):
+            key.update(str(source_fingerprint(module)))
+        return key.hexdigest()
+        
+    def path(self,key):
+        return os.path.join(self.directory,key[:2],key)
+        
+    def get(self,key):
+        """Returns the output stored for the key, or None"""
+        try:
+            with open(self.path(key),"rb") as f:
+                data = f.read()
+            # the modification time records when the entry was last used
+            os.utime(self.path(key),None)
+            return data
+        except (IOError,OSError):
+            return None
+            
+    def total(self):
+        """Returns the running total of the size of the entries, or None if 
+        there isn't one"""
+        try:
+            with open(os.path.join(self.directory,self.TOTAL_FILE),"rb") as f:
+                return int(f.read())
+        except (IOError,ValueError):
+            return None
+            
+    def put(self,key,data):
+        """Stores the output for the key and adds it to the running total. The
+        entries are only listed when there is no total yet, or it is over the
+        limit, and it is then set from their sizes. Other processes sharing
+        the directory may leave the total out, until it is next set"""
+        path = self.path(key)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        write_atomically(path,data)
+        total = self.total()
+        if total is None or total+len(data)-replaced > self.maxsize:
+            total = self.prune()
+        else:
+            total += len(data)-replaced
+        write_atomically(os.path.join(self.directory,self.TOTAL_FILE),str(total))
+            
+    def prune(self):
+        """Removes the least recently used entries while their total size is 
+        over the limit, returning the size of those left"""
+        entries = []
+        total = 0
+        for dir,dirs,files in os.walk(self.directory):
+            if dir == self.directory: continue
+            for name in files:
+                if name.startswith("."): continue
+                try:
+                    stat = os.stat(os.path.join(dir,name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime,os.path.join(dir,name),stat.st_size))
+                total += stat.st_size
+        for mtime,path,size in sorted(entries):
+            if total <= self.maxsize: break
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by another process already
+                pass
+            total -= size
+        return total
+            
+
+def run_cached_passes(grid,cells,rowstarts,patternlist,maxlive,cache,
+        proglsnr):
+    """Resumes matching from the state after the longest run of passes found
+    in the cache, then runs the remaining passes one at a time, storing the
+    state after each. Returns the rendered content"""
+    keys = cache.keys("".join(grid.lines[1:-1]),patternlist,maxlive)
+    contents = []
+    # only the state after the longest run of passes is needed
+    for key in reversed([k for k in keys if k is not None]):
+        found = cache.load(key)
+        if found is not None:
+            meta,contents = found
+            grid.meta.fromstring(meta)
+            break
+    for n in range(len(contents),len(patternlist)):
+        p = make_pass(patternlist[n],grid,cells,rowstarts,maxlive)
+        run_passes([p],rowstarts,lambda x: None)
+        contents.append([s for m in p.complete_matches for s in m.render()])
+        if keys[n] is not None:
+            cache.save(keys[n],grid.meta.tostring(),contents)
+        if n+1 < len(patternlist):
+            proglsnr(float(n+1)/len(patternlist))
+    return [s for content in contents for s in content]
+    
+
+def process_diagram(text,patternlist,proglsnr=lambda x: None,maxlive=None,
+        processes=None,cache=None,budget=None,stats=None,rejects=None,
+        activity=None):
+    """Matches the patterns against the text. Each pattern class in turn sees 
+    the meta of the matches of those before it, but rather than making a 
+    separate pass for each, the passes are run together in one scan, each 
+    following behind the point up to which the passes before it are settled.
+    If maxlive is given, no more than that many matches are kept in progress 
+    at once across all of the patterns: while at the limit, no pass starts 
+    new matches, so a pattern may be missed where it begins in a part of the
+    diagram crowded with candidates. Which are missed can depend on how far 
+    each pass has got, so a DiagramStream may miss others. The passes are 
+    then run together in this process. If processes is more than one, bands of the diagram 
+    separated by blank rows are matched separately in a pool of that many 
+    processes. Otherwise the passes are split between the processes, working
+    as a pipeline, with the meta shared between them. If a PassCache is 
+    given, the passes are instead run one at a time, resuming from and 
+    adding to the cached state. If a Budget is given, the passes are run 
+    together in this process, stopping once over budget. The diagram is then 
+    matched with the budget's fallback patterns instead, within the budget 
+    for_fallback gives, its exceeded field naming the budget which was gone 
+    over, or else BudgetExceeded is raised. 
+    If MatchStats are given, the passes are likewise run together in this 
+    process, and the work done by each is recorded in the stats, as are the 
+    places at which matches are rejected if a RejectProfile is given, and 
+    where matches are stepped if an ActivityMap is given"""
+
+    if budget is not None:
+        # the size is checked before anything is built for the diagram
+        lines = text.splitlines()
+        budget.start(max([len(l) for l in lines] or [0]),len(lines))
+    grid = core.Grid(text)
+    height = grid.height
+    width = grid.width
+    cells,rowstarts = scan_cells(grid)
+
+    proglsnr(0.0)
+    if( budget is not None or stats is not None or rejects is not None
+            or activity is not None or maxlive is not None ):
+        # the budget is checked, the profiles kept and the matches in progress
+        # counted as the passes are run together
+        cache = processes = None
+    if activity is not None:
+        activity.grid = grid
+    if cache is not None:
+        content = run_cached_passes(grid,cells,rowstarts,patternlist,maxlive,
+            cache,proglsnr)
+        proglsnr(1.0)
+        return Diagram((width,height),content)
+    if processes is not None and processes > 1:
+        regions = find_regions(grid,REGION_GAP)
+        if len(regions) > 1:
+            content = match_regions(grid,regions,patternlist,maxlive,processes,
+                proglsnr)
+            proglsnr(1.0)
+            return Diagram((width,height),content)
+        if len(patternlist) > 1:
+            grid.meta = SharedMetaPlane(width,height)
+            passes = [make_pass(pclass,grid,cells,rowstarts,maxlive) 
+                    for pclass in patternlist]
+            content = run_pipeline(passes,rowstarts,processes,proglsnr)
+            proglsnr(1.0)
+            return Diagram((width,height),content)
+        
+    try:
+        passes = []
+        for pclass in patternlist:
+            start = time.time()
+            passes.append(make_pass(pclass,grid,cells,rowstarts,maxlive))
+            passes[-1].seconds = time.time() - start
+            passes[-1].rejects = rejects
+            passes[-1].activity = activity
+        run_passes(passes,rowstarts,proglsnr,budget,stats is not None)
+    except BudgetExceeded as e:
+        if budget.fallback is None: raise
+        try:
+            diagram = process_diagram(text,budget.fallback,proglsnr,maxlive,
+                budget=budget.for_fallback(),stats=stats,rejects=rejects,
+                activity=activity)
+        except BudgetExceeded as f:
+            raise BudgetExceeded(f.budget,f.value,f.limit,first=e)
+        return diagram._replace(exceeded=e.budget)
+    if stats is not None:
+        stats.passes = [s for p in passes for s in p.stats_by_class()]
+    proglsnr(1.0)            
+    content = []
+    for p in passes:
+        for m in p.complete_matches:
+            content.extend(m.render())
+
+    return Diagram((width,height),content)
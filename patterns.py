@@ -28,6 +28,7 @@ Pattern classes go here
 """
 
 import math
+import bisect
 from core import *
 
 TEXT_CHARS = ( "".join([chr(x) for x in range(ord('0'),ord('9')+1)])
@@ -40,6 +41,10 @@ class LiteralPattern(Pattern):
     pos = None
     char = None
     
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars=None,offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
         self.pos = self.curr.col,self.curr.row
@@ -48,8 +53,8 @@ class LiteralPattern(Pattern):
                 and not self.curr.char in (START_OF_INPUT,END_OF_INPUT) ):
             yield M_OCCUPIED
         else:
-            self.reject()
-        return
+            yield REJECTED
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -63,34 +68,47 @@ class DocumentBoxPattern(Pattern):
     fold = False
     wave = False
     
+    @classmethod
+    def needs(cls):
+        return "+-|"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="+",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+        
+    @classmethod
+    def top_edges(cls):
+        return [ TopEdge(left="+",right="+",dashed=False,side="|",slant=0), 
+                TopEdge(left="+",right=".",dashed=False,side="|",slant=0) ]
+    
     def matcher(self):
         w,h = 0,0
         self.curr = yield
         
         # Top part with fold
         self.tl = self.curr.col,self.curr.row
-        self.curr = yield self.expect("+",M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)
-        self.curr = yield self.expect("-",M_OCCUPIED|M_BOX_START_S)
+        self.curr = yield self.expect_or_reject("+",M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)
+        self.curr = yield self.expect_or_reject("-",M_OCCUPIED|M_BOX_START_S)
         while self.curr.char == "-":
-            self.curr = yield self.expect("-",M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("-",M_OCCUPIED|M_BOX_START_S)
         if self.curr.char == "+":
             w = self.curr.col-self.tl[0]+1
             self.fold = False
-            self.curr = yield self.expect("+",M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("+",M_OCCUPIED|M_BOX_START_S)
         else:
             w = self.curr.col-self.tl[0]+1 + 2
             self.fold = True
-            self.curr = yield self.expect(".",M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject(".",M_OCCUPIED|M_BOX_START_S)
         self.curr = yield M_BOX_AFTER_E
         for meta in self.await_pos(self.offset(0,1,self.tl)):
             self.curr = yield meta
         if self.fold:
-            self.curr = yield self.expect("|",M_OCCUPIED|M_BOX_START_E)
+            self.curr = yield self.expect_or_reject("|",M_OCCUPIED|M_BOX_START_E)
             for meta in self.await_pos(self.offset(w-4,1,self.tl)):
                 self.curr = yield meta
-            self.curr = yield self.expect("|",M_OCCUPIED)
-            self.curr = yield self.expect("_",M_OCCUPIED)
-            self.curr = yield self.expect("\\",M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("|",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("_",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("\\",M_OCCUPIED|M_BOX_START_S)
             self.curr = yield M_BOX_AFTER_E
             for meta in self.await_pos(self.offset(0,2,self.tl)):
                 self.curr = yield meta
@@ -98,10 +116,10 @@ class DocumentBoxPattern(Pattern):
         # middle section
         while True:
             linestart = self.curr.col,self.curr.row
-            self.curr = yield self.expect("|",M_OCCUPIED|M_BOX_START_E)
+            self.curr = yield self.expect_or_reject("|",M_OCCUPIED|M_BOX_START_E)
             for meta in self.await_pos(self.offset(w-2,0)):
                 self.curr = yield meta
-            self.curr = yield self.expect("|",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("|",M_OCCUPIED)
             self.curr = yield M_BOX_AFTER_E
             for meta in self.await_pos(self.offset(0,1,linestart)):
                 self.curr = yield meta
@@ -111,27 +129,27 @@ class DocumentBoxPattern(Pattern):
         linestart = self.curr.col,self.curr.row
         if self.curr.char == "'" or not self.fold:
             self.wave = True
-            self.curr = yield self.expect("'",M_OCCUPIED|M_BOX_START_E)
+            self.curr = yield self.expect_or_reject("'",M_OCCUPIED|M_BOX_START_E)
             while self.curr.col < linestart[0]+w-2:
-                self.curr = yield self.expect(".",M_OCCUPIED)
+                self.curr = yield self.expect_or_reject(".",M_OCCUPIED)
                 while self.curr.col < linestart[0]+w-4:
-                    self.curr = yield self.expect("_",M_OCCUPIED)
+                    self.curr = yield self.expect_or_reject("_",M_OCCUPIED)
                     if self.curr.char == ".": break
-                self.curr = yield self.expect(".",M_OCCUPIED)
+                self.curr = yield self.expect_or_reject(".",M_OCCUPIED)
                 while self.curr.col < linestart[0]+w-2:
-                    self.curr = yield self.expect("-",M_OCCUPIED)
+                    self.curr = yield self.expect_or_reject("-",M_OCCUPIED)
                     if self.curr.char == ".": break
-            self.curr = yield self.expect(".",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject(".",M_OCCUPIED)
             self.br = self.curr.col,self.curr.row
-            self.curr = yield self.expect("|",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("|",M_OCCUPIED)
             self.curr = yield M_BOX_AFTER_E
         else:
             self.wave = False
-            self.curr = yield self.expect("+",M_OCCUPIED|M_BOX_START_E)
+            self.curr = yield self.expect_or_reject("+",M_OCCUPIED|M_BOX_START_E)
             for n in range(w-2):
-                self.curr = yield self.expect("-",M_OCCUPIED)
+                self.curr = yield self.expect_or_reject("-",M_OCCUPIED)
             self.br = self.curr.col,self.curr.row
-            self.curr = yield self.expect("+",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("+",M_OCCUPIED)
             self.curr = yield M_BOX_AFTER_E
         try:
             for meta in self.await_pos(self.offset(0,1,linestart)):
@@ -140,7 +158,7 @@ class DocumentBoxPattern(Pattern):
                 self.curr = yield M_BOX_AFTER_S
         except NoSuchPosition: pass
             
-        return
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -196,42 +214,63 @@ class DbCylinderPattern(Pattern):
     tl = None
     br = None
     
+    @classmethod
+    def needs(cls):
+        return ".-'|"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars=".",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+        
+    @classmethod
+    def top_edges(cls):
+        return [ TopEdge(left=".",right=".",dashed=False,side="'",slant=0) ]
+    
     def matcher(self):
         w,h = 0,0
         self.curr = yield
         self.tl = (self.curr.col,self.curr.row)
-        self.curr = yield self.expect(".",M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)
-        self.curr = yield self.expect("-",M_OCCUPIED|M_BOX_START_S)
+        if self.grid is not None:
+            found = self.find(self.grid)
+            if found is None: 
+                yield REJECTED
+            else:
+                for meta in self.follow(*found):
+                    self.curr = yield meta
+                yield FINISHED
+            return
+        self.curr = yield self.expect_or_reject(".",M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)
+        self.curr = yield self.expect_or_reject("-",M_OCCUPIED|M_BOX_START_S)
         while self.curr.char != ".":
-            self.curr = yield self.expect("-",M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("-",M_OCCUPIED|M_BOX_START_S)
         w = self.curr.col-self.tl[0]+1
-        self.curr = yield self.expect(".",M_OCCUPIED|M_BOX_START_S)
+        self.curr = yield self.expect_or_reject(".",M_OCCUPIED|M_BOX_START_S)
         self.curr = yield M_BOX_AFTER_E
         for meta in self.await_pos(self.offset(0,1,self.tl)):
             self.curr = yield meta
-        self.curr = yield self.expect("'",M_OCCUPIED|M_BOX_START_E)
+        self.curr = yield self.expect_or_reject("'",M_OCCUPIED|M_BOX_START_E)
         for n in range(w-2):
-            self.curr = yield self.expect("-",M_OCCUPIED)
-        self.curr = yield self.expect("'",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("-",M_OCCUPIED)
+        self.curr = yield self.expect_or_reject("'",M_OCCUPIED)
         self.curr = yield M_BOX_AFTER_E
         for meta in self.await_pos(self.offset(0,2,self.tl)):
             self.curr = yield meta
         while True:    
             linestart = self.curr.col,self.curr.row
-            self.curr = yield self.expect("|",M_OCCUPIED|M_BOX_START_E)
+            self.curr = yield self.expect_or_reject("|",M_OCCUPIED|M_BOX_START_E)
             for meta in self.await_pos(self.offset(w-2,0)):
                 self.curr = yield meta
-            self.curr = yield self.expect("|",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("|",M_OCCUPIED)
             self.curr = yield M_BOX_AFTER_E
             for meta in self.await_pos(self.offset(0,1,linestart)):
                 self.curr = yield meta
             if self.curr.char == "'": break
         linestart = self.curr.col,self.curr.row
-        self.curr = yield self.expect("'",M_OCCUPIED|M_BOX_START_E)
+        self.curr = yield self.expect_or_reject("'",M_OCCUPIED|M_BOX_START_E)
         for n in range(w-2):
-            self.curr = yield self.expect("-",M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("-",M_OCCUPIED)
         self.br = (self.curr.col,self.curr.row)
-        self.curr = yield self.expect("'",M_OCCUPIED)
+        self.curr = yield self.expect_or_reject("'",M_OCCUPIED)
         try:
             self.curr = yield M_BOX_AFTER_E
             for meta in self.await_pos(self.offset(0,1,linestart)):
@@ -240,7 +279,60 @@ class DbCylinderPattern(Pattern):
                 for meta in self.await_pos(self.offset(1,0)):
                     self.curr = yield M_BOX_AFTER_S
         except NoSuchPosition: pass
-        return
+        yield FINISHED
+        
+    def find(self,grid):
+        """Checks the whole cylinder from its top-left corner. Returns the 
+        meta for each position in scan order and the position at which the 
+        match completes, or None if there is no cylinder here"""
+        x,y = self.tl
+        def ok(col,row,chars):
+            return( self.is_in(grid.char_at(col,row),chars) 
+                and not grid.meta_at(col,row) & M_OCCUPIED )
+        found = []
+        # top
+        if not ok(x,y,".") or not ok(x+1,y,"-"): return None
+        found.append(((x,y),M_OCCUPIED|M_BOX_START_S|M_BOX_START_E))
+        col = x+1
+        while grid.char_at(col,y) != ".":
+            if not ok(col,y,"-"): return None
+            found.append(((col,y),M_OCCUPIED|M_BOX_START_S))
+            col += 1
+        if not ok(col,y,"."): return None
+        found.append(((col,y),M_OCCUPIED|M_BOX_START_S))
+        found.append(((col+1,y),M_BOX_AFTER_E))
+        w = col-x+1
+        def edge(row):
+            if not ok(x,row,"'"): return False
+            found.append(((x,row),M_OCCUPIED|M_BOX_START_E))
+            for col in range(x+1,x+w-1):
+                if not ok(col,row,"-"): return False
+                found.append(((col,row),M_OCCUPIED))
+            if not ok(x+w-1,row,"'"): return False
+            found.append(((x+w-1,row),M_OCCUPIED))
+            found.append(((x+w,row),M_BOX_AFTER_E))
+            return True
+        # underside of top
+        row = y+1
+        if not edge(row): return None
+        # middle section
+        while True:
+            row += 1
+            if not ok(x,row,"|") or not ok(x+w-1,row,"|"): return None
+            found.append(((x,row),M_OCCUPIED|M_BOX_START_E))
+            found.append(((x+w-1,row),M_OCCUPIED))
+            found.append(((x+w,row),M_BOX_AFTER_E))
+            if grid.char_at(x,row+1) is None: return None
+            if grid.char_at(x,row+1) == "'": break
+        # bottom
+        row += 1
+        if not edge(row): return None
+        self.br = (x+w-1,row)
+        # below
+        for col in range(x,x+w):
+            if grid.char_at(col,row+1) in (None,END_OF_INPUT): break
+            found.append(((col,row+1),M_BOX_AFTER_S))
+        return found,(x+w,row+1)
         
     def render(self):
         Pattern.render(self)
@@ -265,6 +357,24 @@ class RectangularBoxPattern(Pattern):
     vs = None
     dashed = False
 
+    @classmethod
+    def needs(cls):
+        return "-"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="".join([c[0] for c in cls.cnrchars]),offset=0,
+            meta=M_NONE,nometa=M_OCCUPIED)
+            
+    @classmethod
+    def top_edges(cls):
+        # the corners are told apart by the top left one
+        tlcnrs = [c[0] for c in cls.cnrchars]
+        return [ TopEdge(left=c[0],right=c[1],dashed=dashed,side=";" if dashed else "|",
+                    slant=0) 
+                for n,c in enumerate(cls.cnrchars) if tlcnrs.index(c[0]) == n 
+                for dashed in (False,True) ]
+
     def matcher(self):
         w,h = 0,0
         self.hs,self.vs = [],[]
@@ -276,47 +386,72 @@ class RectangularBoxPattern(Pattern):
         # top left corner
         tlcnrs = [c[0] for c in self.cnrchars]
         cnrtype = tlcnrs.index(self.curr.char) if self.curr.char in tlcnrs else -1
-        self.curr = yield self.expect(tlcnrs,meta=M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)
+        self.curr = yield self.expect_or_reject(tlcnrs,meta=M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)
         
         # top line 
-        self.curr = yield self.expect("-",meta=M_OCCUPIED|M_BOX_START_S)
+        self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED|M_BOX_START_S)
         if self.curr.char == " ": 
             # dashed box detection
             self.dashed = True
-            self.curr = yield self.expect(" ",meta=M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject(" ",meta=M_OCCUPIED|M_BOX_START_S)
         while self.curr.char != self.cnrchars[cnrtype][1]:
             if self.dashed:
-                self.curr = yield self.expect("-",meta=M_OCCUPIED|M_BOX_START_S)
-                self.curr = yield self.expect(" ",meta=M_OCCUPIED|M_BOX_START_S)
+                self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED|M_BOX_START_S)
+                self.curr = yield self.expect_or_reject(" ",meta=M_OCCUPIED|M_BOX_START_S)
             else:
-                self.curr = yield self.expect("-",meta=M_OCCUPIED|M_BOX_START_S)
+                self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED|M_BOX_START_S)
         w = self.curr.col-self.tl[0]+1
+        self.reach = self.offset(w-1,1,self.tl)
         
         # top right corner
-        self.curr = yield self.expect(self.cnrchars[cnrtype][1],meta=M_OCCUPIED|M_BOX_START_S)
+        self.curr = yield self.expect_or_reject(self.cnrchars[cnrtype][1],meta=M_OCCUPIED|M_BOX_START_S)
         self.curr = yield M_BOX_AFTER_E
         
         # next line
         for meta in self.await_pos(self.offset(0,1,rowstart)): 
             self.curr = yield meta
             
-        # first content line left side
+        # with the grid, the characters of the rest of the outline are checked
+        # up front, and only those cells of the content which may be 
+        # separators are visited
         rowstart = self.curr.col,self.curr.row
-        self.curr = yield self.expect(";" if self.dashed else "|",meta=M_OCCUPIED|M_BOX_START_E)
+        self.reach = self.offset(w-1,1,rowstart)
+        grid = self.grid
+        if grid is not None and not self.outline_found(grid,w,cnrtype):
+            yield REJECTED
+            
+        # first content line left side
+        self.curr = yield self.expect_or_reject(";" if self.dashed else "|",meta=M_OCCUPIED|M_BOX_START_E)
 
         # first content line content
-        for n in range(w-2):
-            if( not self.occupied() and self.curr.char == "|"
-                    and self.curr.col-lastvs > 1 ):
-                self.vs.append(self.curr.col)
-                lastvs = self.curr.col
-                self.curr = yield M_OCCUPIED
-            else:
-                self.curr = yield M_NONE
-            if self.curr.char == "\n": self.reject()
+        if grid is not None:
+            bars = grid.positions(rowstart[1],"|")
+            first = bisect.bisect(bars,rowstart[0])
+            last = bisect.bisect_left(bars,rowstart[0]+w-1)
+            for col in bars[first:last]:
+                for meta in self.await_pos((col,rowstart[1])):
+                    self.curr = yield meta
+                if not self.occupied() and col-lastvs > 1:
+                    self.vs.append(col)
+                    lastvs = col
+                    self.curr = yield M_OCCUPIED
+                else:
+                    self.curr = yield M_NONE
+            for meta in self.await_pos(self.offset(w-1,0,rowstart)):
+                self.curr = yield meta
+        else:
+            for n in range(w-2):
+                if( not self.occupied() and self.curr.char == "|"
+                        and self.curr.col-lastvs > 1 ):
+                    self.vs.append(self.curr.col)
+                    lastvs = self.curr.col
+                    self.curr = yield M_OCCUPIED
+                else:
+                    self.curr = yield M_NONE
+                if self.curr.char == "\n": yield REJECTED
             
         # first content line right side
-        self.curr = yield self.expect(";" if self.dashed else "|",meta=M_OCCUPIED)
+        self.curr = yield self.expect_or_reject(";" if self.dashed else "|",meta=M_OCCUPIED)
         self.curr = yield M_BOX_AFTER_E
             
         # next line
@@ -328,7 +463,8 @@ class RectangularBoxPattern(Pattern):
         
             # left side
             rowstart = self.curr.col,self.curr.row
-            self.curr = yield self.expect(";" if self.dashed else "|",meta=M_OCCUPIED|M_BOX_START_E)
+            self.reach = self.offset(w-1,1,rowstart)
+            self.curr = yield self.expect_or_reject(";" if self.dashed else "|",meta=M_OCCUPIED|M_BOX_START_E)
 
             # content            
             if( not self.occupied() and self.curr.char == "-"
@@ -338,20 +474,28 @@ class RectangularBoxPattern(Pattern):
                 lasths = self.curr.row
                 for n in range(w-2):
                     if self.curr.col in self.vs:
-                        self.curr = yield self.expect("-|",meta=M_OCCUPIED)
+                        self.curr = yield self.expect_or_reject("-|",meta=M_OCCUPIED)
                     else:
-                        self.curr = yield self.expect("-",meta=M_OCCUPIED)
+                        self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED)
+            elif grid is not None:
+                # non-separator, visiting only the vertical separators
+                for col in self.vs:
+                    for meta in self.await_pos((col,rowstart[1])):
+                        self.curr = yield meta
+                    self.curr = yield self.expect_or_reject("|",meta=M_OCCUPIED)
+                for meta in self.await_pos(self.offset(w-1,0,rowstart)):
+                    self.curr = yield meta
             else:
                 # non-separator
                 for n in range(w-2):
                     if self.curr.col in self.vs:
-                        self.curr = yield self.expect("|",meta=M_OCCUPIED)
+                        self.curr = yield self.expect_or_reject("|",meta=M_OCCUPIED)
                     else:
                         self.curr = yield M_NONE
-                    if self.curr.char == "\n": self.reject() 
+                    if self.curr.char == "\n": yield REJECTED 
             
             # right side
-            self.curr = yield self.expect(";" if self.dashed else "|",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject(";" if self.dashed else "|",meta=M_OCCUPIED)
             self.curr = yield M_BOX_AFTER_E
             
             # next line
@@ -360,20 +504,21 @@ class RectangularBoxPattern(Pattern):
             
         # bottom left corner        
         rowstart = self.curr.col,self.curr.row
-        self.curr = yield self.expect(self.cnrchars[cnrtype][2],meta=M_OCCUPIED|M_BOX_START_E)
+        self.reach = None
+        self.curr = yield self.expect_or_reject(self.cnrchars[cnrtype][2],meta=M_OCCUPIED|M_BOX_START_E)
         
         # bottom line
         if self.dashed:
             for n in range((w-2)/2):
-                self.curr = yield self.expect("-",meta=M_OCCUPIED)
-                self.curr = yield self.expect(" ",meta=M_OCCUPIED)
+                self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED)
+                self.curr = yield self.expect_or_reject(" ",meta=M_OCCUPIED)
         else:
             for n in range(w-2):
-                self.curr = yield self.expect("-",meta=M_OCCUPIED)
+                self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED)
             
         # bottom right corner
         self.br = (self.curr.col,self.curr.row)
-        self.curr = yield self.expect(self.cnrchars[cnrtype][3],meta=M_OCCUPIED)
+        self.curr = yield self.expect_or_reject(self.cnrchars[cnrtype][3],meta=M_OCCUPIED)
         self.curr = yield M_BOX_AFTER_E
         
         # optional final line
@@ -389,7 +534,32 @@ class RectangularBoxPattern(Pattern):
                 self.curr = yield M_BOX_AFTER_S
                 
         except NoSuchPosition: pass
-        return
+        yield FINISHED
+        
+    def outline_found(self,grid,w,cnrtype):
+        """Checks the characters of the sides and bottom of a box w wide from 
+        the top left corner, using the grid's tables of runs. The characters
+        can't change, so a box failing this can be rejected at once, while 
+        the meta is left to be checked as each cell is reached"""
+        x,y = self.tl
+        side = ";" if self.dashed else "|"
+        cnrs = self.cnrchars[cnrtype]
+        # the left side runs down to the bottom left corner, and the right 
+        # side at least as far
+        h = grid.vrun(x,y+1,side)
+        right = grid.vrun(x+w-1,y+1,side)
+        bottom = y+1+h
+        if grid.char_at(x+w-1,y+1+min(h,right)) is None:
+            # the box runs past the edge of the diagram
+            self.reach = (x+w-1,y+1+min(h,right))
+            return False
+        if h == 0 or right < h or grid.char_at(x,bottom) != cnrs[2]:
+            return False
+        if self.dashed:
+            edge = grid.hrun(x+1,bottom,"- ") >= (w-2)/2
+        else:
+            edge = grid.hrun(x+1,bottom,"-") >= w-2
+        return edge and grid.char_at(x+w-1,bottom) == cnrs[3]
 
 
 class RoundedRectangularBoxPattern(RectangularBoxPattern):
@@ -461,6 +631,18 @@ class ParagmBoxPattern(Pattern):
     hs = None
     vs = None
 
+    @classmethod
+    def needs(cls):
+        return "+-/"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="+",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+        
+    @classmethod
+    def top_edges(cls):
+        return [ TopEdge(left="+",right="+",dashed=False,side="/",slant=-1) ]
+
     def matcher(self):
         w,h = 0,0
         self.hs,self.vs = [],[]
@@ -470,16 +652,16 @@ class ParagmBoxPattern(Pattern):
         lastvs,lasths = self.tl
         
         # top left corner
-        self.curr = yield self.expect("+",meta=M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)
+        self.curr = yield self.expect_or_reject("+",meta=M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)
         
         # top line 
-        self.curr = yield self.expect("-",meta=M_OCCUPIED|M_BOX_START_S)
+        self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED|M_BOX_START_S)
         while self.curr.char != "+":
-            self.curr = yield self.expect("-",meta=M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED|M_BOX_START_S)
         w = self.curr.col-self.tl[0]+1
         
         # top right corner
-        self.curr = yield self.expect("+",meta=M_OCCUPIED|M_BOX_START_S)
+        self.curr = yield self.expect_or_reject("+",meta=M_OCCUPIED|M_BOX_START_S)
         self.curr = yield M_BOX_AFTER_E
         
         # next line
@@ -489,14 +671,14 @@ class ParagmBoxPattern(Pattern):
         while True:    
             # left side
             rowstart = self.curr.col,self.curr.row
-            self.curr = yield self.expect("/",meta=M_OCCUPIED|M_BOX_START_E)
+            self.curr = yield self.expect_or_reject("/",meta=M_OCCUPIED|M_BOX_START_E)
 
             # content
             for meta in self.await_pos(self.offset(w-1,0,rowstart)):
                 self.curr = yield meta
                 
             # right side
-            self.curr = yield self.expect("/",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("/",meta=M_OCCUPIED)
             self.curr = yield M_BOX_AFTER_E
             
             # next line
@@ -507,15 +689,15 @@ class ParagmBoxPattern(Pattern):
             
         # bottom left corner        
         rowstart = self.curr.col,self.curr.row
-        self.curr = yield self.expect("+",meta=M_OCCUPIED|M_BOX_START_E)
+        self.curr = yield self.expect_or_reject("+",meta=M_OCCUPIED|M_BOX_START_E)
         
         # bottom line
         for n in range(w-2):
-            self.curr = yield self.expect("-",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED)
             
         # bottom right corner
         self.br = (self.curr.col,self.curr.row)
-        self.curr = yield self.expect("+",meta=M_OCCUPIED)
+        self.curr = yield self.expect_or_reject("+",meta=M_OCCUPIED)
         self.curr = yield M_BOX_AFTER_E
         
         # optional final line
@@ -531,7 +713,7 @@ class ParagmBoxPattern(Pattern):
                 self.curr = yield M_BOX_AFTER_S
                 
         except NoSuchPosition: pass
-        return
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -554,36 +736,49 @@ class EllipticalBoxPattern(Pattern):
     tl = None
     br = None
 
+    @classmethod
+    def needs(cls):
+        return ".-'|"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars=".",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+
     def matcher(self):
         self.curr = yield
+        if( self.grid is not None 
+                and not self.outline_found(self.grid,self.curr.col,self.curr.row) ):
+            yield REJECTED
         self.tl = 0,self.curr.row
         rowstart = self.curr.col,self.curr.row
         rowwidth = 0
         slashrows = 0
         
-        self.curr = yield self.expect(".",meta=M_BOX_START_S|M_BOX_START_E|M_OCCUPIED)
+        self.curr = yield self.expect_or_reject(".",meta=M_BOX_START_S|M_BOX_START_E|M_OCCUPIED)
         i = 0
         while True:
-            self.curr = yield self.expect("-",meta=M_BOX_START_S|M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("-",meta=M_BOX_START_S|M_OCCUPIED)
             i += 1
             if self.curr.char != "-": break
-        self.curr = yield self.expect(".",meta=M_BOX_START_S|M_OCCUPIED)
+        self.curr = yield self.expect_or_reject(".",meta=M_BOX_START_S|M_OCCUPIED)
         self.curr = yield M_BOX_AFTER_E
         rowwidth = i+4
         rowstart = rowstart[0]-1,rowstart[1]+1
+        self.reach = self.offset(rowwidth-1,0,rowstart)
         for meta in self.await_pos(rowstart):
             self.curr = yield meta
             
         while True:
             if self.curr.char != "/": break
-            self.curr = yield self.expect("/",meta=M_OCCUPIED|M_BOX_START_E|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("/",meta=M_OCCUPIED|M_BOX_START_E|M_BOX_START_S)
             for meta in self.await_pos(self.offset(rowwidth-1,0,rowstart)):
                 self.curr = yield meta
-            self.curr = yield self.expect("\\",meta=M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("\\",meta=M_OCCUPIED|M_BOX_START_S)
             self.curr = yield M_BOX_AFTER_E
             slashrows += 1
             rowwidth += 2
             rowstart = rowstart[0]-1,rowstart[1]+1
+            self.reach = self.offset(rowwidth-1,0,rowstart)
             for meta in self.await_pos(rowstart):
                 self.curr = yield meta
         
@@ -591,14 +786,15 @@ class EllipticalBoxPattern(Pattern):
         self.br = self.curr.col+(rowwidth-1),0
         first = True
         while True:
-            self.curr = yield self.expect("|",meta=M_BOX_START_E|M_OCCUPIED
+            self.curr = yield self.expect_or_reject("|",meta=M_BOX_START_E|M_OCCUPIED
                     | (M_BOX_START_S if first else M_NONE))
             for meta in self.await_pos(self.offset(rowwidth-1,0,rowstart)):
                 self.curr = yield meta
-            self.curr = yield self.expect("|",meta=M_OCCUPIED
+            self.curr = yield self.expect_or_reject("|",meta=M_OCCUPIED
                     | (M_BOX_START_S if first else M_NONE))
             self.curr = yield M_BOX_AFTER_E
             rowstart = rowstart[0],rowstart[1]+1
+            self.reach = self.offset(rowwidth-2,0,rowstart)
             for meta in self.await_pos(rowstart):
                 self.curr = yield meta
             if self.curr.char != "|": break
@@ -609,22 +805,24 @@ class EllipticalBoxPattern(Pattern):
 
         while slashrows > 0:
             self.curr = yield M_BOX_AFTER_S
-            self.curr = yield self.expect("\\",meta=M_OCCUPIED|M_BOX_START_E)
+            self.curr = yield self.expect_or_reject("\\",meta=M_OCCUPIED|M_BOX_START_E)
             for meta in self.await_pos(self.offset(rowwidth-1,0,rowstart)):
                 self.curr = yield meta
-            self.curr = yield self.expect("/",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("/",meta=M_OCCUPIED)
             self.curr = yield M_BOX_AFTER_E|M_BOX_AFTER_S
             slashrows -= 1
             rowwidth -= 2
             rowstart = rowstart[0]+1,rowstart[1]+1
+            self.reach = self.offset(rowwidth-1,0,rowstart)
             for meta in self.await_pos(self.offset(-1,0,rowstart)):
                 self.curr = yield meta
         
         self.curr = yield M_BOX_AFTER_S
-        self.curr = yield self.expect("'",meta=M_BOX_START_E|M_OCCUPIED)
+        self.curr = yield self.expect_or_reject("'",meta=M_BOX_START_E|M_OCCUPIED)
         for i in range(rowwidth-2):
-            self.curr = yield self.expect("-",meta=M_OCCUPIED)
-        self.curr = yield self.expect("'",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("-",meta=M_OCCUPIED)
+        self.reach = None
+        self.curr = yield self.expect_or_reject("'",meta=M_OCCUPIED)
         self.br = self.br[0],self.curr.row
         self.curr = yield M_BOX_AFTER_E|M_BOX_AFTER_S
         
@@ -635,7 +833,32 @@ class EllipticalBoxPattern(Pattern):
                     self.curr = yield meta
                 self.curr = yield M_BOX_AFTER_S
         except NoSuchPosition: pass
-        return 
+        yield FINISHED
+        
+    def outline_found(self,grid,x,y):
+        """Checks the characters of the outline from the top left corner at 
+        (x,y), using the grid's tables of runs. The rows of each slope and of
+        the sides are as many as the characters give, whatever the meta, so 
+        an ellipse failing this can be rejected at once, while the meta is 
+        left to be checked as each cell is reached"""
+        w = grid.hrun(x+1,y,"-")
+        if w == 0 or grid.char_at(x+w+1,y) != ".":
+            return False
+        # the slopes widening from the top
+        slopes = grid.drun(x-1,y+1,-1,"/")
+        if grid.drun(x+w+2,y+1,1,"\\") < slopes:
+            return False
+        left,right,top = x-1-slopes,x+w+2+slopes,y+1+slopes
+        h = grid.vrun(left,top,"|")
+        if h == 0 or grid.vrun(right,top,"|") < h:
+            return False
+        # the slopes narrowing to the bottom
+        if( grid.drun(left+1,top+h,1,"\\") < slopes 
+                or grid.drun(right-1,top+h,-1,"/") < slopes ):
+            return False
+        bottom = top+h+slopes
+        return( grid.char_at(x,bottom) == "'" and grid.hrun(x+1,bottom,"-") >= w
+                and grid.char_at(x+w+1,bottom) == "'" )
     
     def render(self):
         Pattern.render(self)
@@ -650,9 +873,13 @@ class LineSqCornerPattern(Pattern):
     pos = None
     ends = None
     
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="+",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
-        if self.occupied(): self.reject()
+        if self.occupied(): yield REJECTED
         self.pos = self.curr.col,self.curr.row
         self.ends = []
         for m,dm,x,y in [
@@ -662,7 +889,7 @@ class LineSqCornerPattern(Pattern):
                 (M_LINE_AFTER_SW,M_DASH_AFTER_SW,1,-1) ]:
             if self.curr.meta & m: 
                 self.ends.append((x,y,bool(self.curr.meta & dm)))            
-        self.curr = yield self.expect("+")
+        self.curr = yield self.expect_or_reject("+")
         for m,dm,x,y in [
                 (M_LINE_START_E, M_DASH_START_E, 1,0),
                 (M_LINE_START_SW,M_DASH_START_SW,-1,1),
@@ -674,8 +901,8 @@ class LineSqCornerPattern(Pattern):
                 if self.curr.meta & m:
                     self.ends.append((x,y,bool(self.curr.meta & dm)))    
             except NoSuchPosition: pass
-        if len(self.ends) < 2: self.reject()            
-        return 
+        if len(self.ends) < 2: yield REJECTED            
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -693,10 +920,14 @@ class LineRdCornerPattern(Pattern):
     pos = None
     ends = None
     
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars=".':",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
         
-        if self.occupied(): self.reject()
+        if self.occupied(): yield REJECTED
         
         self.pos = self.curr.col,self.curr.row
         
@@ -707,7 +938,7 @@ class LineRdCornerPattern(Pattern):
             up = True
         elif self.curr.char == ":": 
             up,down = True,True
-        else: self.reject()
+        else: yield REJECTED
         
         self.ends = []
         for m,dm,x,y in [ 
@@ -732,8 +963,8 @@ class LineRdCornerPattern(Pattern):
                 if self.curr.meta & m: self.ends.append((x,y,self.curr.meta & dm))
             except NoSuchPosition: pass
         
-        if len(self.ends) < 2: self.reject()
-        return 
+        if len(self.ends) < 2: yield REJECTED
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -766,21 +997,29 @@ class ShortLinePattern(Pattern):
     tobox = False
     stroketype = None
 
+    @classmethod
+    def needs(cls):
+        return cls.char
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars=cls.char,offset=1,meta=M_NONE,nometa=M_OCCUPIED)
+
     def matcher(self):
         self.curr = yield
-        if self.is_in(self.curr.char,TEXT_CHARS): self.reject()
+        if self.is_in(self.curr.char,TEXT_CHARS): yield REJECTED
         self.curr = yield M_NONE
         self.pos = self.curr.col,self.curr.row
         if self.curr.meta & self.boxstartmeta: self.frombox = True
-        self.curr = yield self.expect(self.char,meta=M_OCCUPIED|self.startmeta)
-        if self.is_in(self.curr.char,TEXT_CHARS): self.reject()
+        self.curr = yield self.expect_or_reject(self.char,meta=M_OCCUPIED|self.startmeta)
+        if self.is_in(self.curr.char,TEXT_CHARS): yield REJECTED
         try:
             for meta in self.await_pos(self.offset(self.xdir,self.ydir,self.pos)):
                 self.curr = yield meta
             if self.curr.meta & self.boxendmeta: self.tobox = True
             if self.curr.char != END_OF_INPUT: yield self.endmeta
         except NoSuchPosition: pass
-        return
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -807,19 +1046,27 @@ class LongLinePattern(Pattern):
     frombox = False
     tobox = False
     
+    @classmethod
+    def needs(cls):
+        return "".join(cls.startchars)
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars=cls.startchars[0],offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         length = 0
         self.curr = yield
         pos = self.curr.col,self.curr.row
         self.startpos = pos
         if self.curr.meta & self.boxstartmeta: self.frombox = True
-        self.curr = yield self.expect(self.startchars[0],meta=M_OCCUPIED|self.startmeta)
+        self.curr = yield self.expect_or_reject(self.startchars[0],meta=M_OCCUPIED|self.startmeta)
         length += 1
         for startchar in self.startchars[1:]:
             for meta in self.await_pos(self.offset(self.xdir,self.ydir,pos)):
                 self.curr = yield meta
             pos = self.curr.col,self.curr.row
-            self.curr = yield self.expect(startchar,meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject(startchar,meta=M_OCCUPIED)
             length += 1
         try:
             breaknow = False
@@ -832,18 +1079,18 @@ class LongLinePattern(Pattern):
                             breaknow = True
                             break
                         else:
-                            self.reject()
+                            yield REJECTED
                     pos = self.curr.col,self.curr.row
-                    self.curr = yield self.expect(midchar,meta=M_OCCUPIED)
+                    self.curr = yield self.expect_or_reject(midchar,meta=M_OCCUPIED)
                     length += 1
             self.endpos = pos
-            if length < 2: self.reject()
+            if length < 2: yield REJECTED
             if self.curr.meta & self.boxendmeta: self.tobox = True
             if self.curr.char != END_OF_INPUT: yield self.endmeta
         except NoSuchPosition:
             self.endpos = pos
-            if length < 2: self.reject()
-        return
+            if length < 2: yield REJECTED
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -1042,18 +1289,66 @@ class LongHorizDashedLinePattern(LongLinePattern):
     boxendmeta = M_BOX_START_E
 
 
+class PatternGroup(Pattern):
+    """A group of patterns matched together in a single pass, rather than in
+    a pass for each. The matches found are those the member classes would 
+    find in passes of their own, in the order listed"""
+    
+    members = []
+    
+    
+class LineGroupPattern(PatternGroup):
+    """A group of line patterns, whose pass traces runs of their characters 
+    rather than trying a matcher at every cell (see main.LineTracerPass)"""
+
+
+class LongLinesPattern(LineGroupPattern):
+
+    members = [
+        LongHorizDashedLinePattern,
+        LongHorizLinePattern,
+        LongVertDashedLinePattern,
+        LongVertLinePattern,
+        LongUpDiagDashedLinePattern,
+        LongUpDiagLinePattern,
+        LongDownDiagDashedLinePattern,
+        LongDownDiagLinePattern,
+    ]
+    
+    
+class ShortLinesPattern(LineGroupPattern):
+
+    members = [
+        ShortHorizLinePattern,
+        ShortVertDashedLinePattern,
+        ShortVertLinePattern,
+        ShortUpDiagDashedLinePattern,
+        ShortUpDiagLinePattern,
+        ShortDownDiagDashedLinePattern,
+        ShortDownDiagLinePattern,
+    ]
+
+
 class TinyCirclePattern(Pattern):
 
     pos = None
     
+    @classmethod
+    def needs(cls):
+        return "O"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="O",offset=1,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
-        if self.curr.char.isalpha(): self.reject()
+        if self.curr.char.isalpha(): yield REJECTED
         self.curr = yield M_NONE
         self.pos = self.curr.col,self.curr.row
-        self.curr = yield self.expect("O")
-        if self.curr.char.isalpha(): self.reject()
-        return
+        self.curr = yield self.expect_or_reject("O")
+        if self.curr.char.isalpha(): yield REJECTED
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -1068,19 +1363,27 @@ class SmallCirclePattern(Pattern):
     right = None
     y = None
     
+    @classmethod
+    def needs(cls):
+        return "()"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="(",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
         self.left = self.curr.col
         self.y = self.curr.row
-        self.curr = yield self.expect("(")
+        self.curr = yield self.expect_or_reject("(")
         for n in range(3):
             if self.curr.char == ")": break
             self.curr = yield M_NONE
         else:
-            self.reject()
+            yield REJECTED
         self.right = self.curr.col
-        self.curr = yield self.expect(")")
-        return
+        self.curr = yield self.expect_or_reject(")")
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -1097,28 +1400,37 @@ class JumpPattern(Pattern):
     vdash = False
     char = None
 
+    @classmethod
+    def needs(cls):
+        return cls.char
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars=cls.char,offset=0,meta=M_LINE_AFTER_E|M_LINE_AFTER_S,
+            nometa=M_OCCUPIED)
+
     def matcher(self):
         self.curr = yield
         ndash,edash,sdash,wdash = [False]*4
         if( self.curr.char != self.char or self.occupied() 
                 or not self.curr.meta & M_LINE_AFTER_E 
                 or not self.curr.meta & M_LINE_AFTER_S ):
-            self.reject()
+            yield REJECTED
         if self.curr.meta & M_DASH_AFTER_E: wdash = True
         if self.curr.meta & M_DASH_AFTER_S: ndash = True
         self.pos = self.curr.col,self.curr.row
         self.curr = yield M_OCCUPIED
         for meta in self.await_pos(self.offset(1,0,self.pos)):
             self.curr = yield meta
-        if not self.curr.meta & M_LINE_START_E: self.reject()
+        if not self.curr.meta & M_LINE_START_E: yield REJECTED
         if self.curr.meta & M_DASH_START_E: edash = True
         for meta in self.await_pos(self.offset(0,1,self.pos)):
             self.curr = yield meta
-        if not self.curr.meta & M_LINE_START_S: self.reject()
+        if not self.curr.meta & M_LINE_START_S: yield REJECTED
         if self.curr.meta & M_DASH_START_S: sdash = True
         self.hdash = edash and wdash
         self.vdash = ndash and sdash 
-        return
+        yield FINISHED
         
         
 class LJumpPattern(JumpPattern):
@@ -1170,21 +1482,29 @@ class StickManPattern(Pattern):
 
     pos = None
     
+    @classmethod
+    def needs(cls):
+        return "-|/\\"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="oO0",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
         self.pos = self.curr.col,self.curr.row
-        self.curr = yield self.expect("oO0")
+        self.curr = yield self.expect_or_reject("oO0")
         for meta in self.await_pos(self.offset(-2,1)):
             self.curr = yield meta
-        self.curr = yield self.expect("-")
-        self.curr = yield self.expect("|")
-        self.curr = yield self.expect("-")
+        self.curr = yield self.expect_or_reject("-")
+        self.curr = yield self.expect_or_reject("|")
+        self.curr = yield self.expect_or_reject("-")
         for meta in self.await_pos(self.offset(-3,1)):
             self.curr = yield meta
-        self.curr = yield self.expect("/")
-        self.curr = yield self.expect(" ")
-        self.curr = yield self.expect("\\")
-        return
+        self.curr = yield self.expect_or_reject("/")
+        self.curr = yield self.expect_or_reject(" ")
+        self.curr = yield self.expect_or_reject("\\")
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -1206,17 +1526,28 @@ class DiamondBoxPattern(Pattern):
     top = None
     width = None
 
+    @classmethod
+    def needs(cls):
+        return ".'<>"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars=".",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+
     def matcher(self):
         self.curr = yield
+        if( self.grid is not None 
+                and not self.outline_found(self.grid,self.curr.col,self.curr.row) ):
+            yield REJECTED
         
         # top peak
         self.top = self.curr.col,self.curr.row
-        self.curr = yield self.expect(".",meta=M_OCCUPIED|M_BOX_START_E|M_BOX_START_S)
+        self.curr = yield self.expect_or_reject(".",meta=M_OCCUPIED|M_BOX_START_E|M_BOX_START_S)
         apeak = self.curr.char=="'"
         if apeak:
             self.top = self.curr.col,self.curr.row
-            self.curr = yield self.expect("'",meta=M_OCCUPIED|M_BOX_START_S)
-            self.curr = yield self.expect(".",meta=M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("'",meta=M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject(".",meta=M_OCCUPIED|M_BOX_START_S)
         self.curr = yield M_BOX_AFTER_E
         
         # top slope
@@ -1229,12 +1560,12 @@ class DiamondBoxPattern(Pattern):
                     self.curr = yield M_NONE
                     break
             except NoSuchPosition: break
-            self.curr = yield self.expect(".",meta=M_OCCUPIED|M_BOX_START_E|M_BOX_START_S)
-            self.curr = yield self.expect("'",meta=M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject(".",meta=M_OCCUPIED|M_BOX_START_E|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("'",meta=M_OCCUPIED|M_BOX_START_S)
             for meta in self.await_pos(self.offset((count-1)*2+1+int(apeak),count,self.top)):
                 self.curr = yield meta
-            self.curr = yield self.expect("'",meta=M_OCCUPIED|M_BOX_START_S)
-            self.curr = yield self.expect(".",meta=M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject("'",meta=M_OCCUPIED|M_BOX_START_S)
+            self.curr = yield self.expect_or_reject(".",meta=M_OCCUPIED|M_BOX_START_S)
             self.curr = yield M_BOX_AFTER_E
             count += 1
         
@@ -1242,10 +1573,10 @@ class DiamondBoxPattern(Pattern):
         for meta in self.await_pos(self.offset(-count*2-int(apeak)+1,count,self.top)):
             self.curr = yield meta
         self.width = 4*(count-1) + 3 + 2*int(apeak)
-        self.curr = yield self.expect("<",meta=M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)    
+        self.curr = yield self.expect_or_reject("<",meta=M_OCCUPIED|M_BOX_START_S|M_BOX_START_E)    
         for meta in self.await_pos(self.offset((count-1)*2+1+int(apeak),count,self.top)):
             self.curr = yield meta
-        self.curr = yield self.expect(">",meta=M_OCCUPIED|M_BOX_START_S)
+        self.curr = yield self.expect_or_reject(">",meta=M_OCCUPIED|M_BOX_START_S)
         self.curr = yield M_BOX_AFTER_E
         
         # bottom slope
@@ -1260,12 +1591,12 @@ class DiamondBoxPattern(Pattern):
             self.curr = yield M_BOX_AFTER_S
             for meta in self.await_pos(self.offset(-(size-count)*2-int(apeak),size+count,self.top)):
                 self.curr = yield meta
-            self.curr = yield self.expect("'",meta=M_OCCUPIED|M_BOX_START_E)
-            self.curr = yield self.expect(".",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("'",meta=M_OCCUPIED|M_BOX_START_E)
+            self.curr = yield self.expect_or_reject(".",meta=M_OCCUPIED)
             for meta in self.await_pos(self.offset((size-count-1)*2+1+int(apeak),size+count,self.top)):
                 self.curr = yield meta
-            self.curr = yield self.expect(".",meta=M_OCCUPIED)
-            self.curr = yield self.expect("'",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject(".",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("'",meta=M_OCCUPIED)
             for meta in self.await_pos(self.offset((size-count-1)*2+1+int(apeak)+2,size+count,self.top)):
                 self.curr = yield meta
             self.curr = yield M_BOX_AFTER_E | M_BOX_AFTER_S
@@ -1287,10 +1618,10 @@ class DiamondBoxPattern(Pattern):
         self.curr = yield M_BOX_AFTER_S
         for meta in self.await_pos(self.offset(-int(apeak),size*2,self.top)):
             self.curr = yield meta
-        self.curr = yield self.expect("'",meta=M_OCCUPIED|M_BOX_START_E)
+        self.curr = yield self.expect_or_reject("'",meta=M_OCCUPIED|M_BOX_START_E)
         if apeak:
-            self.curr = yield self.expect(".",meta=M_OCCUPIED)
-            self.curr = yield self.expect("'",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject(".",meta=M_OCCUPIED)
+            self.curr = yield self.expect_or_reject("'",meta=M_OCCUPIED)
         for meta in self.await_pos(self.offset(int(apeak)+1,size*2,self.top)):
             self.curr = yield meta
         self.curr = yield M_BOX_AFTER_E | M_BOX_AFTER_S
@@ -1314,7 +1645,29 @@ class DiamondBoxPattern(Pattern):
                 self.curr = yield M_BOX_AFTER_S
         except NoSuchPosition: pass
         
-        return
+        yield FINISHED
+        
+    def outline_found(self,grid,x,y):
+        """Checks the characters of the slopes and peaks of a diamond from the
+        top at (x,y), using the grid's tables of runs. The rows down to the 
+        middle are as many as the upper left slope has, whatever the meta, so
+        a diamond failing this can be rejected at once, while the meta is 
+        left to be checked as each cell is reached"""
+        apeak = int(grid.char_at(x+1,y) == "'")
+        if apeak and grid.char_at(x+2,y) != ".":
+            return False
+        x += apeak
+        size = grid.drun(x-2-apeak,y+1,-2,".'")+1
+        if grid.drun(x+1+apeak,y+1,2,"'.") < size-1:
+            return False
+        if( grid.char_at(x-2*size-apeak+1,y+size) != "<" 
+                or grid.char_at(x+2*size-1+apeak,y+size) != ">" ):
+            return False
+        if( grid.drun(x-2*(size-1)-apeak,y+size+1,2,"'.") < size-1
+                or grid.drun(x+2*(size-1)-1+apeak,y+size+1,-2,".'") < size-1 ):
+            return False
+        peak = "'.'" if apeak else "'"
+        return all(grid.char_at(x-apeak+i,y+2*size) == c for i,c in enumerate(peak))
         
     def render(self):
         Pattern.render(self)
@@ -1335,6 +1688,25 @@ class DiamondBoxPattern(Pattern):
                 z=1,stroke=C_FOREGROUND,salpha=1.0,w=1,stype=STROKE_SOLID), ]
 
 
+class BoxGroupPattern(PatternGroup):
+    """A group of box patterns, whose pass finds the top edges in each row 
+    once and tries each member's matcher only where an edge it can begin 
+    with is found (see main.BoxPass). Members without top edges are tried
+    at the cells their start keys give"""
+    
+    
+class BoxesPattern(BoxGroupPattern):
+
+    members = [
+        DbCylinderPattern,
+        DocumentBoxPattern,
+        DiamondBoxPattern,
+        StraightRectangularBoxPattern,
+        RoundedRectangularBoxPattern,
+        ParagmBoxPattern,
+    ]
+
+
 class ConnectorPattern(Pattern):
 
     xdir = 0
@@ -1349,22 +1721,36 @@ class ConnectorPattern(Pattern):
     boxmeta = None
     boxrequired = True
     
+    @classmethod
+    def needs(cls):
+        return "".join([c for c in cls.chars if len(c) == 1])
+    
+    @classmethod
+    def start_key(cls):
+        if cls.flipped:
+            meta = cls.linemeta
+        elif cls.boxrequired:
+            meta = cls.boxmeta
+        else:
+            meta = M_NONE
+        return StartKey(chars=cls.chars[0],offset=0,meta=meta,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
         
         if not self.flipped:
             self.pos = self.curr.col,self.curr.row
             self.tobox = bool(self.curr.meta & self.boxmeta)
-            if self.boxrequired and not self.tobox: self.reject()
+            if self.boxrequired and not self.tobox: yield REJECTED
         else:
-            if not (self.curr.meta & self.linemeta): self.reject()
+            if not (self.curr.meta & self.linemeta): yield REJECTED
             if self.curr.meta & self.dashmeta: self.dashed = True
                 
-        self.curr = yield self.expect(self.chars[0])
+        self.curr = yield self.expect_or_reject(self.chars[0])
         for char in self.chars[1:]:
             for meta in self.await_pos(self.offset(self.xdir-1,self.ydir)):
                 self.curr = yield meta
-            self.curr = yield self.expect(char)
+            self.curr = yield self.expect_or_reject(char)
 
         if self.flipped: self.pos = self.curr.col-1,self.curr.row            
         try:    
@@ -1372,15 +1758,15 @@ class ConnectorPattern(Pattern):
                 self.curr = yield meta    
                             
             if not self.flipped:
-                if not (self.curr.meta & self.linemeta): self.reject()
+                if not (self.curr.meta & self.linemeta): yield REJECTED
                 if self.curr.meta & self.dashmeta: self.dashed = True
             else:
                 self.tobox = bool(self.curr.meta & self.boxmeta)
-                if self.boxrequired and not self.tobox: self.reject()
+                if self.boxrequired and not self.tobox: yield REJECTED
         except NoSuchPosition:
             if self.boxrequired: raise
         
-        return
+        yield FINISHED
 
 
 class ArrowheadPattern(ConnectorPattern):
@@ -1523,18 +1909,26 @@ class UOutlineArrowheadPattern(Pattern):
     tobox = False
     dashed = False
     
+    @classmethod
+    def needs(cls):
+        return "/_\\"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="/",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
-        self.curr = yield self.expect("/")
+        self.curr = yield self.expect_or_reject("/")
         if self.curr.meta & M_BOX_AFTER_S: self.tobox = True
         self.pos = self.curr.col,self.curr.row
-        self.curr = yield self.expect("_")
-        self.curr = yield self.expect("\\")
+        self.curr = yield self.expect_or_reject("_")
+        self.curr = yield self.expect_or_reject("\\")
         for meta in self.await_pos(self.offset(0,1,self.pos)):
             self.curr = yield meta
-        if not (self.curr.meta & M_LINE_START_S): self.reject()
+        if not (self.curr.meta & M_LINE_START_S): yield REJECTED
         if self.curr.meta & M_DASH_START_S: self.dashed = True
-        return
+        yield FINISHED
     
     def render(self):
         Pattern.render(self)
@@ -1560,27 +1954,35 @@ class DOutlineArrowheadPattern(Pattern):
     tobox = False
     dashed = False
     
+    @classmethod
+    def needs(cls):
+        return "_\\/"
+    
+    @classmethod
+    def start_key(cls):
+        return StartKey(chars="_",offset=0,meta=M_NONE,nometa=M_OCCUPIED)
+    
     def matcher(self):
         self.curr = yield
-        self.curr = yield self.expect("_")
+        self.curr = yield self.expect_or_reject("_")
         mpos = self.curr.col,self.curr.row
         for meta in self.await_pos(self.offset(1,0,mpos)):
             self.curr = yield meta
-        self.curr = yield self.expect("_")
+        self.curr = yield self.expect_or_reject("_")
         for meta in self.await_pos(self.offset(-1,1,mpos)):
             self.curr = yield meta
-        self.curr = yield self.expect("\\")
-        if not (self.curr.meta & M_LINE_AFTER_S): self.reject()
+        self.curr = yield self.expect_or_reject("\\")
+        if not (self.curr.meta & M_LINE_AFTER_S): yield REJECTED
         if self.curr.meta & M_DASH_AFTER_S: self.dashed = True
         self.pos = self.curr.col,self.curr.row
-        self.curr = yield self.expect(" ")
-        self.curr = yield self.expect("/")
+        self.curr = yield self.expect_or_reject(" ")
+        self.curr = yield self.expect_or_reject("/")
         try:
             for meta in self.await_pos(self.offset(0,2,mpos)):
                 self.curr = yield meta
             if self.curr.meta & M_BOX_START_S: self.tobox = True
         except NoSuchPosition: pass        
-        return
+        yield FINISHED
         
     def render(self):
         Pattern.render(self)
@@ -1773,59 +2175,93 @@ class RDiamondConnectorPattern(DiamondConnectorPattern):
     dashmeta = M_DASH_AFTER_E
     boxmeta = M_BOX_START_E
     filled = True
+    
+    
+class ConnectorGroupPattern(PatternGroup):
+    """A group of connector patterns, whose pass matches them all from a 
+    table of their characters, directions and meta (see main.ConnectorPass)"""
+    
+    
+class OutlineArrowheadsPattern(ConnectorGroupPattern):
+
+    members = [
+        LOutlineArrowheadPattern,
+        ROutlineArrowheadPattern,
+    ]
+    
+    
+class ConnectorsPattern(ConnectorGroupPattern):
+
+    members = [
+        LArrowheadPattern,
+        RArrowheadPattern,
+        DArrowheadPattern,
+        UArrowheadPattern,
+        LCrowsFeetPattern,
+        RCrowsFeetPattern,
+        UCrowsFeetPattern,
+        DCrowsFeetPattern,
+        UOutlineDiamondConnectorPattern,
+        DOutlineDiamondConnectorPattern,
+        LOutlineDiamondConnectorPattern,
+        ROutlineDiamondConnectorPattern,
+        UDiamondConnectorPattern,
+        DDiamondConnectorPattern,
+        LDiamondConnectorPattern,
+        RDiamondConnectorPattern,
+    ]
+    
+    
+class TextGroupPattern(PatternGroup):
+    """A group of literal patterns, whose pass finds the characters of text a 
+    row at a time rather than trying a matcher at every cell, blank or not 
+    (see main.TextPass)"""
+    
+    
+class LiteralsPattern(TextGroupPattern):
+
+    members = [
+        LiteralPattern,
+    ]
             
         
 PATTERNS = [
     StickManPattern,            
-    DbCylinderPattern,
-    DocumentBoxPattern,
-    DiamondBoxPattern,
-    StraightRectangularBoxPattern,
-    RoundedRectangularBoxPattern,
-    ParagmBoxPattern,
+    BoxesPattern,
     EllipticalBoxPattern,
     #SmallCirclePattern,
     #TinyCirclePattern,
-    LongHorizDashedLinePattern,        
-    LongHorizLinePattern,
-    LongVertDashedLinePattern,
-    LongVertLinePattern,            
-    LongUpDiagDashedLinePattern,
-    LongUpDiagLinePattern,
-    LongDownDiagDashedLinePattern,
-    LongDownDiagLinePattern,        
+    LongLinesPattern,
     UOutlineArrowheadPattern,
     DOutlineArrowheadPattern,
-    LOutlineArrowheadPattern,
-    ROutlineArrowheadPattern,
-    ShortHorizLinePattern,
-    ShortVertDashedLinePattern,
-    ShortVertLinePattern,
-    ShortUpDiagDashedLinePattern,
-    ShortUpDiagLinePattern,
-    ShortDownDiagDashedLinePattern,
-    ShortDownDiagLinePattern,
+    OutlineArrowheadsPattern,
+    ShortLinesPattern,
     LineSqCornerPattern,        
     LineRdCornerPattern,        
     LJumpPattern,
     RJumpPattern,
     UJumpPattern,
-    LArrowheadPattern,            
-    RArrowheadPattern,            
-    DArrowheadPattern,            
-    UArrowheadPattern,            
-    LCrowsFeetPattern,            
-    RCrowsFeetPattern,            
-    UCrowsFeetPattern,            
-    DCrowsFeetPattern,
-    UOutlineDiamondConnectorPattern,
-    DOutlineDiamondConnectorPattern,
-    LOutlineDiamondConnectorPattern,
-    ROutlineDiamondConnectorPattern,
-    UDiamondConnectorPattern,
-    DDiamondConnectorPattern,
-    LDiamondConnectorPattern,
-    RDiamondConnectorPattern,
-    LiteralPattern
+    ConnectorsPattern,
+    LiteralsPattern
 ]
 
+# patterns whose matching is cheap even on pathological input, used in place 
+# of PATTERNS for a diagram over budget
+FALLBACK_PATTERNS = [
+    LongLinesPattern,
+    ShortLinesPattern,
+    LiteralsPattern
+]
+
+# the kinds of pattern, by the base classes of their members, for telling 
+# apart the work done on each in diagnostic output
+FAMILIES = [
+    ("box", (DocumentBoxPattern, DbCylinderPattern, RectangularBoxPattern, 
+        ParagmBoxPattern, EllipticalBoxPattern, DiamondBoxPattern, 
+        TinyCirclePattern, SmallCirclePattern, BoxGroupPattern)),
+    ("line", (ShortLinePattern, LongLinePattern, LineGroupPattern, 
+        LineSqCornerPattern, LineRdCornerPattern, JumpPattern)),
+    ("connector", (ConnectorPattern, ConnectorGroupPattern, 
+        UOutlineArrowheadPattern, DOutlineArrowheadPattern)),
+    ("text", (LiteralPattern, TextGroupPattern)),
+]
@@ -25,6 +25,7 @@ OTHER DEALINGS IN THE SOFTWARE.
 """
 
 import unittest
+from tests.coretests import *
 from tests.maintests import *
 from tests.boxtests import *
 from tests.linetests import *
@@ -824,6 +824,70 @@ class TestDbCylinderPattern(unittest.TestCase,PatternTests):
             p.test(main.CurrentChar(len(input),0," ",core.M_NONE))
         except StopIteration: pass
         
+    def feed_with_grid(self,text,meta={}):
+        g = core.Grid(text)
+        for (x,y),m in meta.items():
+            g.meta.add(x,y,m)
+        p = self.pclass()
+        p.grid = g
+        results = []
+        for j,line in enumerate(g.lines[1:]):
+            for i,char in enumerate(line):
+                results.append(((i,j),p.step(main.CurrentChar(j,i,char,g.meta_at(i,j)))))
+                if results[-1][1] in (core.REJECTED,core.FINISHED): 
+                    return p,results
+        return p,results
+
+    def test_grid_accepts_cylinder(self):
+        p,results = self.feed_with_grid(
+            ".--.\n"+
+            "'--'\n"+
+            "|  |\n"+
+            "'--'\n"+
+            "    ")
+        self.assertEquals(((4,4),core.FINISHED),results[-1])
+        self.assertEquals(((0,0),(3,3)),(p.tl,p.br))
+
+    def test_grid_gives_same_meta_as_stream(self):
+        input = [
+            ".--.\n",
+            "'--'\n",
+            "|  |\n",
+            "|  |\n",
+            "'--'\n",
+            "  \n" ]
+        p = self.pclass()
+        streamed = []
+        for j,line in enumerate(input+[[core.END_OF_INPUT]]):
+            for i,char in enumerate(line):
+                streamed.append(((i,j),p.step(main.CurrentChar(j,i,char,core.M_NONE))))
+        p,results = self.feed_with_grid("".join(input))
+        self.assertEquals(streamed[:len(results)],results)
+        self.assertEquals(core.FINISHED,results[-1][1])
+
+    def test_grid_rejects_at_start_cell(self):
+        p,results = self.feed_with_grid(
+            ".--.\n"+
+            "'--'\n"+
+            "|  |\n"+
+            "'-+'\n")
+        self.assertEquals([((0,0),core.REJECTED)],results)
+
+    def test_grid_rejects_missing_middle_row(self):
+        p,results = self.feed_with_grid(
+            ".--.\n"+
+            "'--'\n"+
+            "'--'\n")
+        self.assertEquals([((0,0),core.REJECTED)],results)
+
+    def test_grid_rejects_occupied_character(self):
+        p,results = self.feed_with_grid(
+            ".--.\n"+
+            "'--'\n"+
+            "|  |\n"+
+            "'--'\n", {(3,2):core.M_OCCUPIED})
+        self.assertEquals([((0,0),core.REJECTED)],results)
+
     def test_expects_top_start_period(self):
         p = self.pclass()
         with self.assertRaises(core.PatternRejected):
@@ -1255,6 +1319,43 @@ class TestStraightRectangularBoxPattern(unittest.TestCase,PatternTests):
         with self.assertRaises(StopIteration):
             p.test(main.CurrentChar(3,9," ",core.M_NONE))
             
+    def test_rejects_top_edge_if_next_row_too_short_for_box(self):
+        p = self.pclass()
+        p.grid = core.Grid("  +-----+\n  |  \n")
+        feed_input(p,0,2,"+-----")
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(0,8,"+",core.M_NONE))
+            
+    def test_rejects_side_if_next_row_too_short_for_box(self):
+        p = self.pclass()
+        p.grid = core.Grid("+---+\n|   |\n|")
+        feed_input(p,0,0,"+---+\n")
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(1,0,"|",core.M_NONE))
+            
+    def test_rejects_bad_bottom_from_grid_at_first_side(self):
+        p = self.pclass()
+        p.grid = core.Grid("+---+\n|   |\n+-x-+")
+        feed_input(p,0,0,"+---+\n")
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(1,0,"|",core.M_NONE))
+            
+    def test_skips_content_to_separators_with_grid(self):
+        p = self.pclass()
+        p.grid = core.Grid("+------+\n|  |   |\n+------+")
+        feed_input(p,0,0,"+------+\n")
+        feed_input(p,1,0,"| ")
+        self.assertEquals((3,1),p.waitpos)
+            
+    def test_accepts_box_at_end_of_grid(self):
+        p = self.pclass()
+        p.grid = core.Grid("+---+\n|   |\n+---+")
+        feed_input(p,0,0,"+---+\n")
+        feed_input(p,1,0,"|   |\n")
+        feed_input(p,2,0,"+---+\n")
+        with self.assertRaises(StopIteration):
+            p.test(main.CurrentChar(3,0,core.END_OF_INPUT,core.M_NONE))
+            
     def test_expects_top_left_plus(self):
         p = self.pclass()
         with self.assertRaises(core.PatternRejected):
@@ -2596,6 +2697,42 @@ class TestDiamondBoxPattern(unittest.TestCase,PatternTests):
         with self.assertRaises(StopIteration):
             p.test(main.CurrentChar(5,5," ",core.M_NONE))
             
+    def test_accepts_box_with_grid(self):
+        p = self.pclass()
+        p.grid = core.Grid("    .    \n  .' '.  \n <     > \n  '. .'  \n    '    \n     ")
+        feed_input(p,0,4,    ".    \n")
+        feed_input(p,1,0,"  .' '.  \n")
+        feed_input(p,2,0," <     > \n")
+        feed_input(p,3,0,"  '. .'  \n")
+        feed_input(p,4,0,"    '    \n")
+        feed_input(p,5,0,"     ")
+        with self.assertRaises(StopIteration):
+            p.test(main.CurrentChar(5,5," ",core.M_NONE))
+            
+    def test_accepts_apeak_box_with_grid(self):
+        p = self.pclass()
+        p.grid = core.Grid("   .'.   \n .'   '. \n<       >\n '.   .' \n   '.'   \n       ")
+        feed_input(p,0,3,   ".'.   \n")
+        feed_input(p,1,0," .'   '. \n")
+        feed_input(p,2,0,"<       >\n")
+        feed_input(p,3,0," '.   .' \n")
+        feed_input(p,4,0,"   '.'   \n")
+        feed_input(p,5,0,"      ")
+        with self.assertRaises(StopIteration):
+            p.test(main.CurrentChar(5,6," ",core.M_NONE))
+            
+    def test_rejects_bad_bottom_from_grid_at_start(self):
+        p = self.pclass()
+        p.grid = core.Grid("    .    \n  .' '.  \n <     > \n  '. .'  \n    -    \n")
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(0,4,".",core.M_NONE))
+            
+    def test_rejects_short_right_slope_from_grid_at_start(self):
+        p = self.pclass()
+        p.grid = core.Grid("      .\n    .' '.\n  .'    \n <       >\n")
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(0,6,".",core.M_NONE))
+            
     def test_expects_first_period(self):
         p = self.pclass()
         with self.assertRaises(core.PatternRejected):
@@ -3089,6 +3226,30 @@ class TestEllipticalBoxPattern(unittest.TestCase,PatternTests):
         with self.assertRaises(StopIteration):
             p.test(main.CurrentChar(4,5," ",core.M_NONE))
             
+    def test_accepts_ellipse_with_grid(self):
+        p = self.pclass()
+        p.grid = core.Grid("  .-.  \n /   \\ \n|     |\n \\   / \n  '-'  \n     ")
+        feed_input(p,0,2,  ".-.  \n")
+        feed_input(p,1,0," /   \\ \n")
+        feed_input(p,2,0,"|     |\n")
+        feed_input(p,3,0," \\   / \n")
+        feed_input(p,4,0,"  '-'  \n")
+        feed_input(p,5,0,"     ")
+        with self.assertRaises(StopIteration):
+            p.test(main.CurrentChar(5,5," ",core.M_NONE))
+            
+    def test_rejects_uneven_sides_from_grid_at_start(self):
+        p = self.pclass()
+        p.grid = core.Grid("  .-.  \n /   \\ \n|     |\n|      \n \\   / \n  '-'  ")
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(0,2,".",core.M_NONE))
+            
+    def test_rejects_short_bottom_from_grid_at_start(self):
+        p = self.pclass()
+        p.grid = core.Grid(".--.\n|  |\n'-' ")
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(0,0,".",core.M_NONE))
+            
     def test_expects_top_left_period(self):
         p = self.pclass()
         with self.assertRaises(core.PatternRejected):
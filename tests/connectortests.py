@@ -32,7 +32,7 @@ import patterns
 from ptests import *
 
 
-class TestLArrowheadPattern(unittest.TestCase,PatternTests):
+class TestLArrowheadPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -156,7 +156,7 @@ class TestLArrowheadPattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID, r[2].stype)
 
 
-class TestRArrowheadPattern(unittest.TestCase,PatternTests):
+class TestRArrowheadPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -279,7 +279,7 @@ class TestRArrowheadPattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID, r[2].stype)
 
 
-class TestUArrowheadPattern(unittest.TestCase,PatternTests):
+class TestUArrowheadPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -431,7 +431,7 @@ class TestUArrowheadPattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID, r[2].stype)
     
     
-class TestDArrowheadPattern(unittest.TestCase,PatternTests):
+class TestDArrowheadPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -612,7 +612,7 @@ class TestDArrowheadPattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID, r[2].stype)    
 
 
-class TestLCrowsFeetPattern(unittest.TestCase,PatternTests):
+class TestLCrowsFeetPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -734,7 +734,7 @@ class TestLCrowsFeetPattern(unittest.TestCase,PatternTests):
             self.assertEquals(core.STROKE_SOLID,shape.stype)
             
     
-class TestRCrowsFeetPattern(unittest.TestCase,PatternTests):
+class TestRCrowsFeetPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -854,7 +854,7 @@ class TestRCrowsFeetPattern(unittest.TestCase,PatternTests):
             self.assertEquals(core.STROKE_SOLID,shape.stype)
         
         
-class TestUCrowsFeetPattern(unittest.TestCase,PatternTests):
+class TestUCrowsFeetPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1016,7 +1016,7 @@ class TestUCrowsFeetPattern(unittest.TestCase,PatternTests):
             self.assertEquals(core.STROKE_SOLID,shape.stype)
     
     
-class TestDCrowsFeetPattern(unittest.TestCase,PatternTests):
+class TestDCrowsFeetPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1170,7 +1170,7 @@ class TestDCrowsFeetPattern(unittest.TestCase,PatternTests):
             self.assertEquals(core.STROKE_SOLID,shape.stype)    
 
 
-class TestUOutlineArrowheadPattern(unittest.TestCase,PatternTests):
+class TestUOutlineArrowheadPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1360,7 +1360,7 @@ class TestUOutlineArrowheadPattern(unittest.TestCase,PatternTests):
             self.assertEquals(core.STROKE_SOLID,shape.stype)
 
 
-class TestDOutlineArrowheadPattern(unittest.TestCase,PatternTests):
+class TestDOutlineArrowheadPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1633,7 +1633,7 @@ class TestDOutlineArrowheadPattern(unittest.TestCase,PatternTests):
             self.assertEquals(core.STROKE_SOLID,shape.stype)
 
 
-class TestLOutlineArrowheadPattern(unittest.TestCase,PatternTests):
+class TestLOutlineArrowheadPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1777,7 +1777,7 @@ class TestLOutlineArrowheadPattern(unittest.TestCase,PatternTests):
             self.assertEquals(core.STROKE_SOLID,shape.stype)    
 
 
-class TestROutlineArrowheadPattern(unittest.TestCase,PatternTests):
+class TestROutlineArrowheadPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1919,7 +1919,7 @@ class TestROutlineArrowheadPattern(unittest.TestCase,PatternTests):
             self.assertEquals(core.STROKE_SOLID,shape.stype)    
 
 
-class TestUOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests):
+class TestUOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2133,7 +2133,7 @@ class TestUOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests):
         self.assertEquals(1.0,p.falpha)
 
 
-class TestDOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests):
+class TestDOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2344,7 +2344,7 @@ class TestDOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests):
         self.assertEquals(1.0,p.falpha)
 
 
-class TestLOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests):
+class TestLOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2489,7 +2489,7 @@ class TestLOutlineDiamondConnectorPattern(unittest.TestCase,PatternTests):
         self.assertEquals(1.0,p.falpha)
         
         
-class TestROutlineDiamondConnectorPattern(unittest.TestCase,PatternTests):
+class TestROutlineDiamondConnectorPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2631,7 +2631,7 @@ class TestROutlineDiamondConnectorPattern(unittest.TestCase,PatternTests):
         self.assertEquals(1.0,p.falpha)        
         
 
-class TestUDiamondConnectorPattern(unittest.TestCase,PatternTests):
+class TestUDiamondConnectorPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2891,7 +2891,7 @@ class TestUDiamondConnectorPattern(unittest.TestCase,PatternTests):
         self.assertEquals(1.0,p.falpha)
             
 
-class TestDDiamondConnectorPattern(unittest.TestCase,PatternTests):
+class TestDDiamondConnectorPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -3135,7 +3135,7 @@ class TestDDiamondConnectorPattern(unittest.TestCase,PatternTests):
         self.assertEquals(1.0,p.falpha)
     
 
-class TestLDiamondConnector(unittest.TestCase,PatternTests):
+class TestLDiamondConnector(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -3299,7 +3299,7 @@ class TestLDiamondConnector(unittest.TestCase,PatternTests):
         self.assertEquals(1.0,p.falpha)
         
         
-class TestRDiamondConnector(unittest.TestCase,PatternTests):
+class TestRDiamondConnector(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
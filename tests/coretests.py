@@ -0,0 +1,528 @@
+#!/usr/bin/python2
+"""    
+Copyright (c) 2012 Mark Frimston
+
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import unittest
+import pickle
+import core
+import main
+
+
+class WaitingPattern(core.Pattern):
+
+    def matcher(self):
+        self.curr = yield
+        for meta in self.await_pos((2,1)):
+            self.curr = yield meta
+        yield core.M_OCCUPIED
+
+
+class TestGrid(unittest.TestCase):
+
+    def test_size(self):
+        g = core.Grid("ab\nabcd\n")
+        self.assertEquals((4,2),(g.width,g.height))
+
+    def test_char_at_returns_character(self):
+        g = core.Grid("ab\ncd")
+        self.assertEquals("d",g.char_at(1,1))
+
+    def test_char_at_returns_newline_at_row_end(self):
+        g = core.Grid("ab\ncd")
+        self.assertEquals("\n",g.char_at(2,0))
+
+    def test_char_at_returns_start_and_end_of_input(self):
+        g = core.Grid("ab\ncd")
+        self.assertEquals(core.START_OF_INPUT,g.char_at(0,-1))
+        self.assertEquals(core.END_OF_INPUT,g.char_at(0,2))
+
+    def test_char_at_returns_none_for_missing_position(self):
+        g = core.Grid("ab\nabcd")
+        self.assertEquals(None,g.char_at(3,0))
+        self.assertEquals(None,g.char_at(1,2))
+        self.assertEquals(None,g.char_at(-1,0))
+        self.assertEquals(None,g.char_at(0,-2))
+
+    def test_meta_at_returns_plane_meta(self):
+        g = core.Grid("ab\ncd")
+        g.meta.add(1,0,core.M_OCCUPIED)
+        self.assertEquals(core.M_OCCUPIED,g.meta_at(1,0))
+
+    def test_row_returns_characters(self):
+        g = core.Grid("ab\ncde")
+        self.assertEquals(("c","d","e","\n"),g.row(1))
+
+    def test_row_returns_slice(self):
+        g = core.Grid("ab\ncde")
+        self.assertEquals(("d","e"),g.row(1,1,3))
+
+    def test_row_returns_empty_for_missing_row(self):
+        g = core.Grid("ab")
+        self.assertEquals((),g.row(5))
+
+    def test_column_returns_characters(self):
+        g = core.Grid("ab\ncd")
+        self.assertEquals((core.START_OF_INPUT,"a","c",core.END_OF_INPUT),g.column(0))
+
+    def test_column_returns_none_for_short_rows(self):
+        g = core.Grid("ab\ncdef\ng")
+        self.assertEquals(("\n","e",None),g.column(2,0,3))
+        self.assertEquals((None,"f",None),g.column(3,0,3))
+        
+    def test_hrun_counts_repeats_along_row(self):
+        g = core.Grid("+---+ - - -+")
+        self.assertEquals(3,g.hrun(1,0,"-"))
+        self.assertEquals(1,g.hrun(3,0,"-"))
+        self.assertEquals(0,g.hrun(0,0,"-"))
+        self.assertEquals(2,g.hrun(6,0,"- "))
+        self.assertEquals(0,g.hrun(7,0,"- "))
+        
+    def test_hrun_is_zero_outside_grid(self):
+        g = core.Grid("--")
+        self.assertEquals(0,g.hrun(5,0,"-"))
+        self.assertEquals(0,g.hrun(0,1,"-"))
+        self.assertEquals(0,g.hrun(0,7,"-"))
+        
+    def test_vrun_counts_cells_down_column(self):
+        g = core.Grid("+\n|\n;\n|x\n+")
+        self.assertEquals(1,g.vrun(0,1,"|"))
+        self.assertEquals(3,g.vrun(0,1,"|;"))
+        self.assertEquals(0,g.vrun(1,1,"|"))
+        self.assertEquals(0,g.vrun(0,9,"|"))
+        
+    def test_drun_counts_repeats_down_diagonal(self):
+        g = core.Grid("   /\n  /\n /  \\\n/    \\")
+        self.assertEquals(4,g.drun(3,0,-1,"/"))
+        self.assertEquals(2,g.drun(1,2,-1,"/"))
+        self.assertEquals(2,g.drun(4,2,1,"\\"))
+        self.assertEquals(0,g.drun(2,0,-1,"/"))
+        
+    def test_drun_of_slope_pairs(self):
+        g = core.Grid("    .'\n  .'\n.'\n'.")
+        self.assertEquals(3,g.drun(4,0,-2,".'"))
+        self.assertEquals(1,g.drun(0,3,2,"'."))
+        self.assertEquals(0,g.drun(5,0,-2,".'"))
+        
+    def test_drun_is_zero_outside_grid(self):
+        g = core.Grid("/")
+        self.assertEquals(0,g.drun(-1,0,-1,"/"))
+        self.assertEquals(0,g.drun(0,1,-1,"/"))
+        self.assertEquals(0,g.drun(0,-1,-1,"/"))
+        
+    def test_positions_of_character_in_row(self):
+        g = core.Grid("| a | b |")
+        self.assertEquals([0,4,8],g.positions(0,"|"))
+        self.assertEquals([],g.positions(1,"|"))
+
+
+    def test_row_masks(self):
+        g = core.Grid("ab\n\n+-")
+        self.assertEquals([0,core.char_mask("ab\n"),core.char_mask("\n"),
+            core.char_mask("+-\n"),0],g.rowmasks)
+
+    def test_mask_covers_all_rows(self):
+        g = core.Grid("ab\n\n+-")
+        self.assertEquals(core.char_mask("ab+-\n"),g.mask)
+
+
+class TestCharMask(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEquals(0,core.char_mask(""))
+
+    def test_distinguishes_characters(self):
+        self.assertEquals(0,core.char_mask("+-") & core.char_mask("|."))
+
+    def test_combines_characters(self):
+        self.assertEquals(core.char_mask("+-"),core.char_mask("+")|core.char_mask("-"))
+
+    def test_non_ascii_characters_share_bit(self):
+        self.assertEquals(core.char_mask(u"\u00e9"),core.char_mask(u"\u2500"))
+        self.assertEquals(0,core.char_mask(u"\u00e9") & core.char_mask("+-|"))
+
+    def test_ignores_non_characters(self):
+        self.assertEquals(0,core.char_mask([core.START_OF_INPUT,core.END_OF_INPUT]))
+
+
+class TestMetaPlane(unittest.TestCase):
+
+    def test_get_returns_none_for_unset_position(self):
+        p = core.MetaPlane(3,2)
+        self.assertEquals(core.M_NONE,p.get(1,1))
+
+    def test_get_returns_added_meta(self):
+        p = core.MetaPlane(3,2)
+        p.add(1,1,core.M_BOX_START_E)
+        self.assertEquals(core.M_BOX_START_E,p.get(1,1))
+
+    def test_add_combines_meta(self):
+        p = core.MetaPlane(3,2)
+        p.add(1,1,core.M_BOX_START_E)
+        p.add(1,1,core.M_OCCUPIED)
+        self.assertEquals(core.M_BOX_START_E|core.M_OCCUPIED,p.get(1,1))
+
+    def test_add_ignores_other_positions(self):
+        p = core.MetaPlane(3,2)
+        p.add(1,1,core.M_BOX_START_E)
+        self.assertEquals(core.M_NONE,p.get(2,1))
+        self.assertEquals(core.M_NONE,p.get(1,0))
+
+    def test_stores_start_and_end_of_input(self):
+        p = core.MetaPlane(3,2)
+        p.add(0,-1,core.M_BOX_START_E)
+        p.add(0,2,core.M_OCCUPIED)
+        self.assertEquals(core.M_BOX_START_E,p.get(0,-1))
+        self.assertEquals(core.M_OCCUPIED,p.get(0,2))
+
+    def test_stores_widest_column(self):
+        p = core.MetaPlane(3,2)
+        p.add(3,1,core.M_OCCUPIED)
+        self.assertEquals(core.M_OCCUPIED,p.get(3,1))
+        self.assertEquals(core.M_NONE,p.get(0,2))
+
+    def test_get_returns_none_outside_plane(self):
+        p = core.MetaPlane(3,2)
+        self.assertEquals(core.M_NONE,p.get(-5,0))
+        self.assertEquals(core.M_NONE,p.get(0,50))
+
+    def test_add_raises_error_outside_plane(self):
+        p = core.MetaPlane(3,2)
+        self.assertRaises(IndexError,p.add,10,0,core.M_OCCUPIED)
+
+    def test_merge_adds_each_position(self):
+        p = core.MetaPlane(3,2)
+        p.add(0,0,core.M_OCCUPIED)
+        p.merge({(0,0):core.M_BOX_START_E,(2,1):core.M_BOX_START_S})
+        self.assertEquals(core.M_OCCUPIED|core.M_BOX_START_E,p.get(0,0))
+        self.assertEquals(core.M_BOX_START_S,p.get(2,1))
+
+    def test_copy_has_same_meta(self):
+        p = core.MetaPlane(3,2)
+        p.add(1,0,core.M_OCCUPIED)
+        self.assertEquals(core.M_OCCUPIED,p.copy().get(1,0))
+
+    def test_copy_is_independent(self):
+        p = core.MetaPlane(3,2)
+        c = p.copy()
+        p.add(1,0,core.M_OCCUPIED)
+        self.assertEquals(core.M_NONE,c.get(1,0))
+
+    def test_tostring_and_fromstring(self):
+        p = core.MetaPlane(3,2)
+        p.add(1,0,core.M_OCCUPIED)
+        c = core.MetaPlane(3,2)
+        c.fromstring(p.tostring())
+        self.assertEquals(core.M_OCCUPIED,c.get(1,0))
+        
+    def test_fromstring_rejects_other_size(self):
+        self.assertRaises(ValueError,core.MetaPlane(3,2).fromstring,
+            core.MetaPlane(4,2).tostring())
+
+    def test_uses_given_storage(self):
+        words = []
+        p = core.MetaPlane(3,2,lambda n: words.extend([0]*n) or words)
+        p.add(1,0,core.M_OCCUPIED)
+        self.assertEquals(36,len(words))
+        self.assertTrue( core.M_OCCUPIED in words )
+
+
+class TestRowMetaPlane(unittest.TestCase):
+
+    def test_empty_plane_has_no_meta(self):
+        self.assertEquals(core.M_NONE,core.RowMetaPlane().get(3,2))
+
+    def test_add_combines_meta(self):
+        p = core.RowMetaPlane()
+        p.add(5,1,core.M_OCCUPIED)
+        p.add(5,1,core.M_BOX_START_E)
+        self.assertEquals(core.M_OCCUPIED|core.M_BOX_START_E,p.get(5,1))
+        self.assertEquals(core.M_NONE,p.get(4,1))
+
+    def test_merge_adds_each_position(self):
+        p = core.RowMetaPlane()
+        p.merge({(0,0):core.M_BOX_START_E,(2,1):core.M_BOX_START_S})
+        self.assertEquals(core.M_BOX_START_E,p.get(0,0))
+        self.assertEquals(core.M_BOX_START_S,p.get(2,1))
+
+    def test_drop_discards_row(self):
+        p = core.RowMetaPlane()
+        p.add(1,0,core.M_OCCUPIED)
+        p.drop(0)
+        self.assertEquals(core.M_NONE,p.get(1,0))
+
+
+class TestStreamGrid(unittest.TestCase):
+
+    def test_reads_characters(self):
+        g = core.StreamGrid(["ab\n","cd\n"])
+        self.assertEquals("d",g.char_at(1,1))
+        self.assertEquals("\n",g.char_at(2,0))
+
+    def test_start_and_end_of_input(self):
+        g = core.StreamGrid(["ab\n"])
+        self.assertEquals(core.START_OF_INPUT,g.char_at(0,-1))
+        self.assertEquals(core.END_OF_INPUT,g.char_at(0,1))
+        self.assertEquals(None,g.char_at(0,2))
+
+    def test_reads_only_as_far_as_needed(self):
+        g = core.StreamGrid(iter(["ab\n","cd\n","ef\n"]))
+        g.char_at(0,0)
+        self.assertEquals(0,g.last)
+        self.assertEquals(None,g.height)
+
+    def test_height_and_width_known_at_end(self):
+        g = core.StreamGrid(["ab\n","cde"])
+        g.load(5)
+        self.assertEquals(2,g.height)
+        self.assertEquals(3,g.width)
+
+    def test_splits_chunks_into_lines(self):
+        g = core.StreamGrid(["ab\ncd\n","ef"])
+        self.assertEquals("e",g.char_at(0,2))
+
+    def test_empty_chunk_is_blank_row(self):
+        g = core.StreamGrid(["a","","b"])
+        self.assertEquals("b",g.char_at(0,2))
+
+    def test_reports_rows_as_read(self):
+        rows = []
+        g = core.StreamGrid(["ab"],lambda y,line: rows.append((y,line)))
+        g.load(1)
+        self.assertEquals([(-1,[core.START_OF_INPUT]),(0,"ab\n"),(1,[core.END_OF_INPUT])],rows)
+
+    def test_runs_and_positions_as_for_grid(self):
+        text = "+- - +\n;  | ;\n;    ;\n+----+"
+        g,s = core.Grid(text),core.StreamGrid(text.splitlines(True))
+        self.assertEquals(g.hrun(1,0,"- "),s.hrun(1,0,"- "))
+        self.assertEquals(g.hrun(1,3,"-"),s.hrun(1,3,"-"))
+        self.assertEquals(g.vrun(5,1,";"),s.vrun(5,1,";"))
+        self.assertEquals(g.positions(1,"|"),s.positions(1,"|"))
+        self.assertEquals(g.drun(0,2,1,";"),s.drun(0,2,1,";"))
+        self.assertEquals(g.drun(4,0,-1," "),s.drun(4,0,-1," "))
+
+    def test_dropped_rows_read_as_none(self):
+        g = core.StreamGrid(["ab\n","cd\n"])
+        g.load(1)
+        g.drop(1)
+        self.assertEquals(None,g.char_at(0,0))
+        self.assertEquals("c",g.char_at(0,1))
+
+
+class TestSentinel(unittest.TestCase):
+
+    def test_keeps_identity_when_pickled(self):
+        self.assertTrue( pickle.loads(pickle.dumps(core.C_FOREGROUND)) is core.C_FOREGROUND )
+
+    def test_keeps_identity_when_pickled_in_shape(self):
+        line = core.Line(a=(0,0),b=(1,1),z=0,stroke=core.C_FOREGROUND,salpha=1.0,
+            w=1,stype=core.STROKE_DASHED)
+        copied = pickle.loads(pickle.dumps(line,2))
+        self.assertTrue( copied.stroke is core.C_FOREGROUND )
+        self.assertTrue( copied.stype is core.STROKE_DASHED )
+
+
+class ExpectingPattern(core.Pattern):
+
+    def matcher(self):
+        self.curr = yield
+        self.curr = yield self.expect_or_reject("a")
+        yield core.FINISHED
+
+
+class RaisingPattern(core.Pattern):
+
+    def matcher(self):
+        self.curr = yield
+        if self.curr.char != "a": self.reject()
+        self.curr = yield core.M_OCCUPIED
+
+
+class ReachingPattern(core.Pattern):
+
+    def matcher(self):
+        self.curr = yield
+        self.reach = (3,1)
+        self.curr = yield core.M_OCCUPIED
+        self.reach = None
+        yield core.M_OCCUPIED
+
+
+class FollowingPattern(core.Pattern):
+
+    def matcher(self):
+        self.curr = yield
+        for meta in self.follow([((0,0),core.M_OCCUPIED),((1,0),core.M_OCCUPIED)],(0,1)):
+            self.curr = yield meta
+        yield core.FINISHED
+
+
+class TestPattern(unittest.TestCase):
+
+    def test_follow_yields_footprint_meta(self):
+        p = FollowingPattern()
+        self.assertEquals(core.M_OCCUPIED,p.step(main.CurrentChar(0,0,"a",core.M_NONE)))
+        self.assertEquals(core.M_OCCUPIED,p.step(main.CurrentChar(0,1,"a",core.M_NONE)))
+
+    def test_follow_rejects_if_footprint_cell_since_occupied(self):
+        p = FollowingPattern()
+        p.step(main.CurrentChar(0,0,"a",core.M_NONE))
+        self.assertEquals(core.REJECTED,p.step(main.CurrentChar(0,1,"a",core.M_OCCUPIED)))
+
+    def test_step_rejects_if_reach_missing_from_grid(self):
+        p = ReachingPattern()
+        p.grid = core.Grid("abcd\nab")
+        self.assertEquals(core.REJECTED,p.step(main.CurrentChar(0,0,"a",core.M_NONE)))
+
+    def test_step_continues_if_reach_in_grid(self):
+        p = ReachingPattern()
+        p.grid = core.Grid("abcd\nabcd")
+        self.assertEquals(core.M_OCCUPIED,p.step(main.CurrentChar(0,0,"a",core.M_NONE)))
+
+    def test_step_ignores_reach_without_grid(self):
+        p = ReachingPattern()
+        self.assertEquals(core.M_OCCUPIED,p.step(main.CurrentChar(0,0,"a",core.M_NONE)))
+
+    def test_step_ignores_cleared_reach(self):
+        p = ReachingPattern()
+        p.grid = core.Grid("abcd\nabcd")
+        p.step(main.CurrentChar(0,0,"a",core.M_NONE))
+        p.grid = core.Grid("ab")
+        self.assertEquals(core.M_OCCUPIED,p.step(main.CurrentChar(0,1,"b",core.M_NONE)))
+
+    def test_expect_returns_meta_for_expected_char(self):
+        p = ExpectingPattern()
+        p.curr = main.CurrentChar(0,0,"a",core.M_NONE)
+        self.assertEquals(core.M_BOX_START_E,p.expect("ab",core.M_BOX_START_E))
+
+    def test_expect_raises_for_other_char(self):
+        p = ExpectingPattern()
+        p.curr = main.CurrentChar(0,0,"c",core.M_NONE)
+        with self.assertRaises(core.PatternRejected):
+            p.expect("ab")
+
+    def test_expect_raises_for_occupied_char(self):
+        p = ExpectingPattern()
+        p.curr = main.CurrentChar(0,0,"a",core.M_OCCUPIED)
+        with self.assertRaises(core.PatternRejected):
+            p.expect("ab")
+
+    def test_expect_or_reject_returns_meta_for_expected_char(self):
+        p = ExpectingPattern()
+        p.curr = main.CurrentChar(0,0,"a",core.M_NONE)
+        self.assertEquals(core.M_BOX_START_E,
+            p.expect_or_reject("ab",core.M_BOX_START_E))
+
+    def test_expect_or_reject_returns_rejected_for_other_char(self):
+        p = ExpectingPattern()
+        p.curr = main.CurrentChar(0,0,"c",core.M_NONE)
+        self.assertEquals(core.REJECTED,p.expect_or_reject("ab"))
+
+    def test_expect_or_reject_returns_rejected_for_occupied_char(self):
+        p = ExpectingPattern()
+        p.curr = main.CurrentChar(0,0,"a",core.M_OCCUPIED)
+        self.assertEquals(core.REJECTED,p.expect_or_reject("ab"))
+
+    def test_step_returns_meta(self):
+        p = ExpectingPattern()
+        self.assertEquals(core.M_OCCUPIED,p.step(main.CurrentChar(0,0,"a",core.M_NONE)))
+
+    def test_step_returns_rejected_for_rejection(self):
+        p = ExpectingPattern()
+        self.assertEquals(core.REJECTED,p.step(main.CurrentChar(0,0,"b",core.M_NONE)))
+
+    def test_step_returns_finished_for_completion(self):
+        p = ExpectingPattern()
+        p.step(main.CurrentChar(0,0,"a",core.M_NONE))
+        self.assertEquals(core.FINISHED,p.step(main.CurrentChar(0,1,"b",core.M_NONE)))
+        self.assertTrue( p.is_finished )
+
+    def test_step_returns_rejected_for_rejected_error(self):
+        p = RaisingPattern()
+        self.assertEquals(core.REJECTED,p.step(main.CurrentChar(0,0,"b",core.M_NONE)))
+
+    def test_step_returns_finished_for_matcher_return(self):
+        p = RaisingPattern()
+        p.step(main.CurrentChar(0,0,"a",core.M_NONE))
+        self.assertEquals(core.FINISHED,p.step(main.CurrentChar(0,1,"b",core.M_NONE)))
+        self.assertTrue( p.is_finished )
+
+    def test_test_raises_rejected_error_for_rejection(self):
+        p = ExpectingPattern()
+        self.assertRaises(core.PatternRejected,p.test,
+            main.CurrentChar(0,0,"b",core.M_NONE))
+
+    def test_test_raises_stop_iteration_for_completion(self):
+        p = ExpectingPattern()
+        p.test(main.CurrentChar(0,0,"a",core.M_NONE))
+        self.assertRaises(StopIteration,p.test,main.CurrentChar(0,1,"b",core.M_NONE))
+        self.assertTrue( p.is_finished )
+
+    def test_await_pos_yields_awaited_position(self):
+        p = WaitingPattern()
+        p.curr = main.CurrentChar(0,0,"a",core.M_NONE)
+        self.assertEquals((2,1),p.await_pos((2,1)).next())
+
+    def test_await_pos_raises_error_if_position_passed(self):
+        p = WaitingPattern()
+        p.curr = main.CurrentChar(1,3,"a",core.M_NONE)
+        self.assertRaises(core.NoSuchPosition,list,p.await_pos((2,1)))
+
+    def test_test_returns_no_meta_while_waiting(self):
+        p = WaitingPattern()
+        self.assertEquals(core.M_NONE,p.test(main.CurrentChar(0,0,"a",core.M_NONE)))
+        self.assertEquals(core.M_NONE,p.test(main.CurrentChar(0,1,"a",core.M_NONE)))
+
+    def test_test_records_awaited_position(self):
+        p = WaitingPattern()
+        p.test(main.CurrentChar(0,0,"a",core.M_NONE))
+        self.assertEquals((2,1),p.waitpos)
+
+    def test_test_doesnt_resume_matcher_before_awaited_position(self):
+        p = WaitingPattern()
+        p.test(main.CurrentChar(0,0,"a",core.M_NONE))
+        p.test(main.CurrentChar(0,1,"a",core.M_NONE))
+        self.assertEquals(main.CurrentChar(0,0,"a",core.M_NONE),p.curr)
+
+    def test_test_resumes_matcher_at_awaited_position(self):
+        p = WaitingPattern()
+        p.test(main.CurrentChar(0,0,"a",core.M_NONE))
+        self.assertEquals(core.M_OCCUPIED,p.test(main.CurrentChar(1,2,"a",core.M_NONE)))
+        self.assertEquals(None,p.waitpos)
+
+    def test_test_rejects_if_awaited_position_doesnt_exist(self):
+        p = WaitingPattern()
+        p.test(main.CurrentChar(0,0,"a",core.M_NONE))
+        self.assertRaises(core.PatternRejected,p.test,
+            main.CurrentChar(2,0,"a",core.M_NONE))
+
+    def test_test_resumes_matcher_at_end_of_input(self):
+        p = WaitingPattern()
+        p.test(main.CurrentChar(0,0,"a",core.M_NONE))
+        self.assertRaises(core.PatternRejected,p.test,
+            main.CurrentChar(0,0,core.END_OF_INPUT,core.M_NONE))
+
+
+if __name__ == "__main__":
+    unittest.main()
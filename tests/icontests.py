@@ -32,7 +32,7 @@ import patterns
 from ptests import *
 
 
-class TestLiteralPattern(unittest.TestCase,PatternTests):
+class TestLiteralPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -33,7 +33,7 @@ import math
 from ptests import *
 
 
-class TestShortUpDiagLinePattern(unittest.TestCase,PatternTests):
+class TestShortUpDiagLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -195,7 +195,7 @@ class TestShortUpDiagLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)
         
 
-class TestLongUpDiagLinePattern(unittest.TestCase,PatternTests):
+class TestLongUpDiagLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -356,7 +356,7 @@ class TestLongUpDiagLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)
     
     
-class TestShortDownDiagLinePattern(unittest.TestCase,PatternTests):
+class TestShortDownDiagLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -526,7 +526,7 @@ class TestShortDownDiagLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)    
     
 
-class TestLongDownDiagLinePattern(unittest.TestCase,PatternTests):
+class TestLongDownDiagLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -705,7 +705,7 @@ class TestLongDownDiagLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)    
 
 
-class TestShortVertLinePattern(unittest.TestCase,PatternTests):
+class TestShortVertLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -894,7 +894,7 @@ class TestShortVertLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)    
 
     
-class TestLongVertLinePattern(unittest.TestCase,PatternTests):
+class TestLongVertLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1094,7 +1094,7 @@ class TestLongVertLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)    
 
 
-class TestShortHorizLinePattern(unittest.TestCase,PatternTests):
+class TestShortHorizLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1246,7 +1246,7 @@ class TestShortHorizLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)    
 
                                 
-class TestLongHorizLinePattern(unittest.TestCase,PatternTests):
+class TestLongHorizLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1374,7 +1374,7 @@ class TestLongHorizLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)    
 
 
-class TestShortUpDiagDashedLinePattern(unittest.TestCase,PatternTests):
+class TestShortUpDiagDashedLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1536,7 +1536,7 @@ class TestShortUpDiagDashedLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_DASHED,l.stype)
 
 
-class TestLongUpDiagDashedLinePattern(unittest.TestCase,PatternTests):
+class TestLongUpDiagDashedLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1697,7 +1697,7 @@ class TestLongUpDiagDashedLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_DASHED,l.stype)
 
 
-class TestShortDownDiagDashedLinePattern(unittest.TestCase,PatternTests):
+class TestShortDownDiagDashedLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -1867,7 +1867,7 @@ class TestShortDownDiagDashedLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_DASHED,l.stype)    
 
 
-class TestLongDownDiagDasheLinePattern(unittest.TestCase,PatternTests):
+class TestLongDownDiagDasheLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2046,7 +2046,7 @@ class TestLongDownDiagDasheLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_DASHED,l.stype)    
     
     
-class TestShortVertDashedLinePattern(unittest.TestCase,PatternTests):
+class TestShortVertDashedLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2235,7 +2235,7 @@ class TestShortVertDashedLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_DASHED,l.stype)    
     
     
-class TestLongVertDashedLinePattern(unittest.TestCase,PatternTests):
+class TestLongVertDashedLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2435,7 +2435,7 @@ class TestLongVertDashedLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_DASHED,l.stype)        
         
         
-class TestLongHorizDashedLinePattern(unittest.TestCase,PatternTests):
+class TestLongHorizDashedLinePattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2594,7 +2594,7 @@ class TestLongHorizDashedLinePattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_DASHED,l.stype)    
 
 
-class TestLineSqCornerPattern(unittest.TestCase,PatternTests):
+class TestLineSqCornerPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -2862,7 +2862,7 @@ class TestLineSqCornerPattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l2.stype)
         
     
-class TestLineRdCornerPattern(unittest.TestCase,PatternTests):
+class TestLineRdCornerPattern(unittest.TestCase,PatternTests,GroupPassTests):
 
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -3249,7 +3249,7 @@ class TestLineRdCornerPattern(unittest.TestCase,PatternTests):
         self.assertEquals(core.STROKE_SOLID,l.stype)        
 
 
-class TestLJumpPattern(unittest.TestCase,PatternTests):
+class TestLJumpPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -3401,7 +3401,7 @@ class TestLJumpPattern(unittest.TestCase,PatternTests):
         self.assertEquals(None,a.fill)
 
     
-class TestRJumpPattern(unittest.TestCase,PatternTests):
+class TestRJumpPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -3553,7 +3553,7 @@ class TestRJumpPattern(unittest.TestCase,PatternTests):
         self.assertEquals(None,a.fill)    
     
     
-class TestUJumpPattern(unittest.TestCase,PatternTests):
+class TestUJumpPattern(unittest.TestCase,PatternTests,GroupPassTests):
     
     def __init__(self,*args,**kargs):
         unittest.TestCase.__init__(self,*args,**kargs)
@@ -27,10 +27,18 @@ OTHER DEALINGS IN THE SOFTWARE.
 import unittest
 import core
 import main
+import patterns
 import io
 import xml.dom.minidom
 import math
 import mock
+import tempfile
+import shutil
+import os
+import inspect
+import time
+import gc
+import weakref
 
 
 class TestMatchLookup(unittest.TestCase):
@@ -71,6 +79,38 @@ class TestMatchLookup(unittest.TestCase):
         result.pop()
         self.assertTrue(1, len(m.get_all_matches()))
         
+    def test_get_matches_keeps_insertion_order_after_removals(self):
+        m = main.MatchLookup()
+        matches = [object() for i in range(50)]
+        for match in matches:
+            m.add_match(match)
+        for match in matches[:40:2]:
+            m.remove_match(match)
+        m.add_match(matches[0])
+        self.assertEquals(matches[1:40:2]+matches[40:]+matches[:1], m.get_all_matches())
+        
+    def test_len_counts_matches(self):
+        m = main.MatchLookup()
+        match1 = object()
+        match2 = object()
+        m.add_match(match1)
+        m.add_match(match2)
+        m.remove_match(match1)
+        self.assertEquals(1, len(m))
+        
+    def test_contains_added_match(self):
+        m = main.MatchLookup()
+        match = object()
+        m.add_match(match)
+        self.assertTrue(match in m)
+        
+    def test_doesnt_contain_removed_match(self):
+        m = main.MatchLookup()
+        match = object()
+        m.add_match(match)
+        m.remove_match(match)
+        self.assertFalse(match in m)
+    
     def test_get_meta_returns_empty_dict_for_no_meta(self):
         m = main.MatchLookup()
         match = object()
@@ -88,6 +128,13 @@ class TestMatchLookup(unittest.TestCase):
         self.assertEquals(core.M_OCCUPIED|core.M_BOX_START_E, result[(1,1)])
         self.assertEquals(core.M_BOX_AFTER_E, result[(2,3)])
         
+    def test_get_meta_omits_empty_meta(self):
+        m = main.MatchLookup()
+        match = object()
+        m.add_match(match)
+        m.add_meta(match,(1,1),core.M_NONE)
+        self.assertEquals({}, m.get_meta_for(match))
+        
     def test_get_meta_ignores_other_matches(self):
         m = main.MatchLookup()
         match1 = object()
@@ -235,6 +282,22 @@ class TestMatchLookup(unittest.TestCase):
         m.remove_cooccupants(match1)
         self.assertTrue( match2 in m.get_all_matches() )
         
+    def test_remove_cooccupants_removes_occupants_of_every_position(self):
+        m = main.MatchLookup()
+        match1 = object()
+        m.add_match(match1)
+        m.add_meta(match1,(2,2),core.M_OCCUPIED)
+        m.add_meta(match1,(2,3),core.M_OCCUPIED)
+        match2 = object()
+        m.add_match(match2)
+        m.add_meta(match2,(2,3),core.M_OCCUPIED)
+        match3 = object()
+        m.add_match(match3)
+        m.add_meta(match3,(2,4),core.M_OCCUPIED)
+        m.remove_cooccupants(match1)
+        self.assertEquals([match3], m.get_all_matches())
+        self.assertEquals([], m.get_occupants_at((2,3)))
+        
     def test_remove_cooccupants_allows_non_existant_match(self):
         m = main.MatchLookup()
         match = object()
@@ -1114,6 +1177,339 @@ class TestProcessDiagram(unittest.TestCase):
         result = main.process_diagram("a a",[MetaMatchingPattern]).content
         self.assertEquals(2, len(result))        
         
+    def test_only_creates_matches_at_start_key_cells(self):
+        class KeyedPattern(object):
+            insts = []
+            @classmethod
+            def start_key(cls):
+                return core.StartKey(chars="b",offset=1,meta=core.M_NONE,nometa=core.M_NONE)
+            def __init__(self):
+                KeyedPattern.insts.append(self)
+                self.positions = []
+            def test(self,curr):
+                self.positions.append((curr.col,curr.row))
+                raise core.PatternRejected()
+            def render(self):
+                return []
+        main.process_diagram("abab\nb",[KeyedPattern])
+        self.assertEquals([[(0,0)],[(2,0)],[(4,0)]],[p.positions for p in KeyedPattern.insts])
+        
+    def test_start_key_meta_excludes_cells_claimed_by_previous_patterns(self):
+        class OccupyingPattern(object):
+            i = 0
+            def test(self,curr):
+                if self.i >= 1: raise StopIteration()
+                self.i += 1
+                if curr.char != "a": raise core.PatternRejected()
+                return core.M_OCCUPIED
+            def render(self):
+                return []
+        class KeyedPattern(object):
+            insts = []
+            @classmethod
+            def start_key(cls):
+                return core.StartKey(chars=None,offset=0,meta=core.M_NONE,nometa=core.M_OCCUPIED)
+            def __init__(self):
+                KeyedPattern.insts.append(self)
+            def test(self,curr):
+                self.char = curr.char
+                raise core.PatternRejected()
+            def render(self):
+                return []
+        main.process_diagram("ab",[OccupyingPattern,KeyedPattern])
+        self.assertEquals([core.START_OF_INPUT,"b","\n",core.END_OF_INPUT],
+            [p.char for p in KeyedPattern.insts])
+        
+    def test_doesnt_resume_waiting_pattern_before_its_position(self):
+        class WaitingPattern(object):
+            insts = []
+            waitpos = None
+            def __init__(self):
+                WaitingPattern.insts.append(self)
+                self.positions = []
+            def test(self,curr):
+                self.positions.append((curr.col,curr.row))
+                if len(self.positions) >= 2: raise core.PatternRejected()
+                if curr.char != "a": raise core.PatternRejected()
+                self.waitpos = (1,1)
+                return core.M_NONE
+            def render(self):
+                return []
+        main.process_diagram("abc\nabc",[WaitingPattern])
+        self.assertEquals([(0,0),(1,1)],WaitingPattern.insts[1].positions)
+        self.assertEquals([(0,1),(1,1)],WaitingPattern.insts[5].positions)
+        
+    def test_resumes_waiting_pattern_at_next_row_if_position_missing(self):
+        class WaitingPattern(object):
+            insts = []
+            waitpos = None
+            def __init__(self):
+                WaitingPattern.insts.append(self)
+                self.positions = []
+            def test(self,curr):
+                self.positions.append((curr.col,curr.row))
+                if len(self.positions) >= 2: raise core.PatternRejected()
+                if curr.char != "a": raise core.PatternRejected()
+                self.waitpos = (5,0)
+                return core.M_NONE
+            def render(self):
+                return []
+        main.process_diagram("ab\nc",[WaitingPattern])
+        self.assertEquals([(0,0),(0,1)],WaitingPattern.insts[1].positions)
+        
+    def test_resumes_waiting_pattern_at_end_of_input(self):
+        class WaitingPattern(object):
+            insts = []
+            waitpos = None
+            def __init__(self):
+                WaitingPattern.insts.append(self)
+                self.chars = []
+            def test(self,curr):
+                self.chars.append(curr.char)
+                if curr.char == core.END_OF_INPUT: raise StopIteration()
+                if curr.char != "a": raise core.PatternRejected()
+                self.waitpos = (3,5)
+                return core.M_NONE
+            def render(self):
+                return [ self ]
+        result = main.process_diagram("ab",[WaitingPattern]).content
+        self.assertEquals(["a",core.END_OF_INPUT],WaitingPattern.insts[1].chars)
+        self.assertTrue( WaitingPattern.insts[1] in result )
+        
+    def test_uses_step_method_where_available(self):
+        r = object()
+        class SteppingPattern(object):
+            i = 0
+            def step(self,curr):
+                if self.i >= 1: return core.FINISHED
+                self.i += 1
+                if curr.char != "a": return core.REJECTED
+                return core.M_OCCUPIED
+            def render(self):
+                return [ r ]
+        result = main.process_diagram("abca",[SteppingPattern]).content
+        self.assertEquals([r,r],result)
+        
+    def test_skips_pattern_whose_needed_characters_are_absent(self):
+        class NeedyPattern(object):
+            insts = []
+            @classmethod
+            def needs(cls):
+                return "+|"
+            def __init__(self):
+                NeedyPattern.insts.append(self)
+            def test(self,curr):
+                raise core.PatternRejected()
+            def render(self):
+                return []
+        main.process_diagram("+--+\n+--+",[NeedyPattern])
+        self.assertEquals(0,len(NeedyPattern.insts))
+        main.process_diagram("+--+\n|  |",[NeedyPattern])
+        self.assertTrue( len(NeedyPattern.insts) > 0 )
+        
+    def test_skips_pattern_whose_start_characters_are_absent(self):
+        class KeyedPattern(object):
+            insts = []
+            @classmethod
+            def start_key(cls):
+                return core.StartKey(chars="xy",offset=0,meta=core.M_NONE,nometa=core.M_NONE)
+            def __init__(self):
+                KeyedPattern.insts.append(self)
+            def test(self,curr):
+                raise core.PatternRejected()
+            def render(self):
+                return []
+        main.process_diagram("abc\ndef",[KeyedPattern])
+        self.assertEquals(0,len(KeyedPattern.insts))
+        
+    def test_finds_start_key_cells_on_several_rows(self):
+        class KeyedPattern(object):
+            insts = []
+            @classmethod
+            def start_key(cls):
+                return core.StartKey(chars="yx",offset=0,meta=core.M_NONE,nometa=core.M_NONE)
+            def __init__(self):
+                KeyedPattern.insts.append(self)
+                self.positions = []
+            def test(self,curr):
+                self.positions.append((curr.col,curr.row))
+                raise core.PatternRejected()
+            def render(self):
+                return []
+        main.process_diagram("yax\n\nbbb\naxy",[KeyedPattern])
+        self.assertEquals([[(0,0)],[(2,0)],[(1,3)],[(2,3)]],
+            [p.positions for p in KeyedPattern.insts])
+        
+    def test_limits_matches_in_progress(self):
+        class NeverendingPattern(object):
+            insts = []
+            def __init__(self):
+                NeverendingPattern.insts.append(self)
+            def test(self,curr):
+                return core.M_NONE
+            def render(self):
+                return []
+        main.process_diagram("abcdef",[NeverendingPattern],maxlive=3)
+        self.assertEquals(3,len(NeverendingPattern.insts))
+        
+    def test_starts_matches_again_when_below_limit(self):
+        class ShortPattern(object):
+            insts = []
+            def __init__(self):
+                ShortPattern.insts.append(self)
+                self.positions = []
+            def test(self,curr):
+                self.positions.append((curr.col,curr.row))
+                if len(self.positions) > 2: raise StopIteration()
+                return core.M_NONE
+            def render(self):
+                return []
+        main.process_diagram("abcdef",[ShortPattern],maxlive=2)
+        self.assertEquals([(0,-1),(0,0),(2,0),(3,0),(5,0),(6,0)],
+            [p.positions[0] for p in ShortPattern.insts])
+        
+    def test_limit_shared_across_passes(self):
+        text = "+--+ +--+ .-. \n|  | |  | | | \n+--+ +--+ '-' \n"*3
+        for maxlive in [1,2,3]:
+            # the budget counts the matches in progress in all of the passes
+            main.process_diagram(text,patterns.PATTERNS,maxlive=maxlive,
+                budget=main.Budget(live=maxlive))
+                
+    def test_limit_applies_to_group_passes(self):
+        text = "+--+ --- |\n|  | <-> |\n+--+ a b |\n"
+        self.assertEquals([],main.process_diagram(text,patterns.PATTERNS,
+            maxlive=0).content)
+        self.assertEquals([],main.DiagramStream(text.splitlines(True),
+            patterns.PATTERNS,maxlive=0).diagram().content)
+        
+    def test_doesnt_limit_matches_by_default(self):
+        class NeverendingPattern(object):
+            insts = []
+            def __init__(self):
+                NeverendingPattern.insts.append(self)
+            def test(self,curr):
+                return core.M_NONE
+            def render(self):
+                return []
+        main.process_diagram("abcdef",[NeverendingPattern])
+        self.assertEquals(9,len(NeverendingPattern.insts))
+        
+    def test_later_pattern_sees_meta_of_match_completing_rows_later(self):
+        class LongPattern(core.Pattern):
+            @classmethod
+            def start_key(cls):
+                return core.StartKey(chars="a",offset=0,meta=core.M_NONE,nometa=core.M_NONE)
+            def matcher(self):
+                self.curr = yield
+                self.curr = yield core.M_BOX_START_E
+                for meta in self.await_pos((0,2)):
+                    self.curr = yield meta
+                yield core.FINISHED
+            def render(self):
+                return []
+        class MetaStoringPattern(object):
+            metas = {}
+            def test(self,curr):
+                MetaStoringPattern.metas[(curr.col,curr.row)] = curr.meta
+                raise StopIteration()
+            def render(self):
+                return []
+        main.process_diagram("a\nb\nc",[LongPattern,MetaStoringPattern])
+        self.assertEquals(core.M_BOX_START_E,MetaStoringPattern.metas[(0,0)])
+        self.assertEquals(core.M_NONE,MetaStoringPattern.metas[(0,1)])
+        
+    def test_outputs_matches_in_pattern_order(self):
+        class LongPattern(core.Pattern):
+            @classmethod
+            def start_key(cls):
+                return core.StartKey(chars="a",offset=0,meta=core.M_NONE,nometa=core.M_NONE)
+            def matcher(self):
+                self.curr = yield
+                for meta in self.await_pos((0,2)):
+                    self.curr = yield meta
+                yield core.FINISHED
+            def render(self):
+                return ["long"]
+        class ShortPattern(core.Pattern):
+            @classmethod
+            def start_key(cls):
+                return core.StartKey(chars="b",offset=0,meta=core.M_NONE,nometa=core.M_NONE)
+            def matcher(self):
+                self.curr = yield
+                yield core.FINISHED
+            def render(self):
+                return ["short"]
+        result = main.process_diagram("ab\nb\nc",[LongPattern,ShortPattern]).content
+        self.assertEquals(["long","short","short"],result)
+        
+    def test_same_result_with_several_processes(self):
+        class OccupyingPattern(object):
+            def __init__(self):
+                self.positions = []
+            def test(self,curr):
+                if curr.meta & core.M_OCCUPIED: raise core.PatternRejected()
+                self.positions.append((curr.col,curr.row))
+                if len(self.positions) == 2: raise StopIteration()
+                return core.M_OCCUPIED
+            def render(self):
+                return [ tuple(self.positions) ]
+        class SecondPattern(OccupyingPattern): pass
+        class ThirdPattern(OccupyingPattern): pass
+        text = "abc\n\nde\nf\n"
+        patterns = [OccupyingPattern,SecondPattern,ThirdPattern]
+        expected = main.process_diagram(text,patterns).content
+        for processes in (2,3,4):
+            self.assertEquals(expected,main.process_diagram(text,patterns,
+                processes=processes).content)
+                
+    def test_reports_progress_with_several_processes(self):
+        class StubPattern(object):
+            def test(self,curr): raise StopIteration
+            def render(self): return []
+        reporter = mock.Mock()
+        main.process_diagram("aaaa",[StubPattern]*5,reporter,processes=2)
+        self.assertEquals(((0.0,),{}),reporter.call_args_list[0])
+        self.assertEquals(((1.0,),{}),reporter.call_args_list[-1])
+        
+    def test_raises_error_from_other_process(self):
+        class StubPattern(object):
+            def test(self,curr): raise StopIteration
+            def render(self): return []
+        class BrokenPattern(object):
+            def test(self,curr): raise ValueError()
+            def render(self): return []
+        self.assertRaises(ValueError,main.process_diagram,"aaaa",
+            [StubPattern,BrokenPattern,StubPattern],processes=3)
+            
+    def test_raises_error_when_other_process_dies(self):
+        class StubPattern(object):
+            def test(self,curr): raise StopIteration
+            def render(self): return []
+        class DyingPattern(object):
+            def test(self,curr): os._exit(1)
+            def render(self): return []
+        self.assertRaises(RuntimeError,main.process_diagram,"aaaa",
+            [StubPattern,DyingPattern,StubPattern],processes=3)
+        
+    def test_same_result_for_regions_in_several_processes(self):
+        text = "+--+\n|  |\n+--+\n\n\n--->\n\n\n\n .-.\n'-'\n"
+        expected = main.process_diagram(text,patterns.PATTERNS).content
+        self.assertEquals(expected,main.process_diagram(text,patterns.PATTERNS,
+            processes=2).content)
+        
+    def test_regions_of_local_patterns_in_several_processes(self):
+        class LocalPattern(object):
+            def test(self,curr):
+                if not isinstance(curr.char,basestring) or not curr.char.isalpha():
+                    raise core.PatternRejected()
+                self.pos = curr.col,curr.row
+                raise StopIteration()
+            def render(self):
+                return [self.pos]
+        text = "ab\n\n\n\nc\n\n\n\nd"
+        self.assertEquals(main.process_diagram(text,[LocalPattern]).content,
+            main.process_diagram(text,[LocalPattern],processes=2).content)
+        
     def test_reports_progress(self):
         class StubPattern(object):
             def test(self,curr): raise StopIteration
@@ -1149,5 +1545,1073 @@ class TestProcessDiagram(unittest.TestCase):
             self.assertTrue( args[0][0] > last )
             last = args[0][0]
         
+class TestDiagramStream(unittest.TestCase):
+
+    TEXT = "+--+\n|  |\n+--+\n\n--->\n .-.\n'-'\nfoo bar\n"
+
+    def test_same_diagram_as_whole_text(self):
+        expected = main.process_diagram(self.TEXT,patterns.PATTERNS)
+        stream = main.DiagramStream(self.TEXT.splitlines(True),patterns.PATTERNS)
+        self.assertEquals(expected,stream.diagram())
+
+    def test_iterates_over_same_content(self):
+        expected = main.process_diagram(self.TEXT,patterns.PATTERNS).content
+        stream = main.DiagramStream(self.TEXT.splitlines(True),patterns.PATTERNS)
+        self.assertEquals(sorted(map(repr,expected)),sorted(map(repr,list(stream))))
+
+    def test_keeps_blank_lines_without_newlines(self):
+        text = "a\n\n\nb\n\n+-+\n| |\n+-+"
+        expected = main.process_diagram(text,patterns.PATTERNS)
+        stream = main.DiagramStream(text.splitlines(),patterns.PATTERNS)
+        self.assertEquals(expected,stream.diagram())
+        self.assertEquals((3,8),stream.size)
+
+    def test_drops_finished_matches_while_streaming(self):
+        alive = []
+        def lines():
+            for i in range(3000):
+                if i % 1000 == 999:
+                    gc.collect()
+                    alive.append(len(TrackedLinePattern.instances))
+                yield "- - -\n"
+        TrackedLinePattern.instances = weakref.WeakSet()
+        stream = main.DiagramStream(lines(),[TrackedLinePattern])
+        self.assertEquals(9000,len(list(stream)))
+        self.assertTrue(max(alive) < 100,alive)
+
+    def test_size_set_once_exhausted(self):
+        stream = main.DiagramStream(["abc\n","de\n"],patterns.PATTERNS)
+        list(stream)
+        self.assertEquals((3,2),stream.size)
+
+    def test_yields_match_before_rest_is_read(self):
+        def lines():
+            yield "---\n"
+            yield "\n\n\n"
+            raise ValueError()
+        stream = iter(main.DiagramStream(lines(),patterns.PATTERNS))
+        self.assertTrue( isinstance(stream.next(),core.Line) )
+
+    def test_waiting_pattern_resumed_on_later_row(self):
+        class WaitingPattern(core.Pattern):
+            def matcher(self):
+                self.curr = yield
+                if self.curr.char != "a": yield core.REJECTED
+                self.pos = self.curr.col,self.curr.row
+                for meta in self.await_pos((1,2)):
+                    self.curr = yield meta
+                self.end = self.curr.col,self.curr.row
+                yield core.FINISHED
+            def render(self):
+                return [(self.pos,self.end)]
+        stream = main.DiagramStream(["a\n","bc\n","de\n"],[WaitingPattern])
+        self.assertEquals([((0,0),(1,2))],list(stream))
+        
+
+class TestUpdateDiagram(unittest.TestCase):
+
+    TEXT = "+--+\n|  |\n+--+\n\n\n--->\n"
+
+    def test_first_version_same_as_whole_text(self):
+        d,state,delta = main.update_diagram(None,self.TEXT,patterns.PATTERNS)
+        self.assertEquals(main.process_diagram(self.TEXT,patterns.PATTERNS),d)
+        
+    def test_first_version_delta_adds_everything(self):
+        d,state,delta = main.update_diagram(None,self.TEXT,patterns.PATTERNS)
+        self.assertEquals([],delta.removed)
+        self.assertEquals(sorted(d.content),sorted(delta.added))
+        
+    def test_unchanged_text_has_empty_delta(self):
+        d,state,delta = main.update_diagram(None,self.TEXT,patterns.PATTERNS)
+        d2,state2,delta = main.update_diagram(state,self.TEXT,patterns.PATTERNS)
+        self.assertEquals(d,d2)
+        self.assertEquals(main.Delta([],[]),delta)
+        
+    def test_only_rows_around_change_matched_again(self):
+        text = "-\n"*40
+        d,state,delta = main.update_diagram(None,text,[CountingTextPattern])
+        CountingTextPattern.count = 0
+        text = "-\n"*20 + "a\n" + "-\n"*19
+        d2,state2,delta = main.update_diagram(state,text,[CountingTextPattern])
+        self.assertTrue(CountingTextPattern.count <= 2*main.UPDATE_CONTEXT)
+        self.assertEquals(main.process_diagram(text,[CountingTextPattern]),d2)
+        
+    def test_rows_below_inserted_row_moved(self):
+        d,state,delta = main.update_diagram(None,self.TEXT,patterns.PATTERNS)
+        text = "foo\n" + self.TEXT
+        d2,state2,delta = main.update_diagram(state,text,patterns.PATTERNS)
+        self.assertEquals(main.process_diagram(text,patterns.PATTERNS),d2)
+        
+    def test_content_below_unchanged_row_not_matched_again(self):
+        text = "-\n"*40
+        d,state,delta = main.update_diagram(None,text,[CountingTextPattern])
+        CountingTextPattern.count = 0
+        text = "a\n" + text[2:]
+        d2,state2,delta = main.update_diagram(state,text,[CountingTextPattern])
+        self.assertTrue(CountingTextPattern.count <= main.UPDATE_CONTEXT)
+        self.assertEquals(main.process_diagram(text,[CountingTextPattern]),d2)
+        
+    def test_edits_at_several_rows_same_as_whole_text(self):
+        text = ("\n"*6 + "+---+\n|   |--->\n+---+\n\n  o---*\n  |\n  v  foo\n"
+            "\n+-----+\n| bar |\n+-----+\n   ^\n   |\n")
+        d,state,delta = main.update_diagram(None,text,patterns.PATTERNS)
+        rows = text.splitlines(True)
+        for i in (0,3,6,7,10,13,15,18):
+            for edited in (rows[:i]+["x-x\n"]+rows[i+1:], 
+                    rows[:i]+["\n"]+rows[i:], rows[:i]+rows[i+1:]):
+                edited = "".join(edited)
+                d2,state2,delta = main.update_diagram(state,edited,
+                    patterns.PATTERNS)
+                self.assertEquals(main.process_diagram(edited,patterns.PATTERNS),d2)
+                content = list(d.content)
+                for s in delta.removed:
+                    content.remove(s)
+                self.assertEquals(sorted(d2.content),sorted(content+delta.added))
+        
+    def test_box_across_change_matched_again(self):
+        text = "+--+\n|  |\n|  |\n|  |\n|  |\n+--+\n"
+        d,state,delta = main.update_diagram(None,text,patterns.PATTERNS)
+        text = text.replace("+--+\n","+- +\n",1)
+        d2,state2,delta = main.update_diagram(state,text,patterns.PATTERNS)
+        self.assertEquals(main.process_diagram(text,patterns.PATTERNS),d2)
+        
+    def test_changed_text_same_as_whole_text(self):
+        d,state,delta = main.update_diagram(None,self.TEXT,patterns.PATTERNS)
+        text = self.TEXT.replace("--->","<-->")
+        d2,state2,delta = main.update_diagram(state,text,patterns.PATTERNS)
+        self.assertEquals(main.process_diagram(text,patterns.PATTERNS),d2)
+        
+    def test_delta_gives_changed_shapes(self):
+        d,state,delta = main.update_diagram(None,self.TEXT,patterns.PATTERNS)
+        text = self.TEXT.replace("--->","---")
+        d2,state2,delta = main.update_diagram(state,text,patterns.PATTERNS)
+        self.assertEquals([s for s in d.content if s not in d2.content],delta.removed)
+        self.assertEquals([s for s in d2.content if s not in d.content],delta.added)
+        
+    def test_different_patterns_matched_again(self):
+        text = "-\n"*10
+        d,state,delta = main.update_diagram(None,text,[CountingLinePattern])
+        CountingLinePattern.count = 0
+        d2,state2,delta = main.update_diagram(state,text,
+            [CountingLinePattern,CountingPlusPattern])
+        self.assertEquals(10,CountingLinePattern.count)
+        
+
+class CountingLinePattern(core.Pattern):
+    
+    count = 0
+    
+    def __init__(self):
+        core.Pattern.__init__(self)
+        type(self).count += 1
+        
+    @classmethod
+    def start_key(cls):
+        return core.StartKey(chars="-",offset=0,meta=core.M_NONE,nometa=core.M_OCCUPIED)
+        
+    def matcher(self):
+        self.curr = yield
+        self.pos = self.curr.col,self.curr.row
+        self.curr = yield core.M_OCCUPIED
+        yield core.FINISHED
+        
+    def render(self):
+        return [("line",self.pos)]
+        
+        
+class TrackedLinePattern(CountingLinePattern):
+
+    instances = None
+    
+    def __init__(self):
+        CountingLinePattern.__init__(self)
+        type(self).instances.add(self)
+        
+        
+class CountingPlusPattern(CountingLinePattern):
+
+    @classmethod
+    def start_key(cls):
+        return core.StartKey(chars="+",offset=0,meta=core.M_NONE,nometa=core.M_OCCUPIED)
+        
+    def render(self):
+        return [("plus",self.pos)]
+        
+        
+class CountingTextPattern(CountingLinePattern):
+
+    def render(self):
+        return [core.Text(pos=self.pos,z=0,text="-",colour=core.C_FOREGROUND,
+            alpha=1.0,size=1)]
+
+
+def rejecting_at_left(base):
+    """Returns a subclass of the pattern class with a matcher of its own, which
+    rejects the matches it would begin at the left edge"""
+    class LeftRejectingPattern(base):
+        def matcher(self):
+            inner = base.matcher(self)
+            inner.next()
+            self.curr = yield
+            if self.curr.col == 0: yield core.REJECTED
+            result = inner.send(self.curr)
+            while True:
+                result = inner.send((yield result))
+    LeftRejectingPattern.__name__ = "LeftRejecting" + base.__name__
+    return LeftRejectingPattern
+    
+
+class TestPassCache(unittest.TestCase):
+
+    TEXT = "+--+\n|  |\n+--+\n\n--->\n"
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = main.PassCache(self.dir)
+        
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        
+    def test_same_result_as_without_cache(self):
+        expected = main.process_diagram(self.TEXT,patterns.PATTERNS)
+        self.assertEquals(expected,main.process_diagram(self.TEXT,patterns.PATTERNS,
+            cache=self.cache))
+        self.assertEquals(expected,main.process_diagram(self.TEXT,patterns.PATTERNS,
+            cache=self.cache))
+            
+    def test_cached_passes_not_run_again(self):
+        main.process_diagram(self.TEXT,[CountingLinePattern],cache=self.cache)
+        CountingLinePattern.count = 0
+        main.process_diagram(self.TEXT,[CountingLinePattern],cache=self.cache)
+        self.assertEquals(0,CountingLinePattern.count)
+        
+    def test_resumes_after_cached_prefix(self):
+        main.process_diagram(self.TEXT,[CountingLinePattern],cache=self.cache)
+        CountingLinePattern.count = 0
+        CountingPlusPattern.count = 0
+        result = main.process_diagram(self.TEXT,[CountingLinePattern,CountingPlusPattern],
+            cache=self.cache)
+        self.assertEquals(0,CountingLinePattern.count)
+        self.assertEquals(4,CountingPlusPattern.count)
+        self.assertEquals(main.process_diagram(self.TEXT,[CountingLinePattern,
+            CountingPlusPattern]),result)
+            
+    def test_loads_only_longest_cached_prefix(self):
+        main.process_diagram(self.TEXT,[CountingLinePattern,CountingPlusPattern],
+            cache=self.cache)
+        keys = self.cache.keys(self.TEXT,[CountingLinePattern,CountingPlusPattern,
+            CountingTextPattern],None)
+        loaded = []
+        load = self.cache.load
+        def recording_load(key):
+            found = load(key)
+            loaded.append((key,found is not None))
+            return found
+        self.cache.load = recording_load
+        result = main.process_diagram(self.TEXT,[CountingLinePattern,
+            CountingPlusPattern,CountingTextPattern],cache=self.cache)
+        self.assertEquals([(keys[2],False),(keys[1],True)],loaded)
+        self.assertEquals(main.process_diagram(self.TEXT,[CountingLinePattern,
+            CountingPlusPattern,CountingTextPattern]),result)
+            
+    def test_different_text_not_cached(self):
+        main.process_diagram(self.TEXT,[CountingLinePattern],cache=self.cache)
+        CountingLinePattern.count = 0
+        main.process_diagram("--",[CountingLinePattern],cache=self.cache)
+        self.assertEquals(2,CountingLinePattern.count)
+        
+    def test_keys_differ_by_patterns_module(self):
+        keys1 = self.cache.keys(self.TEXT,patterns.PATTERNS,None)
+        getsource = inspect.getsource
+        def edited(obj):
+            source = getsource(obj)
+            if obj is patterns:
+                source = source.replace("TEXT_CHARS = ","TEXT_CHARS = \"-\" + ",1)
+            return source
+        with mock.patch("inspect.getsource",edited):
+            keys2 = main.PassCache(self.dir).keys(self.TEXT,patterns.PATTERNS,None)
+        self.assertTrue(all(k1 != k2 for k1,k2 in zip(keys1,keys2)))
+        
+    def test_keys_differ_by_pattern(self):
+        keys1 = self.cache.keys(self.TEXT,[CountingLinePattern,CountingPlusPattern],None)
+        keys2 = self.cache.keys(self.TEXT,[CountingLinePattern,CountingLinePattern],None)
+        self.assertEquals(keys1[0],keys2[0])
+        self.assertNotEquals(keys1[1],keys2[1])
+        
+
+class TestBudget(unittest.TestCase):
+
+    TEXT = "+--+\n|  |\n+--+\n\n--->\n"
+    
+    def over_budget(self,budget,text=TEXT):
+        try:
+            main.process_diagram(text,patterns.PATTERNS,budget=budget)
+        except main.BudgetExceeded as e:
+            return e.budget
+        return None
+    
+    def test_within_budget(self):
+        expected = main.process_diagram(self.TEXT,patterns.PATTERNS)
+        result = main.process_diagram(self.TEXT,patterns.PATTERNS,
+            budget=main.Budget(seconds=60,cells=1000,live=1000,resumes=100000))
+        self.assertEquals(expected,result)
+        self.assertEquals(None,result.exceeded)
+        
+    def test_cells(self):
+        self.assertEquals("cells",self.over_budget(main.Budget(cells=10)))
+        
+    def test_seconds(self):
+        self.assertEquals("seconds",self.over_budget(main.Budget(seconds=-1)))
+        
+    def test_live(self):
+        # boxes side by side, to be matched at once
+        self.assertEquals("live",self.over_budget(main.Budget(live=1),
+            "+--+ +--+\n|  | |  |\n+--+ +--+\n"))
+        
+    def test_resumes(self):
+        self.assertEquals("resumes",self.over_budget(main.Budget(resumes=10)))
+        
+    def test_fallback(self):
+        result = main.process_diagram(self.TEXT,patterns.PATTERNS,
+            budget=main.Budget(resumes=10,fallback=[patterns.LiteralPattern]))
+        self.assertEquals("resumes",result.exceeded)
+        self.assertEquals(main.process_diagram(self.TEXT,[patterns.LiteralPattern]).content,
+            result.content)
+            
+    def test_fallback_patterns_within_budget(self):
+        result = main.process_diagram(self.TEXT,patterns.PATTERNS,
+            budget=main.Budget(resumes=10,fallback=patterns.FALLBACK_PATTERNS))
+        self.assertEquals("resumes",result.exceeded)
+        self.assertTrue(len(result.content) > 0)
+        
+    def test_cells_checked_before_grid_built(self):
+        def no_grid(text):
+            self.fail("grid built")
+        with mock.patch("core.Grid",no_grid):
+            self.assertEquals("cells",self.over_budget(main.Budget(cells=10)))
+            
+    def test_fallback_kept_to_cells(self):
+        self.assertEquals("cells",self.over_budget(main.Budget(cells=10,
+            fallback=patterns.FALLBACK_PATTERNS)))
+            
+    def test_fallback_after_seconds(self):
+        result = main.process_diagram(self.TEXT,patterns.PATTERNS,
+            budget=main.Budget(seconds=1e-9,fallback=[patterns.LiteralPattern]))
+        self.assertEquals("seconds",result.exceeded)
+        self.assertEquals(main.process_diagram(self.TEXT,[patterns.LiteralPattern]).content,
+            result.content)
+            
+    def test_fallback_kept_to_own_seconds(self):
+        budget = main.Budget(seconds=1e-9,fallback=[patterns.LiteralPattern],
+            fallbackseconds=1e-9)
+        try:
+            main.process_diagram(self.TEXT,patterns.PATTERNS,budget=budget)
+            self.fail("budget not exceeded")
+        except main.BudgetExceeded as e:
+            self.assertEquals("seconds",e.budget)
+            self.assertEquals(1e-9,e.limit)
+            self.assertEquals("seconds",e.first.budget)
+            self.assertEquals(1e-9,e.first.limit)
+            self.assertTrue(e.first.value > 0)
+            
+    def test_checked_within_long_row(self):
+        try:
+            main.process_diagram(".-"*20000,patterns.PATTERNS,
+                budget=main.Budget(resumes=100))
+            self.fail("budget not exceeded")
+        except main.BudgetExceeded as e:
+            self.assertEquals("resumes",e.budget)
+            self.assertTrue(e.value < 10*main.BUDGET_INTERVAL,e.value)
+        
+    def test_ignores_processes(self):
+        result = main.process_diagram(self.TEXT,patterns.PATTERNS,processes=2,
+            budget=main.Budget(resumes=100000))
+        self.assertEquals(main.process_diagram(self.TEXT,patterns.PATTERNS),result)
+        
+
+class TestMatchStats(unittest.TestCase):
+
+    TEXT = "+--+\n|  |\n+--+\n\n--->\n"
+    
+    def test_same_result_as_without_stats(self):
+        self.assertEquals(main.process_diagram(self.TEXT,patterns.PATTERNS),
+            main.process_diagram(self.TEXT,patterns.PATTERNS,stats=main.MatchStats()))
+    
+    def test_pass_per_pattern(self):
+        stats = main.MatchStats()
+        main.process_diagram(self.TEXT,patterns.PATTERNS,stats=stats)
+        self.assertEquals([p.__name__ for p in main.pattern_classes(patterns.PATTERNS)],
+            [p.pattern for p in stats.passes])
+            
+    def test_group_counts_by_member(self):
+        stats = main.MatchStats()
+        main.process_diagram("---\n- -\n-\n|\n|",[patterns.LongLinesPattern],stats=stats)
+        bymember = dict((p.pattern,p) for p in stats.passes)
+        self.assertEquals((4,4,3,1),tuple(bymember["LongHorizLinePattern"][2:6]))
+        self.assertEquals(1,bymember["LongVertLinePattern"].completed)
+        self.assertEquals(1,bymember["LongVertLinePattern"].peaklive)
+        self.assertEquals(0,bymember["LongUpDiagLinePattern"].created)
+            
+    def test_counts(self):
+        stats = main.MatchStats()
+        main.process_diagram("a b",[patterns.LiteralPattern],stats=stats)
+        p = stats.passes[0]
+        self.assertEquals(("LiteralPattern",6,8,4,2,2,2),
+            (p.pattern,p.created,p.resumes,p.rejected,p.completed,p.peaklive,p.claimed))
+            
+    def test_rejections(self):
+        stats = main.MatchStats()
+        main.process_diagram("a\nb",[patterns.LongHorizLinePattern],stats=stats)
+        p = stats.passes[0]
+        self.assertEquals(p.created,p.rejected)
+        self.assertEquals(0,p.completed)
+        
+    def test_totals(self):
+        stats = main.MatchStats()
+        main.process_diagram(self.TEXT,patterns.PATTERNS,stats=stats)
+        totals = stats.totals()
+        self.assertEquals(sum(p.resumes for p in stats.passes),totals.resumes)
+        self.assertEquals(max(p.peaklive for p in stats.passes),totals.peaklive)
+        self.assertEquals(len(main.process_diagram(self.TEXT,patterns.PATTERNS).content)>0,
+            totals.completed>0)
+            
+    def test_to_dict(self):
+        stats = main.MatchStats()
+        main.process_diagram("a b",[patterns.LiteralPattern],stats=stats)
+        d = stats.to_dict()
+        self.assertEquals(2,d["passes"][0]["completed"])
+        self.assertEquals(2,d["totals"]["completed"])
+        
+    def test_report(self):
+        stats = main.MatchStats()
+        main.process_diagram("a b",[patterns.LiteralPattern],stats=stats)
+        lines = stats.report().splitlines()
+        self.assertEquals(3,len(lines))
+        self.assertTrue(lines[1].startswith("LiteralPattern"))
+        self.assertTrue(lines[2].startswith("total"))
+        
+    def test_fallback_recorded(self):
+        stats = main.MatchStats()
+        main.process_diagram(self.TEXT,patterns.PATTERNS,stats=stats,
+            budget=main.Budget(resumes=1,fallback=[patterns.LiteralPattern]))
+        self.assertEquals(["LiteralPattern"],[p.pattern for p in stats.passes])
+        
+
+class RejectSitePattern(core.Pattern):
+
+    @classmethod
+    def start_key(cls):
+        return core.StartKey(chars="a",offset=0,meta=core.M_NONE,nometa=core.M_OCCUPIED)
+        
+    def matcher(self):
+        self.curr = yield
+        self.curr = yield core.M_OCCUPIED
+        self.curr = yield core.M_OCCUPIED
+        if self.curr.char == "x":
+            self.reject() # raised
+        for meta in self.await_pos(self.offset(0,1)): # awaited
+            self.curr = yield meta
+        self.curr = yield self.expect("c") # expected
+        yield core.FINISHED
+        
+    def render(self):
+        return []
+        
+        
+class TestRejectProfile(unittest.TestCase):
+
+    def sites(self,text):
+        rejects = main.RejectProfile()
+        main.process_diagram(text,[RejectSitePattern],rejects=rejects)
+        return rejects.sites.get("RejectSitePattern")
+        
+    def site(self,marker,depth):
+        lines,start = inspect.getsourcelines(RejectSitePattern)
+        for i,line in enumerate(lines):
+            if line.rstrip().endswith("# "+marker):
+                return ("maintests.py",start+i,depth)
+
+    def test_same_result_as_without_profile(self):
+        text = "+--+\n|  |\n+--+\n\n--->\n"
+        self.assertEquals(main.process_diagram(text,patterns.PATTERNS),
+            main.process_diagram(text,patterns.PATTERNS,rejects=main.RejectProfile()))
+
+    def test_raised(self):
+        self.assertEquals({self.site("raised",1): {2: 1}},self.sites("abx"))
+        
+    def test_awaited(self):
+        self.assertEquals({self.site("awaited",2): {2: 1}},self.sites("abd"))
+        
+    def test_yielded(self):
+        self.assertEquals({self.site("expected",1): {2: 1}},self.sites("abd\n  e"))
+        
+    def test_not_rejected(self):
+        self.assertEquals(None,self.sites("abd\n  c"))
+        
+    def test_histogram(self):
+        self.assertEquals({self.site("raised",1): {2: 2}},self.sites("abx abx"))
+        
+    def test_past_edge(self):
+        sites = main.RejectProfile()
+        main.process_diagram("+----+\n|    |\n",[patterns.StraightRectangularBoxPattern],
+            rejects=sites)
+        self.assertTrue(any(line is None for f,line,d in 
+            sites.sites["StraightRectangularBoxPattern"]))
+            
+    def test_group_rejections_by_member(self):
+        rejects = main.RejectProfile()
+        stats = main.MatchStats()
+        main.process_diagram("a-b\n-\n/",[patterns.LongLinesPattern,
+            patterns.ShortLinesPattern],rejects=rejects,stats=stats)
+        for p in stats.passes:
+            self.assertEquals(p.rejected,sum(sum(h.values()) 
+                for h in rejects.sites.get(p.pattern,{}).values()))
+        self.assertTrue("ShortHorizLinePattern" in rejects.sites)
+        
+    def test_group_rejections_put_down_to_member_matcher(self):
+        rejects = main.RejectProfile()
+        main.process_diagram("a-b\n-\n/\n+ o\n",[patterns.LongLinesPattern,
+            patterns.ShortLinesPattern,patterns.ConnectorsPattern],rejects=rejects)
+        self.assertNotEquals({},rejects.sites)
+        for name,sites in rejects.sites.items():
+            code = getattr(patterns,name).matcher.im_func.func_code
+            self.assertEquals(set([("patterns.py",code.co_firstlineno,1)]),
+                set(sites))
+            
+    def test_report(self):
+        rejects = main.RejectProfile()
+        main.process_diagram("abx abx abd",[RejectSitePattern],rejects=rejects)
+        lines = rejects.report().splitlines()
+        self.assertEquals("RejectSitePattern",lines[0])
+        self.assertTrue(lines[1].startswith("  maintests.py:%d depth 1: 2 rejected" 
+            % self.site("raised",1)[1]))
+        
+    def test_to_dict(self):
+        rejects = main.RejectProfile()
+        main.process_diagram("abx abx abd",[RejectSitePattern],rejects=rejects)
+        d = rejects.to_dict()["RejectSitePattern"]
+        self.assertEquals([2,1],[s["rejected"] for s in d])
+        self.assertEquals({"2": 2},d[0]["cells"])
+        
+
+class TestActivityMap(unittest.TestCase):
+
+    TEXT = "+--+\n|  |\n+--+\n\n--->\n"
+    
+    def activity(self,text,patternlist):
+        activity = main.ActivityMap()
+        main.process_diagram(text,patternlist,activity=activity)
+        return activity
+        
+    def test_same_result_as_without_map(self):
+        self.assertEquals(main.process_diagram(self.TEXT,patterns.PATTERNS),
+            main.process_diagram(self.TEXT,patterns.PATTERNS,activity=main.ActivityMap()))
+            
+    def test_counts_steps(self):
+        activity = self.activity("a b",[patterns.LiteralPattern])
+        self.assertEquals({"text": 2},activity.counts[(1,0)])
+        self.assertEquals(1,activity.total(0,0))
+        self.assertEquals(0,activity.total(5,5))
+        
+    def test_total_matches_stats(self):
+        stats = main.MatchStats()
+        activity = main.ActivityMap()
+        main.process_diagram(self.TEXT,patterns.PATTERNS,stats=stats,activity=activity)
+        self.assertEquals(stats.totals().resumes,
+            sum(sum(c.values()) for c in activity.counts.values()))
+            
+    def test_families(self):
+        self.assertEquals("box",main.pattern_family(patterns.StraightRectangularBoxPattern))
+        self.assertEquals("line",main.pattern_family(patterns.LongHorizLinePattern))
+        self.assertEquals("connector",main.pattern_family(patterns.RArrowheadPattern))
+        self.assertEquals("text",main.pattern_family(patterns.LiteralPattern))
+        self.assertEquals("other",main.pattern_family(patterns.StickManPattern))
+        
+    def test_csv(self):
+        activity = self.activity("a b\n c",[patterns.LiteralPattern])
+        s = io.BytesIO()
+        activity.write_csv(s)
+        self.assertEquals("1,2,1\n1,1,2\n",s.getvalue())
+        
+    def test_diagram(self):
+        activity = self.activity("a b",[patterns.LiteralPattern])
+        diagram = activity.diagram()
+        self.assertEquals((3,1),diagram.size)
+        rects = [i for i in diagram.content if isinstance(i,core.Rectangle)]
+        texts = [i for i in diagram.content if isinstance(i,core.Text)]
+        self.assertEquals(3,len(rects))
+        self.assertEquals(1.0,max(r.falpha for r in rects))
+        self.assertEquals(["a","b"],sorted(t.text for t in texts))
+        
+
+class TestRenderCache(unittest.TestCase):
+
+    PREFS = main.OutputPrefs((0,0,0),(1,1,1),24)
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = main.RenderCache(self.dir,1000)
+        
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        
+    def test_get_missing(self):
+        self.assertEquals(None,self.cache.get(
+            self.cache.key("--",self.PREFS,main.SvgOutput)))
+            
+    def test_put_then_get(self):
+        key = self.cache.key("--",self.PREFS,main.SvgOutput)
+        self.cache.put(key,"foo")
+        self.assertEquals("foo",self.cache.get(key))
+        
+    def test_same_key_for_same_input(self):
+        self.assertEquals(self.cache.key("--",self.PREFS,main.SvgOutput),
+            self.cache.key("--",main.OutputPrefs((0,0,0),(1,1,1),24),main.SvgOutput))
+            
+    def test_keys_differ_by_text(self):
+        self.assertNotEquals(self.cache.key("--",self.PREFS,main.SvgOutput),
+            self.cache.key("---",self.PREFS,main.SvgOutput))
+            
+    def test_keys_differ_by_prefs(self):
+        keys = set([self.cache.key("--",p,main.SvgOutput) for p in (
+            self.PREFS, main.OutputPrefs((1,0,0),(1,1,1),24),
+            main.OutputPrefs((0,0,0),None,24), main.OutputPrefs((0,0,0),(1,1,1),12) )])
+        self.assertEquals(4,len(keys))
+        
+    def test_keys_differ_by_format(self):
+        self.assertNotEquals(self.cache.key("--",self.PREFS,main.SvgOutput),
+            self.cache.key("--",self.PREFS,main.PngOutput))
+            
+    def test_keys_differ_by_max_matches(self):
+        self.assertEquals(3,len(set([self.cache.key("--",self.PREFS,main.SvgOutput,m)
+            for m in (None,2,3)])))
+            
+    def test_keeps_running_total(self):
+        self.cache.put(self.cache.key("a",self.PREFS,main.SvgOutput),"x"*300)
+        self.cache.put(self.cache.key("b",self.PREFS,main.SvgOutput),"x"*200)
+        self.cache.put(self.cache.key("a",self.PREFS,main.SvgOutput),"x"*100)
+        self.assertEquals(300,self.cache.total())
+        
+    def test_lists_entries_only_when_over_limit(self):
+        walked = []
+        def walk(dir,*args):
+            walked.append(dir)
+            return os_walk(dir,*args)
+        os_walk,main.os.walk = main.os.walk,walk
+        try:
+            for t in ("a","b","c"):
+                self.cache.put(self.cache.key(t,self.PREFS,main.SvgOutput),"x"*400)
+        finally:
+            main.os.walk = os_walk
+        # once to start the total, and once over the limit
+        self.assertEquals(2,walked.count(self.dir))
+        self.assertEquals(800,self.cache.total())
+            
+    def test_removes_least_recently_used(self):
+        keys = [self.cache.key(t,self.PREFS,main.SvgOutput) for t in ("a","b","c")]
+        self.cache.put(keys[0],"x"*400)
+        self.cache.put(keys[1],"x"*400)
+        os.utime(self.cache.path(keys[0]),(1000,1000))
+        os.utime(self.cache.path(keys[1]),(2000,2000))
+        self.cache.put(keys[2],"x"*400)
+        self.assertEquals(None,self.cache.get(keys[0]))
+        self.assertEquals("x"*400,self.cache.get(keys[1]))
+        self.assertEquals("x"*400,self.cache.get(keys[2]))
+        
+    def test_get_marks_as_used(self):
+        keys = [self.cache.key(t,self.PREFS,main.SvgOutput) for t in ("a","b","c")]
+        self.cache.put(keys[0],"x"*400)
+        self.cache.put(keys[1],"x"*400)
+        os.utime(self.cache.path(keys[0]),(1000,1000))
+        os.utime(self.cache.path(keys[1]),(2000,2000))
+        self.cache.get(keys[0])
+        self.cache.put(keys[2],"x"*400)
+        self.assertEquals("x"*400,self.cache.get(keys[0]))
+        self.assertEquals(None,self.cache.get(keys[1]))
+        
+    def test_no_temporary_files_left(self):
+        self.cache.put(self.cache.key("--",self.PREFS,main.SvgOutput),"foo")
+        for dir,dirs,files in os.walk(self.dir):
+            for name in files:
+                self.assertFalse(name.startswith("."))
+                
+
+class TestLineTracer(unittest.TestCase):
+
+    TEXTS = [
+        "+----+\n|    |--->\n+----+\n  |\n  |\n  v",
+        "- - - -\n----\n- - -- -\n-",
+        "|  :  /  \\\n|  ;  /  ,\n|  :  /  `\n  \\ |\n   \\|",
+        "a-b - c|d\n |  ; \n / \\ ,`\n",
+        ".--.\n|  |\n'--'\n  |\n /_\\\n+---+\n|   |\n+---+",
+        "   /\n  /\n /\n/\n\\\n \\\n  \\\n   \\",
+        "|\n\n|\n|  \n -|-\n/ \\",
+    ]
+    
+    def make_pass(self,pclass,text):
+        grid = core.Grid(text)
+        cells,rowstarts = main.scan_cells(grid)
+        return main.make_pass(pclass,grid,cells,rowstarts)
+        
+    def test_same_as_separate_passes(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.process_diagram(text,patterns.PATTERNS))
+                
+    def test_same_when_streamed(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.DiagramStream(text.splitlines(True),patterns.PATTERNS).diagram())
+                
+    def test_same_in_bands(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        text = "\n\n\n".join(self.TEXTS)
+        self.assertEquals(main.process_diagram(text,separate),
+            main.process_diagram(text,patterns.PATTERNS,processes=2))
+                
+    def test_dashed_line_takes_precedence(self):
+        d = main.process_diagram("- - -  --",[patterns.LongLinesPattern])
+        self.assertEquals([core.STROKE_DASHED,core.STROKE_SOLID],
+            [s.stype for s in d.content])
+            
+    def test_short_line_between_text_not_matched(self):
+        d = main.process_diagram("a-b",[patterns.ShortLinesPattern])
+        self.assertEquals([],d.content)
+        
+    def test_pattern_classes(self):
+        self.assertEquals([patterns.LongDownDiagDashedLinePattern,
+                patterns.LongDownDiagLinePattern,patterns.LiteralPattern],
+            main.pattern_classes([patterns.LongLinesPattern,
+                patterns.LiteralPattern])[6:])
+                
+    def test_watermark_held_at_start_of_unfinished_line(self):
+        p = self.make_pass(patterns.LongLinesPattern," \n |\n |\n")
+        p.advance(6)
+        self.assertEquals(4,p.watermark)
+        self.assertEquals([],p.complete_matches)
+        p.advance(10)
+        self.assertEquals(1,len(p.complete_matches))
+        
+    def test_member_which_cant_be_traced(self):
+        class LongVertZigzagPattern(patterns.LongVertLinePattern):
+            startchars = ["|","!"]
+        class ZigzagPattern(patterns.LineGroupPattern):
+            members = [LongVertZigzagPattern]
+        grid = core.Grid("|\n!")
+        cells,rowstarts = main.scan_cells(grid)
+        self.assertRaises(ValueError,main.LineTracerPass,ZigzagPattern,grid,
+            cells,rowstarts)
+        self.assertTrue(isinstance(self.make_pass(ZigzagPattern,"|\n!"),
+            main.ChainedPass))
+        for text in ["|\n!"," !\n |\n\n|\n|"]:
+            self.assertEquals(main.process_diagram(text,[LongVertZigzagPattern]),
+                main.process_diagram(text,[ZigzagPattern]))
+            
+    def test_member_with_own_matcher(self):
+        DashPattern = rejecting_at_left(patterns.ShortHorizLinePattern)
+        class DashesPattern(patterns.LineGroupPattern):
+            members = [DashPattern,patterns.LongHorizLinePattern]
+        self.assertTrue(isinstance(self.make_pass(DashesPattern," -"),
+            main.ChainedPass))
+        for text in [" - -"," - --\n -  -","a - b ---"]:
+            separate = main.process_diagram(text,DashesPattern.members)
+            self.assertEquals(separate,main.process_diagram(text,[DashesPattern]))
+            self.assertEquals(separate,main.DiagramStream(text.splitlines(True),
+                [DashesPattern]).diagram())
+        self.assertEquals(1,len(main.process_diagram(" - -",[DashesPattern]).content))
+        
+    def test_members_built_by_constructor(self):
+        built = []
+        class CountedShortVertLinePattern(patterns.ShortVertLinePattern):
+            def __init__(self):
+                built.append(self)
+                patterns.ShortVertLinePattern.__init__(self)
+        class CountedLinesPattern(patterns.LineGroupPattern):
+            members = [CountedShortVertLinePattern]
+        self.assertTrue(isinstance(self.make_pass(CountedLinesPattern,"|"),
+            main.LineTracerPass))
+        d = main.process_diagram("a\n|\nb\n\n|",[CountedLinesPattern])
+        self.assertEquals(2,len(d.content))
+        self.assertEquals(2,len(built))
+        
+        
+class TestConnectorPass(unittest.TestCase):
+
+    TEXTS = [
+        "+---+\n|   |<---\n+---+\n  ^\n  #\n  v\n  |",
+        "+---+\n|   |>---<|   |\n+---+     +---+",
+        "+---+\n|   |<#>--<>|  |\n+---+       +--+",
+        "  |\n  v\n+---+\n|   |\n+---+\n  ^\n  v\n  |\n  ^\n",
+        "--<|\n--|>\n|>--\n<-- -->\n^\n|\n|\nv",
+        "+--+\n|  |\n+--+\n ^\n v",
+    ]
+    
+    def test_same_as_separate_passes(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.process_diagram(text,patterns.PATTERNS))
+                
+    def test_same_when_streamed(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.DiagramStream(text.splitlines(True),patterns.PATTERNS).diagram())
+                
+    def test_finds_connector_across_rows(self):
+        d = main.process_diagram(self.TEXTS[0],patterns.PATTERNS)
+        self.assertEquals(1,len([s for s in d.content if isinstance(s,core.Polygon)]))
+        
+    def test_member_which_isnt_a_connector(self):
+        class NotConnectorsPattern(patterns.ConnectorGroupPattern):
+            members = [patterns.LiteralPattern]
+        grid = core.Grid("a")
+        cells,rowstarts = main.scan_cells(grid)
+        self.assertRaises(ValueError,main.ConnectorPass,NotConnectorsPattern,
+            grid,cells,rowstarts)
+        self.assertTrue(isinstance(main.make_pass(NotConnectorsPattern,grid,
+            cells,rowstarts),main.ChainedPass))
+        self.assertEquals(main.process_diagram("a b",[patterns.LiteralPattern]),
+            main.process_diagram("a b",[NotConnectorsPattern]))
+            
+    def test_member_with_own_matcher(self):
+        class ArrowsPattern(patterns.ConnectorGroupPattern):
+            members = [rejecting_at_left(patterns.LArrowheadPattern)] \
+                + patterns.ConnectorsPattern.members[1:]
+        grid = core.Grid("<--")
+        cells,rowstarts = main.scan_cells(grid)
+        self.assertTrue(isinstance(main.make_pass(ArrowsPattern,grid,cells,
+            rowstarts),main.ChainedPass))
+        patternlist = [ArrowsPattern if p is patterns.ConnectorsPattern else p 
+            for p in patterns.PATTERNS]
+        separate = main.pattern_classes(patternlist)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.process_diagram(text,patternlist))
+        self.assertNotEquals(main.process_diagram(self.TEXTS[4],patterns.PATTERNS),
+            main.process_diagram(self.TEXTS[4],patternlist))
+            
+    def test_pattern_classes(self):
+        self.assertEquals(patterns.ConnectorsPattern.members,
+            main.pattern_classes([patterns.ConnectorsPattern]))
+        
+        
+class TestBoxPass(unittest.TestCase):
+
+    TEXTS = [
+        "+----------+\n| id |     |\n|----|-----|\n| nm |     |\n+----------+",
+        "+--+--+\n|  |  |\n+--+--+\n|  |  |\n+--+--+",
+        "+- - -+ .- - -.\n;     ; ;     ;\n+- - -+ '- - -'",
+        ".---. /----\\\n'---' |    |\n|   | \\----/\n'---'",
+        "+---.\n|   |_\\\n|     |\n'.__.-'\n+----+\n|    |\n'.__.-'",
+        "  +----+  .\n /    / .' '.\n+----+ <   >\n        '. .'\n          '",
+        "+---+\n|   |\n+---+\n|   |\n+---+\n",
+    ]
+    
+    def test_same_as_separate_passes(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.process_diagram(text,patterns.PATTERNS))
+                
+    def test_same_when_streamed(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.DiagramStream(text.splitlines(True),patterns.PATTERNS).diagram())
+                
+    def test_keeps_separators(self):
+        d = main.process_diagram(self.TEXTS[0],[patterns.BoxesPattern])
+        # a section for each side of both separators, and the box itself
+        self.assertEquals(5,len([s for s in d.content if isinstance(s,core.Rectangle)]))
+        
+    def test_tries_only_top_edges(self):
+        stats = main.MatchStats()
+        main.process_diagram("+---+\n|   |\n+---+",[patterns.BoxesPattern],
+            stats=stats)
+        # the straight and document boxes from the top left corner
+        self.assertEquals(2,sum(p.created for p in stats.passes))
+        
+    def test_member_without_top_edges(self):
+        class NotBoxesPattern(patterns.BoxGroupPattern):
+            members = [patterns.LiteralPattern,patterns.ShortHorizLinePattern]
+        for text in ["a","a - b\n -","- +--+\n  |  |\n  +--+"]:
+            self.assertEquals(main.process_diagram(text,NotBoxesPattern.members),
+                main.process_diagram(text,[NotBoxesPattern]))
+            
+    def test_pattern_classes(self):
+        self.assertEquals(patterns.BoxesPattern.members,
+            main.pattern_classes([patterns.BoxesPattern]))
+        
+        
+class TestTextPass(unittest.TestCase):
+
+    TEXTS = [
+        "a b\n c",
+        "+---+ hello\n| x |  -->\n+---+ world",
+        "  \t  a\n\n\n     b   ",
+        u"caf\xe9 \xa0 x",
+    ]
+    
+    def test_same_as_separate_passes(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.process_diagram(text,patterns.PATTERNS))
+                
+    def test_same_when_streamed(self):
+        separate = main.pattern_classes(patterns.PATTERNS)
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,separate),
+                main.DiagramStream(text.splitlines(True),patterns.PATTERNS).diagram())
+                
+    def test_tries_only_nonblank_cells(self):
+        stats = main.MatchStats()
+        main.process_diagram("a" + " "*1000 + "b\n" + " "*500,
+            [patterns.LiteralsPattern],stats=stats)
+        self.assertEquals(2,stats.passes[0].created)
+        
+    def test_leaves_occupied_cells(self):
+        d = main.process_diagram("--- a",[patterns.LongLinesPattern,
+            patterns.LiteralsPattern])
+        self.assertEquals(["a"],[t.text for t in d.content if isinstance(t,core.Text)])
+        
+    def test_unicode_whitespace(self):
+        d = main.process_diagram(u"a\xa0b",[patterns.LiteralsPattern])
+        self.assertEquals([u"a",u"b"],[t.text for t in d.content 
+            if isinstance(t,core.Text)])
+        
+    def test_member_not_literal(self):
+        class NotLiteralsPattern(patterns.TextGroupPattern):
+            members = [patterns.ShortHorizLinePattern]
+        grid = core.Grid("a - b")
+        cells,rowstarts = main.scan_cells(grid)
+        self.assertRaises(ValueError,main.TextPass,NotLiteralsPattern,grid,
+            cells,rowstarts)
+        self.assertTrue(isinstance(main.make_pass(NotLiteralsPattern,grid,
+            cells,rowstarts),main.ChainedPass))
+        self.assertEquals(main.process_diagram("a - b",[patterns.ShortHorizLinePattern]),
+            main.process_diagram("a - b",[NotLiteralsPattern]))
+            
+    def test_member_with_own_matcher(self):
+        IndentedPattern = rejecting_at_left(patterns.LiteralPattern)
+        class IndentedTextPattern(patterns.TextGroupPattern):
+            members = [IndentedPattern]
+        for text in self.TEXTS:
+            self.assertEquals(main.process_diagram(text,[IndentedPattern]),
+                main.process_diagram(text,[IndentedTextPattern]))
+        self.assertEquals(["b"],[t.text for t in main.process_diagram("a b",
+            [IndentedTextPattern]).content])
+            
+    def test_pattern_classes(self):
+        self.assertEquals([patterns.LiteralPattern],
+            main.pattern_classes([patterns.LiteralsPattern]))
+        
+        
+class TestFindRegions(unittest.TestCase):
+
+    def test_single_region(self):
+        self.assertEquals([(0,3)],main.find_regions(core.Grid("a\nb\nc"),2))
+        
+    def test_splits_at_blank_rows(self):
+        self.assertEquals([(0,4),(4,5)],
+            main.find_regions(core.Grid("a\nb\n\n  \nc"),2))
+            
+    def test_doesnt_split_at_fewer_blank_rows_than_gap(self):
+        self.assertEquals([(0,4)],main.find_regions(core.Grid("a\nb\n\nc"),2))
+        
+    def test_leaves_out_leading_blank_rows(self):
+        self.assertEquals([(2,3)],main.find_regions(core.Grid("\n \na"),2))
+        
+    def test_no_regions_for_blank_diagram(self):
+        self.assertEquals([],main.find_regions(core.Grid(" \n"),2))
+        
+        
+class TestGroupRegions(unittest.TestCase):
+
+    def test_joins_small_regions(self):
+        self.assertEquals([(0,6),(6,10)],
+            main.group_regions([(0,3),(3,6),(6,8),(8,10)],2))
+            
+    def test_leaves_large_regions(self):
+        self.assertEquals([(0,8),(8,10)],main.group_regions([(0,8),(8,10)],4))
+        
+    def test_no_regions(self):
+        self.assertEquals([],main.group_regions([],4))
+        
+
+class TestScanCells(unittest.TestCase):
+
+    def test_cells_in_scan_order(self):
+        grid = core.Grid("ab\n\nc")
+        cells,rowstarts = main.scan_cells(grid)
+        self.assertEquals([0,1,4,5,7,8],rowstarts)
+        self.assertEquals([(-1,0,core.START_OF_INPUT),(0,0,"a"),(0,1,"b"),(0,2,"\n"),
+                (1,0,"\n"),(2,0,"c"),(2,1,"\n"),(3,0,core.END_OF_INPUT)],
+            [cells[k] for k in range(len(cells))])
+            
+    def test_cells_indexed_out_of_order(self):
+        cells,rowstarts = main.scan_cells(core.Grid("ab\ncd"))
+        self.assertEquals((1,1,"d"),cells[5])
+        self.assertEquals((0,0,"a"),cells[1])
+        
+    def test_index_past_end(self):
+        cells,rowstarts = main.scan_cells(core.Grid("ab"))
+        self.assertRaises(IndexError,lambda: cells[5])
+        
+
+class TestPatternPass(unittest.TestCase):
+
+    def make_pass(self,pclass,text):
+        grid = core.Grid(text)
+        cells,rowstarts = [],[]
+        for j,line in enumerate(grid.lines):
+            rowstarts.append(len(cells))
+            for i,char in enumerate(line):
+                cells.append((j-1,i,char))
+        rowstarts.append(len(cells))
+        return main.PatternPass(pclass,grid,cells,rowstarts)
+        
+    def test_advance_processes_cells_before_limit(self):
+        class PosStoringPattern(object):
+            positions = []
+            def test(self,curr):
+                PosStoringPattern.positions.append((curr.col,curr.row))
+                raise StopIteration()
+            def render(self):
+                return []
+        p = self.make_pass(PosStoringPattern,"ab\ncd")
+        p.advance(3)
+        self.assertEquals([(0,-1),(0,0),(1,0)],PosStoringPattern.positions)
+        self.assertEquals(3,p.watermark)
+        
+    def test_watermark_held_at_start_of_match_in_progress(self):
+        class NeverendingPattern(object):
+            first = None
+            def test(self,curr):
+                if self.first is None: self.first = curr.char
+                if self.first != "b": raise StopIteration()
+                return core.M_NONE
+            def render(self):
+                return []
+        p = self.make_pass(NeverendingPattern,"ab\ncd")
+        p.advance(5)
+        self.assertEquals(2,p.watermark)
+        
+    def test_pass_which_cannot_match_is_finished(self):
+        class NeedyPattern(object):
+            @classmethod
+            def needs(cls):
+                return "z"
+            def test(self,curr):
+                raise StopIteration()
+            def render(self):
+                return []
+        p = self.make_pass(NeedyPattern,"ab\ncd")
+        self.assertEquals(8,p.watermark)
+        
+
 if __name__ == "__main__":
     unittest.main()
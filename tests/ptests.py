@@ -24,6 +24,7 @@ OTHER DEALINGS IN THE SOFTWARE.
 """
 
 import unittest
+import random
 import core
 import patterns
 import main
@@ -41,6 +42,32 @@ class PatternTests(object):
         with self.assertRaises(core.PatternStateError):
             p.render()
 
+    def test_start_key_excludes_other_characters(self):
+        key = self.pclass.start_key()
+        if key is None or key.chars is None: return
+        p = self.pclass()
+        feed_input(p,0,0," "*key.offset)
+        char = [c for c in "?@x" if c not in key.chars][0]
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(0,key.offset,char,key.meta))
+            
+    def test_start_key_excludes_missing_meta(self):
+        key = self.pclass.start_key()
+        if key is None or key.meta == core.M_NONE: return
+        p = self.pclass()
+        feed_input(p,0,0," "*key.offset)
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(0,key.offset,key.chars[0],core.M_NONE))
+            
+    def test_start_key_excludes_forbidden_meta(self):
+        key = self.pclass.start_key()
+        if key is None or key.nometa == core.M_NONE: return
+        p = self.pclass()
+        feed_input(p,0,0," "*key.offset)
+        with self.assertRaises(core.PatternRejected):
+            p.test(main.CurrentChar(0,key.offset,key.chars[0] if key.chars else "a",
+                key.meta|key.nometa))
+
     def find_with(self,items,properties,value=None):
         if not isinstance(properties,dict):
             properties = {properties: value}
@@ -64,6 +91,64 @@ class PatternTests(object):
         return l
 
 
+class GroupPassTests(object):
+    """Tests that the pass for a group of the pattern alone matches just as a 
+    pass for the pattern does"""
+    
+    pclass = None
+    
+    FLAGS = [getattr(core,n) for n in dir(core) if n.startswith("M_") 
+        and n not in ("M_NONE","M_OCCUPIED")]
+
+    def test_group_pass_matches_as_pattern(self):
+        groups = [g for g in patterns.PATTERNS if main.is_group(g) 
+            and self.pclass in g.members]
+        if len(groups) == 0: return
+        group = type(groups[0].__name__,(groups[0],),{"members":[self.pclass]})
+        for text,meta in self.group_samples():
+            self.assertEquals(self.match_with(self.pclass,text,meta),
+                self.match_with(group,text,meta),"%r %r" % (text,meta))
+                
+    def group_samples(self):
+        needed = list(self.pclass.needs() or "")
+        for c in needed:
+            yield c,{}
+            yield "a%sb %s\n %s%s" % (c,c,c,c),{}
+        # each flag, and all of them, in every cell around a column of each 
+        # of the characters, and around all of them in turn across and down
+        texts = [" %s \n %s \n %s" % (c,c,c) for c in needed]
+        seq = [c[0] for c in getattr(self.pclass,"chars",None) or needed]
+        if len(seq) > 0:
+            blank = " "*(len(seq)+2)
+            texts += ["\n".join([blank," %s " % "".join(seq),blank]),
+                "\n".join([blank]+[" %s " % c for c in seq]+[blank])]
+        for text in texts:
+            for flag in self.FLAGS + [reduce(lambda a,b: a|b,self.FLAGS)]:
+                yield text,dict(((x,y),flag) for y,line in enumerate(text.split("\n"))
+                    for x in range(len(line)))
+        rand = random.Random(1)
+        chars = needed*3 + [" "," ","a","\n"]
+        for i in range(100):
+            text = "".join(rand.choice(chars) for j in range(rand.randint(1,16)))
+            meta = {}
+            for y,line in enumerate(text.split("\n")):
+                for x in range(len(line)):
+                    if rand.random() < 0.5:
+                        meta[(x,y)] = reduce(lambda a,b: a|b,
+                            rand.sample(self.FLAGS,rand.randint(1,3)))
+                        if rand.random() < 0.2:
+                            meta[(x,y)] |= core.M_OCCUPIED
+            yield text,meta
+        
+    def match_with(self,pclass,text,meta):
+        grid = core.Grid(text)
+        grid.meta.merge(meta)
+        cells,rowstarts = main.scan_cells(grid)
+        p = main.make_pass(pclass,grid,cells,rowstarts)
+        main.run_passes([p],rowstarts,lambda x: None)
+        return sorted(s for m in p.complete_matches for s in m.render()),grid.meta.tostring()
+
+
 def feed_input(pattern,row,col,characters):
     for char in characters:
         pattern.test(main.CurrentChar(row,col,char,core.M_NONE))